@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Profile, Photo, Comment, Like, Notification
+from .models import (Profile, ProfileStats, Photo, PhotoUpload, Comment, Like,
+                     Notification, FollowSuggestion, NotificationOutbox)
 
 
 @admin.register(Profile)
@@ -8,14 +9,33 @@ class ProfileAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'user__email']
 
 
+@admin.register(ProfileStats)
+class ProfileStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'photos_count', 'likes_received',
+                    'comments_received', 'followers_count',
+                    'following_count', 'updated_at']
+    search_fields = ['user__username']
+    readonly_fields = ['updated_at']
+
+
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
-    list_display = ['title', 'owner', 'created_at', 'is_public']
-    list_filter = ['is_public', 'created_at']
+    list_display = ['title', 'owner', 'created_at', 'is_public', 'status']
+    list_filter = ['is_public', 'status', 'created_at']
     search_fields = ['title', 'description', 'owner__username']
     date_hierarchy = 'created_at'
 
 
+@admin.register(PhotoUpload)
+class PhotoUploadAdmin(admin.ModelAdmin):
+    list_display = ['photo', 'spool_name', 'attempts', 'available_at',
+                    'created_at']
+    list_filter = ['photo__status']
+    search_fields = ['photo__title', 'spool_name', 'last_error']
+    raw_id_fields = ['photo']
+    readonly_fields = ['created_at']
+
+
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ['photo', 'author', 'created_at', 'text']
@@ -43,3 +63,20 @@ class NotificationAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return (super().get_queryset(request)
                 .select_related('recipient', 'sender', 'photo'))
+
+
+@admin.register(FollowSuggestion)
+class FollowSuggestionAdmin(admin.ModelAdmin):
+    list_display = ['user', 'suggested', 'score', 'mutual_follows',
+                    'shared_likes', 'computed_at']
+    search_fields = ['user__username', 'suggested__username']
+    raw_id_fields = ['user', 'suggested']
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ['idempotency_key', 'notification_type', 'recipient_id',
+                    'attempts', 'available_at', 'failed', 'created_at']
+    list_filter = ['failed', 'notification_type']
+    search_fields = ['idempotency_key', 'last_error']
+    readonly_fields = ['created_at']
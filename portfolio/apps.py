@@ -7,3 +7,4 @@ class PortfolioConfig(AppConfig):
 
     def ready(self):
         import portfolio.models  # noqa: F401
+        import portfolio.signals  # noqa: F401
@@ -0,0 +1,208 @@
+"""
+Uploading a whole shoot at once: many image files, or zip archives of them.
+
+The bulk view streams request bodies to temporary files (never memory) and
+``bulk_upload`` walks them one at a time: each file, or each archive member
+copied out chunk by chunk, is checked for extension, size and a readable
+image header, and valid ones are handed straight to a thread pool of
+``BULK_UPLOAD_WORKERS`` that sends them to storage while the next file is
+checked. Every stored photo is then created with one ``bulk_create``; if
+that fails, the stored files are deleted again. Because ``bulk_create``
+skips the ``Photo`` signal handlers, the photos are published here with
+``uploads.photos_published`` and one Following-timeline fan-out, and
+followers get a single "new photos" notification for the batch.
+
+The result lists every file with its status: ``created`` (with the new
+photo id), ``invalid`` (rejected before upload) or ``failed`` (storage
+error).
+"""
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from PIL import Image
+
+from . import direct_uploads, images, timeline, uploads
+from .models import Photo
+from .outbox import enqueue_upload_fanout
+
+CREATED = 'created'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+# Copy buffer for archive members
+CHUNK_SIZE = 64 * 1024
+
+
+def title_from_name(name):
+    """'IMG_2041-harbour.jpg' -> 'IMG 2041 harbour'."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    title = ' '.join(stem.replace('_', ' ').replace('-', ' ').split())
+    if len(title) < 3:
+        title = f'Photo {title}'.strip()
+    return title[:255]
+
+
+def _format(name):
+    return os.path.splitext(name)[1].lstrip('.').lower()
+
+
+def _check(fileobj, size):
+    """The reason an extracted file cannot be uploaded, or ``None``."""
+    if size > settings.UPLOAD_MAX_BYTES:
+        return 'File size too large'
+    try:
+        # Reads the header and checks the structure without decoding pixels
+        with Image.open(fileobj) as image:
+            image.verify()
+    except Exception:
+        return 'Not a readable image'
+    finally:
+        fileobj.seek(0)
+    return None
+
+
+def _extract(zf, info):
+    """Copy one archive member to a temporary file, chunk by chunk."""
+    spooled = tempfile.TemporaryFile()
+    size = 0
+    with zf.open(info) as member:
+        # Bounded even if the member's declared size lies
+        while size <= settings.UPLOAD_MAX_BYTES and (
+                chunk := member.read(CHUNK_SIZE)):
+            spooled.write(chunk)
+            size += len(chunk)
+    spooled.seek(0)
+    return spooled, size
+
+
+def _members(archive):
+    """Yield ``(name, declared size, opener)`` for the files in a zip."""
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        yield archive.name, archive.size, None
+        return
+    with zf:
+        for info in zf.infolist():
+            base = os.path.basename(info.filename)
+            if (info.is_dir() or not base or base.startswith('.')
+                    or info.filename.startswith('__MACOSX/')):
+                continue
+            yield (info.filename, info.file_size,
+                   lambda info=info: _extract(zf, info))
+
+
+def iter_files(uploads):
+    """
+    Yield ``(name, size, opener)`` for uploaded files and archive members.
+
+    ``opener()`` returns ``(file, size)``; archive members are only
+    extracted when it is called. It is ``None`` for unreadable archives.
+    """
+    for upload in uploads:
+        if _format(upload.name) == 'zip':
+            yield from _members(upload)
+        else:
+            yield upload.name, upload.size, (
+                lambda upload=upload: (upload, upload.size))
+
+
+def bulk_upload(owner, uploads, is_public=True, workers=None, store=None):
+    """
+    Validate, store and create photos for ``uploads``.
+
+    ``store(fileobj, public_id, image_format)`` defaults to
+    ``direct_uploads.upload_file``. Returns one result dict per file, in
+    upload order, with ``name``, ``status`` and ``photo_id`` or ``error``.
+    """
+    store = store or direct_uploads.upload_file
+    workers = workers or settings.BULK_UPLOAD_WORKERS
+
+    def transfer(result, fileobj):
+        try:
+            return store(fileobj, direct_uploads.new_public_id(owner),
+                         _format(result['name']))
+        except Exception as exc:
+            result['status'] = FAILED
+            result['error'] = f'{type(exc).__name__}: {exc}'
+            return None
+        finally:
+            fileobj.close()
+
+    results, queued = [], []
+    # Files are validated one by one in this thread while earlier ones are
+    # already being transferred by the pool
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for name, size, opener in iter_files(uploads):
+            result = {'name': name, 'status': INVALID}
+            results.append(result)
+            # Cheap checks first, so rejected members are not extracted
+            if opener is None:
+                result['error'] = 'Not a readable zip archive'
+            elif len(results) > settings.BULK_UPLOAD_MAX_FILES:
+                result['error'] = (
+                    f'More than {settings.BULK_UPLOAD_MAX_FILES} files in '
+                    'one upload')
+            elif _format(name) not in direct_uploads.ALLOWED_FORMATS:
+                result['error'] = 'Not a JPEG, PNG, GIF or WebP file'
+            elif size > settings.UPLOAD_MAX_BYTES:
+                result['error'] = 'File size too large'
+            else:
+                fileobj, size = opener()
+                result['error'] = _check(fileobj, size)
+                if result['error']:
+                    fileobj.close()
+                else:
+                    del result['error']
+                    queued.append(
+                        (result, pool.submit(transfer, result, fileobj)))
+        stored = [future.result() for _, future in queued]
+
+    photos, created = [], []
+    for (result, _), image in zip(queued, stored):
+        if image is None:
+            continue
+        photo = Photo(owner=owner, image=image, is_public=is_public,
+                      title=title_from_name(result['name']))
+        photo.renditions = images.photo_renditions(photo)
+        photos.append(photo)
+        created.append(result)
+    if photos:
+        _create(owner, photos)
+    for result, photo in zip(created, photos):
+        result['status'] = CREATED
+        result['photo_id'] = photo.pk
+    return results
+
+
+def _create(owner, photos):
+    """
+    Insert and publish ``photos``, as the Photo signal handlers would.
+
+    If the insert fails, their stored files are deleted before re-raising.
+    """
+    try:
+        with transaction.atomic():
+            Photo.objects.bulk_create(photos)
+            uploads.photos_published(owner.pk, photos)
+            count = len(photos)
+            enqueue_upload_fanout(
+                photos[-1],
+                title='New photos' if count > 1 else 'New photo',
+                message=(f'{owner.username} uploaded {count} photos'
+                         if count > 1 else
+                         f'{owner.username} uploaded "{photos[0].title}"'),
+            )
+    except Exception:
+        for photo in photos:
+            try:
+                direct_uploads.delete_file(photo.image)
+            except Exception:
+                # Best effort; the insert's error is the one to report
+                pass
+        raise
+    timeline.fan_out_photos(owner, photos)
@@ -0,0 +1,242 @@
+"""
+Signed direct uploads: the browser sends the image straight to storage.
+
+``upload_ticket`` returns the storage URL plus the form fields to post with
+the file: a public id under the user's folder, a timestamp and a signature
+over both (Cloudinary's ``api_sign_request`` scheme). Storage accepts the
+file only with a valid, fresh signature and answers with the stored
+``public_id``, ``version`` and a response signature over the two. The
+browser hands that answer to the confirm view, which checks the response
+signature and the folder with ``confirmed_image`` before creating the
+``Photo``. The web process never sees the image bytes.
+
+With ``DIRECT_UPLOAD_BACKEND = 'cloudinary'`` tickets point at Cloudinary's
+upload API and are signed with the account's API secret. The ``'local'``
+backend points them at ``store_local_upload`` (the ``direct_upload_local``
+view), a stand-in that speaks the same protocol, signs with a key derived
+from ``SECRET_KEY`` and writes files to the default storage, so the flow
+works offline and in tests; photos then refer to the file by its storage
+name (``local_image``), which ``images`` serves. ``upload_file`` stores a
+file from the server side through the same backend, for form uploads and
+``process_uploads``.
+"""
+import secrets
+import time
+
+import cloudinary
+import cloudinary.uploader
+from cloudinary import CloudinaryResource
+from cloudinary.utils import api_sign_request
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from . import images
+
+CLOUDINARY_UPLOAD_URL = 'https://api.cloudinary.com/v1_1/{}/image/upload'
+
+# Applied by Cloudinary on upload (crop to 2000px, eco quality, progressive)
+INCOMING_TRANSFORMATION = 'c_limit,fl_progressive,h_2000,q_auto:eco,w_2000'
+ALLOWED_FORMATS = ('jpg', 'jpeg', 'png', 'gif', 'webp')
+# Derived images generated with server-side uploads, so the first card and
+# detail views are not rendered on demand
+EAGER_RENDITIONS = [
+    {key: value for key, value in preset.items()
+     if key in ('width', 'height', 'crop', 'gravity', 'quality')}
+    for preset in (images.THUMBNAIL, images.DETAIL)
+]
+
+
+def _api_secret():
+    if settings.DIRECT_UPLOAD_BACKEND == 'cloudinary':
+        return cloudinary.config().api_secret
+    return salted_hmac('direct-upload', 'local').hexdigest()
+
+
+def _sign(params, signature_version=2):
+    return api_sign_request(params, _api_secret(),
+                            signature_version=signature_version)
+
+
+def user_folder(user, folder=None):
+    return f'{folder or settings.DIRECT_UPLOAD_FOLDER}/u{user.pk}'
+
+
+def new_public_id(user, folder=None):
+    return f'{user_folder(user, folder)}/{secrets.token_urlsafe(12)}'
+
+
+def upload_ticket(user):
+    """
+    A signed ticket for one direct upload by ``user``.
+
+    Returns ``upload_url``, the ``fields`` to post alongside ``file`` and
+    ``expires_at`` (Unix time).
+    """
+    timestamp = int(time.time())
+    params = {
+        'public_id': new_public_id(user),
+        'timestamp': timestamp,
+    }
+    if settings.DIRECT_UPLOAD_BACKEND == 'cloudinary':
+        config = cloudinary.config()
+        params.update(transformation=INCOMING_TRANSFORMATION,
+                      allowed_formats=','.join(ALLOWED_FORMATS))
+        upload_url = CLOUDINARY_UPLOAD_URL.format(config.cloud_name)
+        fields = dict(params, api_key=config.api_key)
+    else:
+        upload_url = reverse('direct_upload_local')
+        fields = dict(params)
+    fields['signature'] = _sign(params)
+    return {
+        'upload_url': upload_url,
+        'fields': fields,
+        'expires_at': timestamp + settings.DIRECT_UPLOAD_TICKET_TTL,
+    }
+
+
+def response_signature(public_id, version, image_format=None):
+    """
+    What storage signs its upload response with (signature version 1).
+
+    The local stand-in also signs ``format``; Cloudinary signs only
+    ``public_id`` and ``version``.
+    """
+    params = {'public_id': public_id, 'version': version}
+    if image_format is not None:
+        params['format'] = image_format
+    return _sign(params, signature_version=1)
+
+
+def verify_upload(user, public_id, version, signature, image_format=None):
+    """
+    Whether storage really stored ``public_id`` at ``version`` (as
+    ``image_format``, when given) for a ticket issued to ``user``.
+    """
+    if not (public_id and version and signature):
+        return False
+    if not str(public_id).startswith(user_folder(user) + '/'):
+        return False
+    return constant_time_compare(
+        signature, response_signature(public_id, version, image_format))
+
+
+def confirmed_image(user, fields):
+    """
+    The ``Photo.image`` value for the storage response in ``fields``, or
+    ``None`` if it does not verify.
+
+    Cloudinary's signature does not cover ``format``, so with Cloudinary
+    the posted format is ignored and delivery serves the stored original.
+    """
+    image_format = None
+    if settings.DIRECT_UPLOAD_BACKEND != 'cloudinary':
+        image_format = fields.get('format', '')
+    public_id = fields.get('public_id', '')
+    version = fields.get('version', '')
+    if not verify_upload(user, public_id, version,
+                         fields.get('signature', ''), image_format):
+        return None
+    if settings.DIRECT_UPLOAD_BACKEND != 'cloudinary':
+        return local_image(public_id, image_format)
+    return stored_image(public_id, version, image_format)
+
+
+def stored_image(public_id, version, image_format):
+    """The value to assign to ``Photo.image`` for a verified upload."""
+    return CloudinaryResource(
+        public_id, format=image_format, version=version, type='upload',
+        resource_type='image')
+
+
+def local_image(public_id, image_format):
+    """
+    The ``Photo.image`` value for a file stored by the local backend: its
+    default storage name, which ``images`` serves from there.
+    """
+    return CloudinaryResource(
+        f'{images.LOCAL_FOLDER}/{public_id}', format=image_format,
+        type='upload', resource_type='image')
+
+
+def same_upload(image):
+    """A ``Photo`` filter matching ``image``'s upload in any format."""
+    base = stored_image(image.public_id, image.version, None).get_prep_value()
+    return Q(image=base) | Q(image__startswith=f'{base}.')
+
+
+def _save_local(public_id, image_format, fileobj):
+    name = default_storage.save(
+        f'{images.LOCAL_FOLDER}/{public_id}.{image_format}', fileobj)
+    return name, int(time.time())
+
+
+def upload_file(fileobj, public_id, image_format, original=False):
+    """
+    Store an image from the server side; returns the ``Photo.image`` value.
+
+    ``fileobj`` is an open file or a path. New uploads are resized with
+    ``INCOMING_TRANSFORMATION`` and get ``EAGER_RENDITIONS``; with
+    ``original`` the file is stored as it is, for migrating existing media.
+    """
+    if settings.DIRECT_UPLOAD_BACKEND == 'cloudinary':
+        options = {} if original else {
+            'transformation': INCOMING_TRANSFORMATION,
+            'eager': EAGER_RENDITIONS}
+        result = cloudinary.uploader.upload(
+            fileobj, public_id=public_id, **options)
+        return stored_image(
+            result['public_id'], result['version'], result['format'])
+    if isinstance(fileobj, str):
+        with open(fileobj, 'rb') as f:
+            _save_local(public_id, image_format, f)
+    else:
+        _save_local(public_id, image_format, fileobj)
+    return local_image(public_id, image_format)
+
+
+def delete_file(image):
+    """Remove a file stored by ``upload_file``, for uploads left unused."""
+    if str(image).startswith(f'{images.LOCAL_FOLDER}/'):
+        default_storage.delete(f'{image}.{image.format}')
+    else:
+        cloudinary.uploader.destroy(image.public_id, invalidate=True)
+
+
+def store_local_upload(fields, upload):
+    """
+    Stand-in for the storage upload API: check the ticket ``fields`` and
+    store ``upload``.
+
+    Returns ``(response, error)``; ``response`` mirrors Cloudinary's upload
+    response.
+    """
+    public_id = fields.get('public_id', '')
+    try:
+        timestamp = int(fields.get('timestamp', ''))
+    except ValueError:
+        return None, 'Missing timestamp'
+    expected = _sign({'public_id': public_id, 'timestamp': timestamp})
+    if not constant_time_compare(fields.get('signature', ''), expected):
+        return None, 'Invalid signature'
+    if time.time() - timestamp > settings.DIRECT_UPLOAD_TICKET_TTL:
+        return None, 'Stale request'
+    if upload is None:
+        return None, 'Missing file'
+    if upload.size > settings.UPLOAD_MAX_BYTES:
+        return None, 'File size too large'
+    image_format = upload.name.rsplit('.', 1)[-1].lower()
+    if image_format not in ALLOWED_FORMATS:
+        return None, 'Image format not allowed'
+
+    name, version = _save_local(public_id, image_format, upload)
+    return {
+        'public_id': public_id,
+        'version': version,
+        'signature': response_signature(public_id, version, image_format),
+        'format': image_format,
+        'bytes': upload.size,
+        'secure_url': default_storage.url(name),
+    }, None
@@ -0,0 +1,212 @@
+"""
+Pub-sub for the live notification stream.
+
+``publish`` hands an event for one user to the configured broker. Each
+open ``/notifications/stream/`` connection calls ``subscribe(user_id,
+last_event_id)`` and drains the subscription with ``await
+subscription.next(timeout)``, which returns ``None`` when idle so the
+stream can send a heartbeat.
+
+Brokers (``NOTIFICATION_BROKER``):
+
+``local``
+    In-process fan-out to asyncio queues. Instant, but only reaches
+    streams served by the same process, so it suits a single ASGI worker.
+``database``
+    Every subscription polls the notifications table for rows newer than
+    the last one it sent and for unread-count changes. Works across any
+    number of workers at the cost of one small query pair per interval.
+
+A dotted path to another broker class may also be given.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict, deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+EVENT_NOTIFICATION = 'notification'
+EVENT_NOTIFICATION_UPDATED = 'notification-updated'
+EVENT_UNREAD = 'unread'
+
+# Events queued per local subscription before new ones are dropped; a
+# client that far behind resynchronises from the next unread event
+LOCAL_QUEUE_SIZE = 100
+
+
+class Event:
+    """One server-sent event; ``id`` is set for notification events."""
+
+    __slots__ = ('name', 'data', 'id')
+
+    def __init__(self, name, data, id=None):
+        self.name = name
+        self.data = data
+        self.id = id
+
+    def __eq__(self, other):
+        return (isinstance(other, Event) and
+                (self.name, self.data, self.id) ==
+                (other.name, other.data, other.id))
+
+    def __repr__(self):
+        return f'Event({self.name!r}, {self.data!r}, id={self.id!r})'
+
+
+class LocalSubscription:
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=LOCAL_QUEUE_SIZE)
+
+    def offer(self, event):
+        """Queue ``event``; runs on this subscription's event loop."""
+        if not self.queue.full():
+            self.queue.put_nowait(event)
+
+    async def next(self, timeout):
+        """Return the next event, or ``None`` after ``timeout`` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Delivers events to subscriptions in this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id, last_event_id):
+        subscription = LocalSubscription(self, user_id)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event):
+        # Called from sync views in worker threads; hand the event to each
+        # subscriber's own loop rather than touching its queue directly
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(
+                    subscription.offer, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+
+
+class DatabaseSubscription:
+    def __init__(self, user_id, last_event_id):
+        # ``last_event_id`` is the newest notification the client has seen
+        self.user_id = user_id
+        self.last_id = last_event_id
+        self.unread_count = None
+        self.pending = deque()
+
+    def _poll(self):
+        # Imported here: portfolio.notifications publishes through this module
+        from . import notifications as service
+        from .models import Notification
+
+        notifications = Notification.objects.filter(
+            recipient_id=self.user_id).select_related('sender', 'photo')
+        new = list(notifications.filter(id__gt=self.last_id)
+                   .order_by('id')[:LOCAL_QUEUE_SIZE])
+        events = [service.notification_event(n) for n in new]
+        if new:
+            self.last_id = new[-1].pk
+
+        count = service.unread_count(self.user_id)
+        if count != self.unread_count:
+            # The stream sends the count on connect; only report changes
+            if self.unread_count is not None or events:
+                events.append(service.unread_event(count))
+            self.unread_count = count
+        return events
+
+    async def next(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = settings.NOTIFICATION_POLL_INTERVAL
+        while not self.pending:
+            self.pending.extend(await sync_to_async(self._poll)())
+            remaining = deadline - loop.time()
+            if self.pending:
+                break
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(interval, remaining))
+        return self.pending.popleft()
+
+    def close(self):
+        pass
+
+
+class DatabaseBroker:
+    """Subscriptions poll the database; publishing is a no-op."""
+
+    def subscribe(self, user_id, last_event_id):
+        return DatabaseSubscription(user_id, last_event_id)
+
+    def publish(self, user_id, event):
+        pass
+
+
+BROKERS = {
+    'local': LocalBroker,
+    'database': DatabaseBroker,
+}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            name = settings.NOTIFICATION_BROKER
+            broker_class = BROKERS.get(name) or import_string(name)
+            _broker = broker_class()
+        return _broker
+
+
+def reset_broker():
+    global _broker
+    with _broker_lock:
+        _broker = None
+
+
+def publish(user_id, event):
+    """Send ``event`` to ``user_id``'s open streams after commit."""
+    transaction.on_commit(lambda: get_broker().publish(user_id, event))
+
+
+def format_event(event):
+    """Encode ``event`` in the text/event-stream wire format."""
+    lines = []
+    if event.id is not None:
+        lines.append(f'id: {event.id}')
+    lines.append(f'event: {event.name}')
+    lines.append(f'data: {json.dumps(event.data)}')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,323 @@
+"""
+"Who to follow" suggestions, computed offline.
+
+``compute_follow_suggestions`` loads the follow graph and the likes into
+compressed sparse row (CSR) form: for each user, a slice of one flat
+integer array lists the accounts they follow (or photos they liked). A
+candidate's score is
+
+    mutual follows * 1 + shared likes * FOLLOW_SUGGESTION_LIKE_WEIGHT
+
+where mutual follows counts the accounts the user follows that follow the
+candidate (friends of friends) and shared likes counts photos both liked.
+Photos with more than ``FOLLOW_SUGGESTION_MAX_LIKERS`` likers are ignored:
+liking a viral photo says little about two people, and they would make
+scoring quadratic. The top ``FOLLOW_SUGGESTION_COUNT`` candidates per user
+are stored in ``FollowSuggestion``; pages read them back in one query.
+
+With NumPy and SciPy (both in requirements.txt) the scores are sparse
+matrix products over blocks of users, read back row by row from the CSR
+slices; if they are missing the same CSR arrays are walked in pure Python.
+"""
+import random
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Follow, FollowSuggestion, Like, Photo
+from . import follows
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # Optional: scoring falls back to pure Python
+    np = sparse = None
+
+# Users scored per sparse matrix product
+BLOCK_SIZE = 2000
+
+
+class Graph:
+    """
+    Follows and likes as CSR arrays over dense user indexes ``0..n-1``.
+
+    ``user_ids[i]`` is the id of user ``i``. ``follows`` rows list followed
+    user indexes, ``likes`` rows list liked photo indexes and ``likers``
+    (the transpose of ``likes``) list the user indexes that liked a photo.
+    Each is an ``(indptr, indices)`` pair of ``array('q')``.
+    """
+
+    def __init__(self, user_ids, follows, likes, likers):
+        self.user_ids = user_ids
+        self.follows = follows
+        self.likes = likes
+        self.likers = likers
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @property
+    def nbytes(self):
+        arrays = [self.user_ids, *self.follows, *self.likes, *self.likers]
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+def _columns(pairs):
+    """Split ``(row, column)`` pairs into two flat arrays."""
+    rows, columns = array('q'), array('q')
+    for row, column in pairs:
+        rows.append(row)
+        columns.append(column)
+    return rows, columns
+
+
+def csr(row_of, columns, rows):
+    """Build ``(indptr, indices)`` from parallel row and column arrays."""
+    indptr = array('q', bytes(8 * (rows + 1)))
+    for row in row_of:
+        indptr[row + 1] += 1
+    for i in range(rows):
+        indptr[i + 1] += indptr[i]
+    # Counting sort by row, so callers need not pre-sort the pairs
+    indices = array('q', bytes(8 * len(columns)))
+    position = array('q', indptr[:-1])
+    for row, column in zip(row_of, columns):
+        indices[position[row]] = column
+        position[row] += 1
+    return indptr, indices
+
+
+def build_graph(user_ids, follow_pairs, like_pairs, photos):
+    """
+    Build a ``Graph`` from id pairs.
+
+    ``follow_pairs`` are ``(follower index, followed index)`` and
+    ``like_pairs`` ``(user index, photo index)`` with photo indexes below
+    ``photos``. Pairs are streamed into flat arrays, never held as tuples.
+    """
+    users = len(user_ids)
+    follows = csr(*_columns(follow_pairs), users)
+    likers, liked = _columns(like_pairs)
+    return Graph(
+        user_ids,
+        follows,
+        csr(likers, liked, users),
+        csr(liked, likers, photos),
+    )
+
+
+def synthetic_graph(users, follows_per_user=20, likes_per_user=30,
+                    photos_per_user=2, seed=0):
+    """
+    A random graph for benchmarks, without touching the database.
+
+    Followed accounts and liked photos are skewed towards low indexes so a
+    few accounts are popular and most are not, as on the real site.
+    """
+    rng = random.Random(seed)
+    photos = users * photos_per_user
+
+    def skewed(n):
+        return int(n * rng.random() ** 2)
+
+    follow_pairs = (
+        (u, v) for u in range(users)
+        for v in {skewed(users) for _ in range(follows_per_user)} if v != u)
+    like_pairs = (
+        (u, p) for u in range(users)
+        for p in {skewed(photos) for _ in range(likes_per_user)})
+    return build_graph(array('q', range(1, users + 1)), follow_pairs,
+                       like_pairs, photos)
+
+
+def load_graph():
+    """Load every user's follows and likes from the database."""
+    from django.contrib.auth.models import User
+
+    user_ids = array('q', User.objects.order_by('pk').values_list(
+        'pk', flat=True).iterator(chunk_size=10000))
+    index = {pk: i for i, pk in enumerate(user_ids)}
+    photo_index = {pk: i for i, pk in enumerate(
+        Photo.objects.order_by('pk').values_list('pk', flat=True)
+        .iterator(chunk_size=10000))}
+    # Rows are read by separate queries, so follows and likes may name users
+    # or photos created after the id lists were loaded; those wait for the
+    # next run
+    follow_pairs = (
+        (index[a], index[b]) for a, b in
+        Follow.objects.values_list('follower_id', 'following_id')
+        .iterator(chunk_size=10000)
+        if a in index and b in index)
+    like_pairs = (
+        (index[u], photo_index[p]) for u, p in
+        Like.objects.values_list('user_id', 'photo_id')
+        .iterator(chunk_size=10000)
+        if u in index and p in photo_index)
+    return build_graph(user_ids, follow_pairs, like_pairs, len(photo_index))
+
+
+def _row(matrix, i):
+    indptr, indices = matrix
+    return indices[indptr[i]:indptr[i + 1]]
+
+
+def _python_scores(graph, count, like_weight, max_likers):
+    for user in range(len(graph)):
+        followed = _row(graph.follows, user)
+        mutual = Counter()
+        for other in followed:
+            mutual.update(_row(graph.follows, other))
+        shared = Counter()
+        if like_weight:
+            for photo in _row(graph.likes, user):
+                likers = _row(graph.likers, photo)
+                if len(likers) <= max_likers:
+                    shared.update(likers)
+        # Rank on score / like_weight so the (usually far larger) shared
+        # counts are copied and sorted in C rather than summed in a loop
+        scale = 1 / like_weight if like_weight else 1
+        ranked = Counter(shared)
+        for candidate, n in mutual.items():
+            ranked[candidate] += n * scale
+        ranked.pop(user, None)
+        for candidate in followed:
+            ranked.pop(candidate, None)
+        yield user, [
+            (c, value / scale, mutual[c], shared[c])
+            for c, value in ranked.most_common(count)]
+
+
+def _to_scipy(matrix, rows, columns):
+    indptr, indices = matrix
+    indptr = np.frombuffer(indptr, dtype=np.int64)
+    indices = np.frombuffer(indices, dtype=np.int64)
+    data = np.ones(len(indices), dtype=np.float32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(rows, columns))
+
+
+def _csr_row(matrix, i):
+    """Column indexes and values of row ``i``, as views of the CSR arrays."""
+    start, end = matrix.indptr[i], matrix.indptr[i + 1]
+    return matrix.indices[start:end], matrix.data[start:end]
+
+
+def _lookup(matrix, i, columns):
+    """``matrix[i, columns]`` for a CSR matrix with sorted indices."""
+    indices, data = _csr_row(matrix, i)
+    if not len(indices):
+        return np.zeros(len(columns), dtype=data.dtype)
+    positions = np.minimum(np.searchsorted(indices, columns),
+                           len(indices) - 1)
+    return np.where(indices[positions] == columns, data[positions], 0)
+
+
+def _scipy_scores(graph, count, like_weight, max_likers):
+    users = len(graph)
+    photos = len(graph.likers[0]) - 1
+    follows_matrix = _to_scipy(graph.follows, users, users)
+    likes_matrix = _to_scipy(graph.likes, users, photos)
+    popularity = np.diff(np.frombuffer(graph.likers[0], dtype=np.int64))
+    likes_matrix = likes_matrix @ sparse.diags(
+        (popularity <= max_likers).astype(np.float32))
+    likes_t = likes_matrix.T.tocsr()
+    for start in range(0, users, BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, users)
+        mutual = (follows_matrix[start:end] @ follows_matrix).tocsr()
+        shared = (likes_matrix[start:end] @ likes_t).tocsr()
+        scores = (mutual + like_weight * shared).tocsr()
+        mutual.sort_indices()
+        shared.sort_indices()
+        # Every row is read from the CSR slices: nothing is densified, so
+        # a block costs memory in proportion to its non-zeros
+        for offset in range(end - start):
+            user = start + offset
+            candidates, values = _csr_row(scores, offset)
+            followed, _ = _csr_row(follows_matrix, user)
+            keep = (values > 0) & (candidates != user) & ~np.isin(
+                candidates, followed)
+            candidates, values = candidates[keep], values[keep]
+            if not len(candidates):
+                yield user, []
+                continue
+            if len(candidates) > count:
+                best = np.argpartition(-values, count)[:count]
+                candidates, values = candidates[best], values[best]
+            order = np.argsort(-values, kind='stable')
+            candidates, values = candidates[order], values[order]
+            yield user, [
+                (int(c), float(v), int(m), int(sh)) for c, v, m, sh in zip(
+                    candidates, values, _lookup(mutual, offset, candidates),
+                    _lookup(shared, offset, candidates))]
+
+
+def score(graph, count=None, backend=None):
+    """
+    Yield ``(user index, [(candidate index, score, mutual, shared), ...])``
+    with candidates best first.
+
+    ``backend`` is ``'scipy'`` or ``'python'``; by default SciPy is used
+    when it is installed.
+    """
+    count = count or settings.FOLLOW_SUGGESTION_COUNT
+    backend = backend or ('scipy' if sparse is not None else 'python')
+    if backend == 'scipy' and sparse is None:
+        raise ImportError('The scipy backend needs numpy and scipy')
+    scorer = _scipy_scores if backend == 'scipy' else _python_scores
+    return scorer(graph, count, settings.FOLLOW_SUGGESTION_LIKE_WEIGHT,
+                  settings.FOLLOW_SUGGESTION_MAX_LIKERS)
+
+
+def store(graph, scored, batch_size=1000):
+    """
+    Replace users' stored suggestions, ``batch_size`` users per transaction.
+
+    Returns ``(users, rows)`` written.
+    """
+    users = rows = 0
+    batch_users, batch_rows = [], []
+
+    def flush():
+        with transaction.atomic():
+            FollowSuggestion.objects.filter(user_id__in=batch_users).delete()
+            FollowSuggestion.objects.bulk_create(batch_rows)
+
+    for user, suggestions in scored:
+        user_id = graph.user_ids[user]
+        batch_users.append(user_id)
+        batch_rows.extend(
+            FollowSuggestion(
+                user_id=user_id, suggested_id=graph.user_ids[candidate],
+                score=value, mutual_follows=mutual, shared_likes=shared)
+            for candidate, value, mutual, shared in suggestions)
+        if len(batch_users) >= batch_size:
+            flush()
+            users += len(batch_users)
+            rows += len(batch_rows)
+            batch_users, batch_rows = [], []
+    if batch_users:
+        flush()
+        users += len(batch_users)
+        rows += len(batch_rows)
+    return users, rows
+
+
+def suggestions_for(user, limit=5):
+    """
+    ``user``'s best stored suggestions, with profiles, in one query.
+
+    Accounts followed since the last run are skipped using the cached
+    followed-id set.
+    """
+    if not user.is_authenticated:
+        return []
+    rows = list(
+        FollowSuggestion.objects.filter(user=user)
+        .select_related('suggested__profile')
+        .order_by('-score')[:limit * 2]
+    )
+    if not rows:
+        return []
+    followed = set(follows.following_ids(user.pk))
+    return [s for s in rows if s.suggested_id not in followed][:limit]
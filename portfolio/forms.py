@@ -1,28 +1,28 @@
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.validators import URLValidator
+from django.core.validators import FileExtensionValidator, URLValidator
 import re
 from .models import Photo, Comment, Profile
+from .direct_uploads import ALLOWED_FORMATS
+from .images import profile_renditions
 from cloudinary.forms import CloudinaryFileField
 
 
 class PhotoForm(forms.ModelForm):
-    image = CloudinaryFileField(
-        options={
-            'crop': 'limit',
-            'width': 2000,
-            'height': 2000,
-            'quality': 'auto:eco',  # More aggressive compression
-            'progressive': True,  # Progressive JPEG loading
-            'secure': True  # Use HTTPS URLs
-        },
+    # A plain file field: the view decides when the image is sent to
+    # storage (see portfolio.uploads), with the crop and quality options
+    # in portfolio.direct_uploads
+    image = forms.ImageField(
+        label='Upload Photo *',
+        validators=[FileExtensionValidator(ALLOWED_FORMATS)],
         help_text=("Upload a high-quality image (JPEG, PNG, or WebP). "
                    "Maximum file size: 10MB.")
     )
 
     class Meta:
         model = Photo
-        fields = ['image', 'title', 'description', 'is_public']
+        fields = ['title', 'description', 'is_public']
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -43,8 +43,7 @@ class PhotoForm(forms.ModelForm):
         labels = {
             'title': 'Photo Title *',
             'description': 'Description',
-            'is_public': 'Make this photo public',
-            'image': 'Upload Photo *'
+            'is_public': 'Make this photo public'
         }
         help_texts = {
             'title': 'Choose a clear, descriptive title (3-255 characters)',
@@ -53,6 +52,14 @@ class PhotoForm(forms.ModelForm):
             'is_public': 'Uncheck to keep this photo private'
         }
 
+    field_order = ['image', 'title', 'description', 'is_public']
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if image and image.size > settings.UPLOAD_MAX_BYTES:
+            raise ValidationError("Image file too large (max 10MB).")
+        return image
+
     def clean_title(self):
         title = self.cleaned_data.get('title')
         if not title:
@@ -94,6 +101,51 @@ class PhotoForm(forms.ModelForm):
         return cleaned_data
 
 
+class DirectUploadPhotoForm(PhotoForm):
+    """Photo details for an image the browser already sent to storage."""
+    image = None
+
+    class Meta(PhotoForm.Meta):
+        fields = ['title', 'description', 'is_public']
+
+
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    """A file field that accepts several files and cleans each of them."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(d, initial) for d in data]
+        return [single_file_clean(data, initial)]
+
+
+class BulkUploadForm(forms.Form):
+    files = MultipleFileField(
+        label='Photos or zip archives *',
+        widget=MultipleFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.jpg,.jpeg,.png,.gif,.webp,.zip',
+        }),
+        help_text=("Select up to 200 images (JPEG, PNG, GIF or WebP, max "
+                   "10MB each) or zip archives of them. Titles are taken "
+                   "from the file names.")
+    )
+    is_public = forms.BooleanField(
+        label='Make these photos public',
+        required=False,
+        initial=True,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+
+
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
@@ -174,7 +226,8 @@ class ProfileForm(forms.ModelForm):
         model = Profile
         fields = [
             'display_name', 'bio', 'avatar', 'hero_image',
-            'website', 'location', 'instagram', 'show_email'
+            'website', 'location', 'instagram', 'show_email',
+            'mute_upload_notifications'
         ]
         widgets = {
             'display_name': forms.TextInput(attrs={
@@ -206,6 +259,9 @@ class ProfileForm(forms.ModelForm):
             'show_email': forms.CheckboxInput(attrs={
                 'class': 'form-check-input'
             }),
+            'mute_upload_notifications': forms.CheckboxInput(attrs={
+                'class': 'form-check-input'
+            }),
         }
         labels = {
             'display_name': 'Display Name',
@@ -215,7 +271,8 @@ class ProfileForm(forms.ModelForm):
             'website': 'Website',
             'location': 'Location',
             'instagram': 'Instagram Handle',
-            'show_email': 'Show Email Publicly'
+            'show_email': 'Show Email Publicly',
+            'mute_upload_notifications': 'Mute New Photo Notifications'
         }
         help_texts = {
             'display_name': ('How you want to be known on ShutterSpace '
@@ -224,7 +281,9 @@ class ProfileForm(forms.ModelForm):
             'website': 'Your personal website or portfolio URL',
             'location': 'Where you are based',
             'instagram': 'Your Instagram username (without @)',
-            'show_email': 'Allow other users to see your email address'
+            'show_email': 'Allow other users to see your email address',
+            'mute_upload_notifications': ("Don't notify me when people I "
+                                          "follow upload a photo")
         }
 
     def clean_display_name(self):
@@ -342,3 +401,11 @@ class ProfileForm(forms.ModelForm):
                 "Consider adding a biography to tell others about yourself.")
 
         return cleaned_data
+
+    def save(self, commit=True):
+        profile = super().save(commit=False)
+        # Store avatar/hero delivery URLs so pages never rebuild them
+        profile.renditions = profile_renditions(profile)
+        if commit:
+            profile.save()
+        return profile
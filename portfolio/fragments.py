@@ -0,0 +1,169 @@
+"""
+Versioned fragment cache for photo cards.
+
+Each card is rendered once per ``(variant, role, photo id, version)`` and
+reused for every viewer. The per-photo version lives in the cache and is
+bumped (after commit) whenever the photo is edited or deleted or gains or
+loses a like or comment, so stale fragments are simply never looked up
+again and age out on their own.
+
+Viewer-specific markup stays out of the fragment: the like button is
+filled into a slot after the cached HTML is fetched, and comment actions
+are covered by the ``role`` part of the key. Viewers who wrote one of the
+card's recent comments get a live render, which is counted as a bypass.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+
+VERSION_KEY = 'photo-card-version:{}'
+FRAGMENT_KEY = 'photo-card:{variant}:{role}:{pk}:{version}'
+
+ROLE_VIEWER = 'viewer'
+ROLE_OWNER = 'owner'
+
+TEMPLATES = {
+    'home': 'partials/photo_card_home.html',
+    'profile': 'partials/photo_card_profile.html',
+}
+
+LIKE_BUTTON_SLOT = '<!--like-button-->'
+LIKED_BUTTON = (
+    '<button data-like-button data-photo-id="{}" '
+    'class="btn btn-sm btn-danger">♥ Liked</button>')
+LIKE_BUTTON = (
+    '<button data-like-button data-photo-id="{}" '
+    'class="btn btn-sm btn-outline-danger">♡ Like</button>')
+
+# Sent after each grid render with that render's hit/miss/bypass counts,
+# for anyone who wants to export hit ratios to their metrics system
+cards_rendered = Signal()
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+
+
+def card_cache_stats():
+    """Return this process's running hit/miss counts and hit ratio."""
+    with _stats_lock:
+        stats = dict(_stats)
+    looked_up = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / looked_up if looked_up else 0.0
+    return stats
+
+
+def reset_card_cache_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def _record(hits, misses, bypassed, variant):
+    with _stats_lock:
+        _stats['hits'] += hits
+        _stats['misses'] += misses
+        _stats['bypassed'] += bypassed
+    cards_rendered.send(
+        sender=variant, hits=hits, misses=misses, bypassed=bypassed)
+
+
+def _fresh_version():
+    # Seeding from the clock means an evicted version key can never be
+    # recreated with a number an old fragment was cached under
+    return time.time_ns()
+
+
+def versions_for(photo_ids):
+    """Return ``{photo id: version}``, seeding versions that are missing."""
+    keys = {VERSION_KEY.format(pk): pk for pk in photo_ids}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, pk in keys.items():
+        if pk not in versions:
+            cache.add(key, _fresh_version(), timeout=None)
+            versions[pk] = cache.get(key)
+    return versions
+
+
+def bump_version(photo_id):
+    """Invalidate every cached card for ``photo_id`` once the write commits."""
+    def bump():
+        key = VERSION_KEY.format(photo_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def _role(photo, viewer):
+    """Cache role for ``viewer`` on ``photo``; ``None`` means render live."""
+    if not viewer.is_authenticated:
+        return ROLE_VIEWER
+    if viewer.pk == photo.owner_id:
+        return ROLE_OWNER
+    comments = getattr(photo, 'recent_comments', ())
+    if any(comment.author_id == viewer.pk for comment in comments):
+        return None
+    return ROLE_VIEWER
+
+
+def _render(photo, variant, user):
+    # ``owner`` is the profile being viewed, used by the profile card's
+    # delete button; it is always the photo's owner there
+    return render_to_string(TEMPLATES[variant], {
+        'photo': photo,
+        'user': user,
+        'owner': photo.owner,
+    })
+
+
+def _like_button(photo):
+    template = LIKED_BUTTON if getattr(photo, 'liked_by_me', False) \
+        else LIKE_BUTTON
+    return format_html(template, photo.pk)
+
+
+def render_cards(photos, variant, viewer):
+    """
+    Return the HTML for a grid of photo cards as seen by ``viewer``.
+
+    Costs two cache round trips for versions and fragments plus one
+    ``set_many`` for any misses. Photos should come from ``feed_for`` so
+    the like state and recent comments are already loaded.
+    """
+    photos = list(photos)
+    versions = versions_for([photo.pk for photo in photos])
+    roles = {photo.pk: _role(photo, viewer) for photo in photos}
+    keys = {
+        photo.pk: FRAGMENT_KEY.format(
+            variant=variant, role=roles[photo.pk], pk=photo.pk,
+            version=versions[photo.pk])
+        for photo in photos if roles[photo.pk] is not None
+    }
+    cached = cache.get_many(keys.values())
+
+    parts, misses, bypassed = [], {}, 0
+    for photo in photos:
+        role = roles[photo.pk]
+        if role is None:
+            html = _render(photo, variant, viewer)
+            bypassed += 1
+        elif keys[photo.pk] in cached:
+            html = cached[keys[photo.pk]]
+        else:
+            html = _render(
+                photo, variant, photo.owner if role == ROLE_OWNER else None)
+            misses[keys[photo.pk]] = html
+        parts.append(html.replace(LIKE_BUTTON_SLOT, _like_button(photo)))
+    if misses:
+        cache.set_many(misses, timeout=settings.PHOTO_CARD_CACHE_TIMEOUT)
+
+    _record(len(keys) - len(misses), len(misses), bypassed, variant)
+    return ''.join(parts)
@@ -0,0 +1,192 @@
+"""
+Cloudinary delivery URLs for the image presets used across the site.
+
+Photo and profile images never change after upload, so their preset URLs
+and srcset are computed once on save and stored as a ``renditions`` dict
+(see ``renditions_for``). Rendering reads the stored values; rows without
+them (or whose image has since changed) fall back to building URLs live,
+memoized per process in a bounded LRU keyed by ``(public_id, preset,
+version)``. URLs keep the image's ``v<version>`` segment, so a re-upload
+under the same public id gets new URLs and stale CDN copies are not served.
+
+Files stored by the ``'local'`` direct upload backend are not on
+Cloudinary: their public id is their name in default storage under
+``LOCAL_FOLDER``, and every preset serves that file untransformed.
+"""
+from functools import lru_cache
+
+from cloudinary import CloudinaryImage
+from django.core.files.storage import default_storage
+
+# Options shared by every preset
+_DELIVERY = {
+    'format': 'auto',
+    'fetch_format': 'auto',
+    'progressive': True,
+    'secure': True,
+}
+
+THUMBNAIL = dict(_DELIVERY, width=400, height=300, crop='fill',
+                 quality='auto:eco')
+DETAIL = dict(_DELIVERY, width=800, height=600, crop='limit',
+              quality='auto:good')
+HERO = dict(_DELIVERY, width=1200, height=400, crop='fill',
+            quality='auto:eco')
+AVATAR = dict(_DELIVERY, width=150, height=150, crop='thumb',
+              gravity='face', quality='auto:eco')
+
+PRESETS = {
+    'thumbnail': THUMBNAIL,
+    'detail': DETAIL,
+    'hero': HERO,
+    'avatar': AVATAR,
+}
+DEFAULT_PRESET = 'thumbnail'
+
+SRCSET = 'srcset'
+SRCSET_WIDTHS = (400, 800, 1200, 1600)
+SRCSET_OPTIONS = dict(_DELIVERY, crop='limit', quality='auto:eco')
+
+# Distinct (public_id, preset) pairs kept per process
+URL_CACHE_SIZE = 8192
+
+# Default storage folder of files stored by the local upload backend
+LOCAL_FOLDER = 'direct_uploads'
+
+# Renditions stored for each kind of image
+PHOTO_RENDITIONS = ('thumbnail', 'detail', 'hero', 'avatar', SRCSET)
+AVATAR_RENDITIONS = ('avatar',)
+HERO_IMAGE_RENDITIONS = ('hero', SRCSET)
+
+
+def preset_name(transform_type):
+    """Map a requested transform to a known preset, as the tags always did."""
+    return transform_type if transform_type in PRESETS else DEFAULT_PRESET
+
+
+def _build(public_id, preset, version=None):
+    image = CloudinaryImage(public_id, version=version)
+    if preset == SRCSET:
+        return ', '.join(
+            f"{image.build_url(width=width, **SRCSET_OPTIONS)} {width}w"
+            for width in SRCSET_WIDTHS)
+    return image.build_url(**PRESETS[preset])
+
+
+cached_url = lru_cache(maxsize=URL_CACHE_SIZE)(_build)
+
+
+def url_cache_info():
+    """Hit/miss counters and size of this process's URL cache."""
+    return cached_url.cache_info()
+
+
+def clear_url_cache():
+    cached_url.cache_clear()
+
+
+def _version(image):
+    """The stored version of a Cloudinary field, ``None`` for a public id."""
+    version = getattr(image, 'version', None)
+    return str(version) if version else None
+
+
+def local_url(image):
+    """Default storage URL of a locally stored image, else ``None``."""
+    public_id = str(image)
+    if not public_id.startswith(f'{LOCAL_FOLDER}/'):
+        return None
+    image_format = getattr(image, 'format', None)
+    return default_storage.url(
+        f'{public_id}.{image_format}' if image_format else public_id)
+
+
+def renditions_for(image, presets=PHOTO_RENDITIONS):
+    """
+    Return the stored form of ``image``'s renditions.
+
+    ``{'public_id': ..., <preset>: url, ..., 'srcset': ...}``, or ``{}``
+    for an empty field. Raises if Cloudinary cannot build the URLs.
+    """
+    if not image:
+        return {}
+    public_id = str(image)
+    version = _version(image)
+    renditions = {'public_id': public_id}
+    if version:
+        renditions['version'] = version
+    local = local_url(image)
+    for preset in presets:
+        if local:
+            renditions[preset] = '' if preset == SRCSET else local
+        else:
+            renditions[preset] = cached_url(public_id, preset, version)
+    return renditions
+
+
+def _stored(renditions, image, preset):
+    # Only trust renditions computed for the image currently on the row
+    if (renditions and renditions.get('public_id') == str(image)
+            and renditions.get('version') == _version(image)):
+        return renditions.get(preset)
+    return None
+
+
+def image_url(image, transform_type=DEFAULT_PRESET, renditions=None):
+    """
+    Delivery URL for a Cloudinary field or public id, '' if empty.
+
+    ``renditions`` is the stored dict for this image, if any.
+    """
+    if not image:
+        return ''
+    preset = preset_name(transform_type)
+    stored = _stored(renditions, image, preset)
+    if stored:
+        return stored
+    local = local_url(image)
+    if local:
+        return local
+    try:
+        return cached_url(str(image), preset, _version(image))
+    except Exception:
+        # Fall back to the stored URL if the transformation fails
+        return getattr(image, 'url', '')
+
+
+def image_srcset(image, renditions=None):
+    """``srcset`` value covering ``SRCSET_WIDTHS``, '' if unavailable."""
+    if not image:
+        return ''
+    stored = _stored(renditions, image, SRCSET)
+    if stored:
+        return stored
+    if local_url(image):
+        # One untransformed file: nothing to choose between
+        return ''
+    try:
+        return cached_url(str(image), SRCSET, _version(image))
+    except Exception:
+        return ''
+
+
+def _renditions_or_empty(image, presets):
+    # A row without renditions still renders (live); never fail a save
+    try:
+        return renditions_for(image, presets)
+    except Exception:
+        return {}
+
+
+def photo_renditions(photo):
+    """Renditions to store on ``photo.renditions``."""
+    return _renditions_or_empty(photo.image, PHOTO_RENDITIONS)
+
+
+def profile_renditions(profile):
+    """Renditions to store on ``profile.renditions``, keyed by field."""
+    return {
+        'avatar': _renditions_or_empty(profile.avatar, AVATAR_RENDITIONS),
+        'hero_image': _renditions_or_empty(profile.hero_image,
+                                           HERO_IMAGE_RENDITIONS),
+    }
@@ -0,0 +1,77 @@
+"""
+Liking and unliking photos without read-then-write races.
+
+A toggle first tries to delete the like and only inserts when there was
+none. The like row is read ``FOR UPDATE`` before it is deleted, so of two
+concurrent unlikes one waits for the other, finds nothing and uncounts
+nothing. The insert runs in a savepoint and treats a unique-constraint
+conflict as "already liked", which is what a concurrent double-click
+produces. Counters come from the denormalized ``Photo.like_count``
+maintained by the ``Like`` signal handlers.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Like, Photo
+
+# Photo ids accepted per like-state request
+MAX_STATE_IDS = 100
+
+
+def like(photo, user):
+    """Like ``photo``; returns the new ``Like``, or ``None`` if it existed."""
+    try:
+        with transaction.atomic():
+            return Like.objects.create(photo=photo, user=user)
+    except IntegrityError:
+        return None
+
+
+def unlike(photo_id, user):
+    """Remove ``user``'s like of the photo; returns whether there was one."""
+    with transaction.atomic():
+        # The row lock makes a concurrent unlike wait, then find nothing,
+        # so the post_delete handlers uncount the like once
+        existing = Like.objects.select_for_update().filter(
+            photo_id=photo_id, user=user).first()
+        if existing is None:
+            return False
+        existing.delete()
+    return True
+
+
+def toggle(photo, user):
+    """
+    Flip ``user``'s like of ``photo``; call inside a transaction.
+
+    Returns ``(liked, created_like)``; ``created_like`` is set only when
+    this call inserted the like.
+    """
+    if unlike(photo.pk, user):
+        return False, None
+    return True, like(photo, user)
+
+
+def like_count(photo_id):
+    return Photo.objects.filter(pk=photo_id).values_list(
+        'like_count', flat=True).first() or 0
+
+
+def like_states(user, photo_ids):
+    """
+    ``{photo id: {'liked': bool, 'likes_count': int}}`` in one query.
+
+    Only published photos ``user`` may see are included; callers reject
+    more than ``MAX_STATE_IDS`` ids.
+    """
+    rows = (
+        Photo.objects.filter(pk__in=photo_ids, status=Photo.READY)
+        .filter(Q(is_public=True) | Q(owner=user))
+        .annotate(liked=Exists(Like.objects.filter(
+            photo=OuterRef('pk'), user=user)))
+        .values_list('pk', 'liked', 'like_count')
+    )
+    return {
+        pk: {'liked': liked, 'likes_count': count}
+        for pk, liked, count in rows
+    }
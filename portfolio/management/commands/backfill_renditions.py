@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portfolio import images
+from portfolio.models import Photo, Profile
+
+
+class Command(BaseCommand):
+    help = ('Compute and store preset URLs and srcsets for photos and '
+            'profile images saved before renditions were stored.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows written per chunk (default: 500)')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute every row, not just rows without renditions')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        photos = Photo.objects.only('pk', 'image', 'renditions')
+        profiles = Profile.objects.only(
+            'pk', 'avatar', 'hero_image', 'renditions')
+        if not options['all']:
+            photos = photos.filter(renditions={})
+            profiles = profiles.filter(renditions={})
+
+        photo_count = self._backfill(
+            photos, images.photo_renditions, batch_size, 'photos')
+        profile_count = self._backfill(
+            profiles, images.profile_renditions, batch_size, 'profiles')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Stored renditions for {photo_count} photo(s) and '
+            f'{profile_count} profile(s).'))
+
+    def _backfill(self, queryset, compute, batch_size, label):
+        done = 0
+        last_pk = 0
+        while True:
+            # Keyset chunks: rows filled in by earlier chunks drop out of
+            # the filter, so an OFFSET would skip rows
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not chunk:
+                return done
+            last_pk = chunk[-1].pk
+            for obj in chunk:
+                obj.renditions = compute(obj)
+            with transaction.atomic():
+                queryset.model.objects.bulk_update(chunk, ['renditions'])
+            done += len(chunk)
+            self.stdout.write(f'  {label}: {done}')
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from portfolio import timeline
+
+
+class Command(BaseCommand):
+    help = ('Seed Following timelines from existing follows and flag '
+            'accounts past TIMELINE_FANOUT_MAX_FOLLOWERS fanout_on_read. '
+            'Safe to rerun: rows already in a timeline are kept.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Timeline rows per insert '
+                 '(default: TIMELINE_FANOUT_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def progress(accounts, rows):
+            if accounts % 100 == 0:
+                self.stdout.write(
+                    f'  {accounts} account(s), {rows} timeline row(s)')
+
+        written = timeline.backfill_timelines(
+            options['batch_size'], progress)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Wrote {written} timeline row(s) in {elapsed:.1f}s.'))
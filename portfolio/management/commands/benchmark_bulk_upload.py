@@ -0,0 +1,93 @@
+import io
+import os
+import random
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+
+from portfolio import bulk_uploads
+from portfolio.direct_uploads import stored_image
+
+
+class FakeStorage:
+    """Reads each file and waits ``latency`` seconds, like a remote API."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __call__(self, fileobj, public_id, image_format):
+        while fileobj.read(64 * 1024):
+            pass
+        time.sleep(self.latency)
+        return stored_image(public_id, 1, image_format)
+
+
+class Command(BaseCommand):
+    help = ('Measure bulk upload throughput against a fake storage backend '
+            'with a fixed per-file latency. All data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--files', type=int, default=100,
+            help='Images per upload (default: 100)')
+        parser.add_argument(
+            '--size-kb', type=int, default=500,
+            help='Approximate size of each image (default: 500)')
+        parser.add_argument(
+            '--latency-ms', type=int, default=150,
+            help='Fake storage time per file (default: 150)')
+        parser.add_argument(
+            '--workers', default='1,4,8,16',
+            help='Comma-separated pool sizes to compare (default: 1,4,8,16)')
+
+    def handle(self, *args, **options):
+        total = options['files']
+        storage = FakeStorage(options['latency_ms'] / 1000)
+        with tempfile.TemporaryDirectory() as spool:
+            self.stdout.write(f'Writing {total} synthetic images...')
+            paths = self._write_images(spool, total, options['size_kb'])
+            megabytes = sum(os.path.getsize(p) for p in paths) / 2 ** 20
+
+            self.stdout.write(
+                f'{"workers":>8} {"seconds":>9} {"files/s":>9} '
+                f'{"MB/s":>8}')
+            for workers in [int(w) for w in options['workers'].split(',')]:
+                with transaction.atomic():
+                    owner = User.objects.create(username='__bulk_upload__')
+                    uploads = [File(open(p, 'rb'), name=os.path.basename(p))
+                               for p in paths]
+                    start = time.perf_counter()
+                    results = bulk_uploads.bulk_upload(
+                        owner, uploads, workers=workers, store=storage)
+                    elapsed = time.perf_counter() - start
+                    transaction.set_rollback(True)
+                created = sum(1 for r in results
+                              if r['status'] == bulk_uploads.CREATED)
+                if created != total:
+                    self.stdout.write(self.style.WARNING(
+                        f'Only {created} of {total} files were created'))
+                self.stdout.write(
+                    f'{workers:>8} {elapsed:>9.2f} '
+                    f'{total / elapsed:>9.1f} {megabytes / elapsed:>8.1f}')
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def _write_images(self, directory, count, size_kb):
+        # Random noise compresses badly, so the side length sets the size
+        side = max(int((size_kb * 1024) ** 0.5), 16)
+        rng = random.Random(0)
+        noise = Image.frombytes(
+            'RGB', (side, side), rng.randbytes(side * side * 3))
+        buffer = io.BytesIO()
+        noise.save(buffer, 'JPEG', quality=90)
+        paths = []
+        for i in range(count):
+            path = os.path.join(directory, f'frame_{i:04d}.jpg')
+            with open(path, 'wb') as f:
+                f.write(buffer.getvalue())
+            paths.append(path)
+        return paths
@@ -0,0 +1,76 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portfolio.models import Photo
+from portfolio.pagination import encode_cursor, keyset_page
+
+
+class Command(BaseCommand):
+    help = ('Benchmark keyset vs OFFSET pagination of a profile grid on a '
+            'synthetic user. All data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--photos', type=int, default=10000,
+            help='Synthetic photos for the benchmark user (default: 10000)')
+        parser.add_argument(
+            '--page-size', type=int, default=12,
+            help='Photos per page (default: 12)')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Timed runs per page, the median is reported (default: 20)')
+
+    def handle(self, *args, **options):
+        total = options['photos']
+        page_size = options['page_size']
+        repeat = options['repeat']
+
+        with transaction.atomic():
+            owner = User.objects.create(username='__feed_benchmark__')
+            self.stdout.write(f'Creating {total} synthetic photos...')
+            Photo.objects.bulk_create(
+                (Photo(owner=owner, title=f'Frame {i}', image='sample')
+                 for i in range(total)),
+                batch_size=1000,
+            )
+            queryset = Photo.objects.filter(owner=owner)
+            last_page = max((total - 1) // page_size, 0)
+            pages = sorted({0, 1, 10, 100, last_page // 2, last_page})
+            pages = [p for p in pages if p <= last_page]
+
+            self.stdout.write(
+                f'{"page":>8} {"keyset ms":>12} {"offset ms":>12}')
+            for page in pages:
+                cursor = self._cursor_before(queryset, page, page_size)
+                keyset = self._median_ms(repeat, lambda: keyset_page(
+                    queryset, cursor, page_size))
+                offset = self._median_ms(repeat, lambda: list(
+                    queryset.order_by('-created_at', '-id')[
+                        page * page_size:(page + 1) * page_size]))
+                self.stdout.write(
+                    f'{page + 1:>8} {keyset:>12.3f} {offset:>12.3f}')
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Done. Keyset pages should stay flat while OFFSET pages grow '
+            'with depth.'))
+
+    def _cursor_before(self, queryset, page, page_size):
+        """Cursor pointing at the last row of the previous page (untimed)."""
+        if page == 0:
+            return None
+        last = queryset.order_by('-created_at', '-id').values(
+            'created_at', 'id')[page * page_size - 1]
+        return encode_cursor(last['created_at'], last['id'])
+
+    def _median_ms(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,55 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+
+from portfolio import follow_suggestions
+
+
+class Command(BaseCommand):
+    help = ('Measure "who to follow" scoring time and memory on a synthetic '
+            'in-memory graph. Nothing is written to the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=100000,
+            help='Synthetic users (default: 100000)')
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Accounts followed per user (default: 20)')
+        parser.add_argument(
+            '--likes', type=int, default=30,
+            help='Photos liked per user (default: 30)')
+        parser.add_argument(
+            '--backend', choices=['scipy', 'python'], default=None,
+            help='Scoring backend (default: scipy when installed)')
+
+    def handle(self, *args, **options):
+        backend = options['backend'] or (
+            'scipy' if follow_suggestions.sparse is not None else 'python')
+        start = time.perf_counter()
+        graph = follow_suggestions.synthetic_graph(
+            options['users'], options['follows'], options['likes'])
+        built = time.perf_counter()
+
+        suggestions = users = 0
+        for _, top in follow_suggestions.score(graph, backend=backend):
+            users += 1
+            suggestions += len(top)
+        scored = time.perf_counter()
+        # Kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        self.stdout.write(f'Backend:          {backend}')
+        self.stdout.write(f'Users:            {users}')
+        self.stdout.write(
+            f'Graph:            {len(graph.follows[1])} follows, '
+            f'{len(graph.likes[1])} likes, '
+            f'{graph.nbytes / 2 ** 20:.1f} MiB CSR')
+        self.stdout.write(f'Build:            {built - start:.2f}s')
+        self.stdout.write(
+            f'Score:            {scored - built:.2f}s '
+            f'({users / (scored - built):.0f} users/s)')
+        self.stdout.write(f'Suggestions:      {suggestions}')
+        self.stdout.write(f'Peak RSS:         {peak / 2 ** 20:.1f} MiB')
+        self.stdout.write(self.style.SUCCESS('Done.'))
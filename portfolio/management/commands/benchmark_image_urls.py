@@ -0,0 +1,71 @@
+import statistics
+import time
+from types import SimpleNamespace
+
+import cloudinary
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from portfolio import images
+
+PAGE = Template(
+    '{% load image_optimization %}{% for photo in photos %}'
+    '<img src="{% optimized_image_url photo.image \'thumbnail\' %}" '
+    'srcset="{% responsive_image_srcset photo.image %}">'
+    '{% endfor %}'
+)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark rendering Cloudinary URLs for a page of photo cards '
+            'with a cold and a warm URL cache.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cards', type=int, default=100,
+            help='Photo cards on the synthetic page (default: 100)')
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Timed renders per mode, the median is reported '
+                 '(default: 50)')
+
+    def handle(self, *args, **options):
+        cards = options['cards']
+        repeat = options['repeat']
+        if not cloudinary.config().cloud_name:
+            # URL building only needs a cloud name, not credentials
+            cloudinary.config(cloud_name='benchmark')
+
+        photos = [
+            SimpleNamespace(pk=i, image=f'shutterspace/frame_{i}')
+            for i in range(cards)
+        ]
+        context = Context({'photos': photos})
+
+        def cold():
+            images.clear_url_cache()
+            PAGE.render(context)
+
+        cold_ms = self._median_ms(repeat, cold)
+        PAGE.render(context)
+        warm_ms = self._median_ms(repeat, lambda: PAGE.render(context))
+
+        info = images.url_cache_info()
+        self.stdout.write(f'{"mode":<24} {"ms/render":>10} {"us/card":>10}')
+        for label, ms in (('cold cache (before)', cold_ms),
+                          ('warm cache (after)', warm_ms)):
+            self.stdout.write(
+                f'{label:<24} {ms:>10.3f} {ms * 1000 / cards:>10.1f}')
+        self.stdout.write(
+            f'URL cache: {info.hits} hits, {info.misses} misses, '
+            f'{info.currsize}/{info.maxsize} entries')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Warm renders are {cold_ms / warm_ms:.1f}x faster.'))
+
+    def _median_ms(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
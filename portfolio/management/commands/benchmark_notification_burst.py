@@ -0,0 +1,72 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portfolio.models import Notification, Photo
+from portfolio.notifications import ACTOR_KEY, create_notification
+
+
+class Command(BaseCommand):
+    help = ('Measure notification rows written for a burst of likes on one '
+            'photo, with coalescing. All data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--likes', type=int, default=10000,
+            help='Distinct likers in the burst (default: 10000)')
+        parser.add_argument(
+            '--relike-every', type=int, default=10,
+            help='Every Nth liker also unlikes and likes again '
+                 '(default: 10, 0 to disable)')
+
+    def handle(self, *args, **options):
+        likes = options['likes']
+        relike_every = options['relike_every']
+
+        with transaction.atomic():
+            owner = User.objects.create(username='__burst_owner__')
+            photo = Photo.objects.create(
+                owner=owner, title='Viral frame', image='sample')
+            User.objects.bulk_create(
+                (User(username=f'__burst_{i}__') for i in range(likes)),
+                batch_size=1000,
+            )
+            likers = list(User.objects.filter(
+                username__startswith='__burst_', username__endswith='__')
+                .exclude(pk=owner.pk))
+            message = 'liked your photo "Viral frame"'
+
+            events = 0
+            start = time.perf_counter()
+            for i, liker in enumerate(likers, 1):
+                repeats = 2 if relike_every and i % relike_every == 0 else 1
+                for _ in range(repeats):
+                    create_notification(
+                        owner, liker, 'like', 'Someone liked your photo',
+                        f'{liker.username} {message}', photo=photo)
+                    events += 1
+            elapsed = time.perf_counter() - start
+
+            rows = Notification.objects.filter(recipient=owner)
+            written = rows.count()
+            aggregate = rows.order_by('-actor_count').first()
+            transaction.set_rollback(True)
+        # Drop the per-actor dedupe keys the burst left behind
+        cache.delete_many([
+            ACTOR_KEY.format(type='like', photo=photo.pk, actor=liker.pk)
+            for liker in likers])
+
+        self.stdout.write(f'Like events:              {events}')
+        self.stdout.write(f'Rows without coalescing:  {events}')
+        self.stdout.write(f'Rows written:             {written}')
+        if aggregate is not None:
+            self.stdout.write(
+                f'Largest notification:     {aggregate.actor_count} actors '
+                f'- "{aggregate.message}"')
+        self.stdout.write(
+            f'Elapsed:                  {elapsed:.2f}s '
+            f'({events / elapsed:.0f} events/s)')
+        self.stdout.write(self.style.SUCCESS('Done.'))
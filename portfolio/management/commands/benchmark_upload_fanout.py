@@ -0,0 +1,71 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portfolio.models import Follow, Notification, Photo, Profile, ProfileStats
+from portfolio.notifications import fan_out_upload
+
+
+class Command(BaseCommand):
+    help = ('Measure new-photo notification fan-out to a synthetic '
+            'audience in rows/s. All data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--followers', type=int, default=50000,
+            help='Followers of the uploading account (default: 50000)')
+        parser.add_argument(
+            '--mute-every', type=int, default=20,
+            help='Every Nth follower mutes upload notifications '
+                 '(default: 20, 0 to disable)')
+
+    def handle(self, *args, **options):
+        total = options['followers']
+        mute_every = options['mute_every']
+
+        with transaction.atomic():
+            owner = User.objects.create(username='__fanout_owner__')
+            self.stdout.write(f'Creating {total} synthetic followers...')
+            User.objects.bulk_create(
+                (User(username=f'__fanout_{i}__') for i in range(total)),
+                batch_size=1000,
+            )
+            follower_ids = list(
+                User.objects.filter(username__startswith='__fanout_',
+                                    username__endswith='__')
+                .exclude(pk=owner.pk).values_list('pk', flat=True))
+            Profile.objects.bulk_create(
+                (Profile(user_id=user_id, mute_upload_notifications=bool(
+                    mute_every and i % mute_every == 0))
+                 for i, user_id in enumerate(follower_ids, 1)),
+                batch_size=1000,
+            )
+            ProfileStats.objects.bulk_create(
+                (ProfileStats(user_id=user_id) for user_id in follower_ids),
+                batch_size=1000,
+            )
+            Follow.objects.bulk_create(
+                (Follow(follower_id=user_id, following=owner)
+                 for user_id in follower_ids),
+                batch_size=1000,
+            )
+            photo = Photo.objects.create(
+                owner=owner, title='Fresh frame', image='sample')
+
+            start = time.perf_counter()
+            written = fan_out_upload(
+                photo, 'New photo', 'uploaded "Fresh frame"')
+            elapsed = time.perf_counter() - start
+            stored = Notification.objects.filter(
+                photo=photo, notification_type='photo_upload').count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'Followers:              {total}')
+        self.stdout.write(f'Notifications written:  {written}')
+        self.stdout.write(f'Rows stored:            {stored}')
+        self.stdout.write(
+            f'Elapsed:                {elapsed:.2f}s '
+            f'({written / elapsed:.0f} rows/s)')
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,42 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+
+from portfolio import follow_suggestions
+
+
+class Command(BaseCommand):
+    help = ('Score "who to follow" candidates by mutual follows and shared '
+            'likes and store the top ones per user.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Users whose suggestions are replaced per transaction '
+                 '(default: 1000)')
+        parser.add_argument(
+            '--backend', choices=['scipy', 'python'], default=None,
+            help='Scoring backend (default: scipy when installed)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        graph = follow_suggestions.load_graph()
+        loaded = time.perf_counter()
+        self.stdout.write(
+            f'Loaded {len(graph)} users in {loaded - start:.2f}s '
+            f'({graph.nbytes / 2 ** 20:.1f} MiB of CSR arrays)')
+
+        scored = follow_suggestions.score(graph, backend=options['backend'])
+        users, rows = follow_suggestions.store(
+            graph, scored, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+        # Kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        self.stdout.write(
+            f'Scored and stored in {elapsed - (loaded - start):.2f}s; '
+            f'peak RSS {peak / 2 ** 20:.1f} MiB')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Stored {rows} suggestion(s) for {users} user(s) in '
+            f'{elapsed:.2f}s.'))
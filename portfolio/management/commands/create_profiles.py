@@ -1,108 +1,166 @@
-from django.core.management.base import BaseCommand
-from django.conf import settings
-from django.core.files import File
+import json
 import os
-from portfolio.models import Profile, Photo
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portfolio import direct_uploads, fragments, images, media_migration
+from portfolio.models import Photo, Profile
+
+MODELS = ('avatars', 'photos')
 
 
 class Command(BaseCommand):
-    help = 'Upload local MEDIA files to default storage (e.g. Cloudinary) and update model fields'
+    help = ('Upload local MEDIA files behind Profile.avatar and Photo.image '
+            'to Cloudinary, as they are, and update the rows. Rows already '
+            'on Cloudinary are skipped, so runs can be repeated or split '
+            'with --since-profile-id, --since-photo-id and --limit.')
 
-    def handle(self, *args, **options):
-        """
-        Safe media migration:
-        - If no cloud storage is detected (DEFAULT_FILE_STORAGE doesn't mention 'cloud' and
-          CLOUDINARY_URL isn't set), the command prints a warning and exits (safe for Heroku).
-        - For each Profile.avatar and Photo.image:
-          * Try reading the file from disk under MEDIA_ROOT and re-save it (uploads to configured storage).
-          * If the file isn't present on disk, attempt to open it through the model field storage and re-save.
-          * Each item is wrapped in try/except so one failure doesn't abort the whole run.
-        """
-        default_storage = getattr(settings, 'DEFAULT_FILE_STORAGE', '') or ''
-        has_cloud_env = 'CLOUDINARY_URL' in os.environ
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows loaded and updated per chunk (default: %(default)s)')
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='Files uploaded at the same time (default: %(default)s)')
+        parser.add_argument(
+            '--since-profile-id', type=int, default=0,
+            help='Only profiles with a greater primary key, e.g. the '
+                 'avatars last_id of a report (default: %(default)s)')
+        parser.add_argument(
+            '--since-photo-id', type=int, default=0,
+            help='Only photos with a greater primary key, e.g. the photos '
+                 'last_id of a report (default: %(default)s)')
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Rows to examine per model (default: all)')
+        parser.add_argument(
+            '--only', choices=MODELS, default=None,
+            help='Migrate just avatars or just photos (default: both)')
+        parser.add_argument(
+            '--report', default=None,
+            help='JSON file rewritten with the progress after every chunk')
 
-        # If we don't detect cloud storage, do a safe skip (so it won't crash on Heroku)
-        if 'cloud' not in default_storage.lower() and not has_cloud_env:
+    def handle(self, *args, **options):
+        # Without Cloudinary the files would only be copied around MEDIA_ROOT
+        if settings.DIRECT_UPLOAD_BACKEND != 'cloudinary':
             self.stdout.write(self.style.WARNING(
-                'Cloud storage not detected. This command is intended to be run locally with a cloud '
-                'DEFAULT_FILE_STORAGE (e.g. django-cloudinary-storage) or with CLOUDINARY_URL set. '
-                'Skipping migration.'
-            ))
+                'Cloud storage not detected. This command is intended to be '
+                'run with CLOUDINARY_URL set (DIRECT_UPLOAD_BACKEND = '
+                '"cloudinary"). Skipping migration.'))
             return
 
-        media_root = getattr(settings, 'MEDIA_ROOT', '') or ''
-
-        def safe_username(obj):
-            try:
-                return obj.user.username
-            except Exception:
-                return getattr(obj.user, 'id', 'unknown')
+        self.options = options
+        self.start = time.perf_counter()
+        self.report = {'finished': False, 'elapsed': 0.0}
+        # Rows on Cloudinary carry a version; the rest point at local files
+        profiles = (
+            Profile.objects.exclude(avatar='')
+            .exclude(avatar__startswith='image/upload/v')
+            .select_related('user')
+            .only('pk', 'avatar', 'hero_image', 'renditions', 'user__id'))
+        photos = (
+            Photo.objects.exclude(image='')
+            .exclude(image__startswith='image/upload/v')
+            .select_related('owner')
+            .only('pk', 'image', 'renditions', 'owner__id'))
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            if options['only'] in (None, 'avatars'):
+                self._migrate(
+                    'avatars', profiles, 'avatar', lambda p: p.user,
+                    images.profile_renditions, pool,
+                    options['since_profile_id'],
+                    settings.DIRECT_UPLOAD_AVATAR_FOLDER)
+            if options['only'] in (None, 'photos'):
+                self._migrate(
+                    'photos', photos, 'image', lambda p: p.owner,
+                    images.photo_renditions, pool,
+                    options['since_photo_id'], settings.DIRECT_UPLOAD_FOLDER)
 
-        # Migrate avatars
-        for profile in Profile.objects.all():
-            try:
-                field = getattr(profile, 'avatar', None)
-                if not field:
-                    continue
-                name = getattr(field, 'name', '') or ''
-                if not name:
-                    continue
+        self.report['finished'] = True
+        self._write_report()
+        summary = ', '.join(
+            f"{label}: {counts['migrated']} migrated, "
+            f"{counts['missing']} missing, {counts['failed']} failed"
+            for label, counts in self.report.items()
+            if label in MODELS)
+        self.stdout.write(self.style.SUCCESS(
+            f"Media migration complete in {self.report['elapsed']:.1f}s. "
+            f'{summary}.'))
 
-                local_path = os.path.join(media_root, name) if media_root else None
+    def _store(self, obj, field, owner, folder):
+        """Upload ``obj``'s local file untouched; runs in a pool thread."""
+        image = getattr(obj, field)
+        name = media_migration.local_name(image)
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if not os.path.isfile(path):
+            return None
+        return direct_uploads.upload_file(
+            path, direct_uploads.new_public_id(owner(obj), folder),
+            image.format or 'jpg', original=True)
 
-                if local_path and os.path.exists(local_path):
-                    try:
-                        with open(local_path, 'rb') as f:
-                            profile.avatar.save(os.path.basename(name), File(f), save=True)
-                        self.stdout.write(self.style.SUCCESS(
-                            f'Uploaded avatar for {safe_username(profile)} from disk: {name}'
-                        ))
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(
-                            f'Failed to upload avatar for {safe_username(profile)} from disk ({name}): {e}'
-                        ))
-                else:
-                    # Fallback: try opening from the field storage (may be remote)
-                    try:
-                        with profile.avatar.open('rb') as f:
-                            profile.avatar.save(os.path.basename(name), File(f), save=True)
-                        self.stdout.write(self.style.SUCCESS(
-                            f'Uploaded avatar for {safe_username(profile)} from storage: {name}'
-                        ))
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(
-                            f'Could not open avatar for {safe_username(profile)} ({name}): {e}'
-                        ))
-            except Exception as e:
-                self.stdout.write(self.style.WARNING(f'Unexpected error migrating avatar for profile {profile.pk}: {e}'))
-
-        # Migrate photos
-        for photo in Photo.objects.all():
-            try:
-                field = getattr(photo, 'image', None)
-                if not field:
+    def _migrate(self, label, queryset, field, owner, renditions, pool,
+                 since, folder):
+        counts = self.report[label] = dict.fromkeys(
+            ('examined', 'migrated', 'missing', 'failed'), 0)
+        counts['last_id'] = last_pk = since
+        limit = self.options['limit']
+        batch_size = self.options['batch_size']
+        while limit is None or counts['examined'] < limit:
+            size = batch_size
+            if limit is not None:
+                size = min(size, limit - counts['examined'])
+            # Keyset chunks: migrated rows drop out of the filter, so an
+            # OFFSET would skip rows
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk')[:size])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            futures = [pool.submit(self._store, obj, field, owner, folder)
+                       for obj in chunk]
+            updated = []
+            for obj, future in zip(chunk, futures):
+                try:
+                    image = future.result()
+                except Exception as e:
+                    counts['failed'] += 1
+                    self.stderr.write(self.style.ERROR(
+                        f'Upload failed for {label} {obj.pk}: {e}'))
                     continue
-                name = getattr(field, 'name', '') or ''
-                if not name:
+                if image is None:
+                    counts['missing'] += 1
                     continue
+                setattr(obj, field, image)
+                obj.renditions = renditions(obj)
+                updated.append(obj)
+            if updated:
+                with transaction.atomic():
+                    queryset.model.objects.bulk_update(
+                        updated, [field, 'renditions'])
+                    # bulk_update sends no post_save: expire cached cards
+                    if queryset.model is Photo:
+                        for photo in updated:
+                            fragments.bump_version(photo.pk)
+            counts['examined'] += len(chunk)
+            counts['migrated'] += len(updated)
+            counts['last_id'] = last_pk
+            self._write_report()
+            self.stdout.write(json.dumps({'model': label, **counts,
+                                          'elapsed': self.report['elapsed']}))
 
-                local_path = os.path.join(media_root, name) if media_root else None
-
-                if local_path and os.path.exists(local_path):
-                    try:
-                        with open(local_path, 'rb') as f:
-                            photo.image.save(os.path.basename(name), File(f), save=True)
-                        self.stdout.write(self.style.SUCCESS(f'Uploaded photo {photo.id} from disk: {name}'))
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(f'Failed to upload photo {photo.id} from disk ({name}): {e}'))
-                else:
-                    try:
-                        with photo.image.open('rb') as f:
-                            photo.image.save(os.path.basename(name), File(f), save=True)
-                        self.stdout.write(self.style.SUCCESS(f'Uploaded photo {photo.id} from storage: {name}'))
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(f'Could not open photo {photo.id} ({name}): {e}'))
-            except Exception as e:
-                self.stdout.write(self.style.WARNING(f'Unexpected error migrating photo {photo.pk}: {e}'))
-
-        self.stdout.write(self.style.SUCCESS('Media migration complete.'))
\ No newline at end of file
+    def _write_report(self):
+        elapsed = time.perf_counter() - self.start
+        self.report['elapsed'] = round(elapsed, 2)
+        self.report['rows_per_second'] = round(sum(
+            counts['examined'] for label, counts in self.report.items()
+            if label in MODELS) / max(elapsed, 1e-9), 1)
+        path = self.options['report']
+        if path:
+            # Written aside and renamed, so readers never see half a report
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(self.report, f, indent=2)
+            os.replace(f'{path}.tmp', path)
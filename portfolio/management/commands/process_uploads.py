@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from portfolio import uploads
+
+
+class Command(BaseCommand):
+    help = ('Store spooled photo uploads and publish them. Runs until '
+            'interrupted unless --once is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=uploads.DEFAULT_BATCH_SIZE,
+            help='Uploads claimed per batch (default: %(default)s)')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Files transferred at the same time '
+                 '(default: UPLOAD_PIPELINE_WORKERS)')
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to sleep when nothing is due (default: 1)')
+        parser.add_argument(
+            '--max-attempts', type=int, default=None,
+            help='Attempts before an upload is marked failed '
+                 '(default: UPLOAD_PIPELINE_MAX_ATTEMPTS)')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no upload is due instead of polling')
+
+    def handle(self, *args, **options):
+        if not settings.UPLOAD_PIPELINE:
+            self.stdout.write(self.style.WARNING(
+                'UPLOAD_PIPELINE is off: uploads are stored during the '
+                'request and nothing will be queued here.'))
+        workers = options['workers'] or settings.UPLOAD_PIPELINE_WORKERS
+        self.stdout.write(
+            f'Processing uploads from {settings.UPLOAD_SPOOL_DIR} with '
+            f'{workers} worker(s) ({uploads.pending_count()} pending)')
+        totals = dict.fromkeys(('ready', 'retried', 'failed'), 0)
+        try:
+            while True:
+                start = time.perf_counter()
+                result = uploads.process_batch(
+                    batch_size=options['batch_size'], workers=workers,
+                    max_attempts=options['max_attempts'])
+                if result['claimed']:
+                    elapsed = time.perf_counter() - start
+                    for key in totals:
+                        totals[key] += result[key]
+                    self.stdout.write(
+                        f"Stored {result['ready']} of {result['claimed']} "
+                        f"in {elapsed:.2f}s "
+                        f"({result['ready'] / elapsed:.1f} photos/s; "
+                        f"retried {result['retried']}, "
+                        f"failed {result['failed']})")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Stored {totals['ready']} upload(s); "
+            f"{totals['retried']} retried, {totals['failed']} failed."))
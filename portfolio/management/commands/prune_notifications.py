@@ -0,0 +1,121 @@
+import gzip
+import json
+import os
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from portfolio import notifications
+from portfolio.models import Notification
+
+ARCHIVE_FIELDS = (
+    'id', 'recipient_id', 'sender_id', 'notification_type', 'title',
+    'message', 'photo_id', 'comment_id', 'is_read', 'created_at',
+    'actor_count', 'recent_actors')
+
+
+class Command(BaseCommand):
+    help = ('Delete notifications older than NOTIFICATION_RETENTION allows, '
+            'in short id-range chunks, optionally archiving them first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Rows deleted per transaction (default: 1000)')
+        parser.add_argument(
+            '--archive-dir',
+            help='Write deleted rows to a gzipped JSONL file in this '
+                 'directory before deleting them')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report what would be deleted without deleting anything')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        rules = notifications.retention_rules()
+        for notification_type, is_read, days in rules:
+            self.stdout.write(
+                f"  {notification_type or 'default'} "
+                f"{'read' if is_read else 'unread'}: keep {days} days")
+        expired = notifications.expired_notifications(now)
+        total = expired.count()
+
+        if options['dry_run']:
+            by_type = expired.order_by().values_list(
+                'notification_type', 'is_read')
+            for (notification_type, is_read), count in sorted(
+                    Counter(by_type.iterator()).items()):
+                self.stdout.write(
+                    f"  would delete {count} {notification_type} "
+                    f"({'read' if is_read else 'unread'})")
+            self.stdout.write(self.style.SUCCESS(
+                f'Dry run: {total} notification(s) would be deleted.'))
+            return
+
+        archive = None
+        if options['archive_dir'] and total:
+            os.makedirs(options['archive_dir'], exist_ok=True)
+            path = os.path.join(
+                options['archive_dir'],
+                f"notifications-{now.strftime('%Y%m%dT%H%M%S')}.jsonl.gz")
+            archive = gzip.open(path, 'wt', encoding='utf-8')
+            self.stdout.write(f'Archiving to {path}')
+
+        start = time.perf_counter()
+        deleted = 0
+        try:
+            deleted = self._prune(expired, options['chunk_size'], archive,
+                                  total, start)
+        finally:
+            if archive is not None:
+                archive.close()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Deleted {deleted} notification(s) in {elapsed:.2f}s.'))
+
+    def _prune(self, expired, chunk_size, archive, total, start):
+        deleted = 0
+        last_pk = 0
+        while True:
+            ids = list(expired.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                return deleted
+            last_pk = ids[-1]
+            # Each chunk is its own short transaction over a bounded id
+            # range, so no lock is held across the whole table
+            with transaction.atomic():
+                # Locked so a row being marked read meanwhile cannot be
+                # uncounted twice
+                rows = list(
+                    expired.filter(pk__gte=ids[0], pk__lte=ids[-1])
+                    .select_for_update().order_by('pk')
+                    .values(*ARCHIVE_FIELDS))
+                # Archived and flushed before the delete commits: a run cut
+                # short may archive rows that are still there (a re-run
+                # archives them again), but never loses one
+                if archive is not None:
+                    for row in rows:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder))
+                        archive.write('\n')
+                    archive.flush()
+                # A plain delete, so the post_delete handler uncounts the
+                # unread rows; nothing references notifications, so no
+                # cascade is collected
+                Notification.objects.filter(
+                    pk__in=[row['id'] for row in rows]).delete()
+                # Expire the dropdown ETags; push counts that changed
+                for user_id in {row['recipient_id'] for row in rows}:
+                    notifications.bump_version(user_id)
+                for user_id in {row['recipient_id'] for row in rows
+                                if not row['is_read']}:
+                    notifications.publish_unread(user_id)
+            deleted += len(rows)
+            elapsed = time.perf_counter() - start
+            rate = deleted / elapsed if elapsed else 0
+            self.stdout.write(
+                f'  deleted {deleted}/{total} ({rate:.0f} rows/s)')
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from portfolio.stats import rebuild_profile_stats
+
+
+class Command(BaseCommand):
+    help = ('Recompute materialized ProfileStats rows from photos and '
+            'follows in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Users rebuilt per batch (default: 1000)')
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=None,
+            help='Only rebuild this username (may be repeated)')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(
+                username__in=options['usernames']).values_list(
+                    'pk', flat=True))
+        rebuilt = rebuild_profile_stats(
+            user_ids=user_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Rebuilt stats for {rebuilt} user(s).'))
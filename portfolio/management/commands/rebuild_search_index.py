@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from portfolio import search
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the full-text search index for public photos and '
+            'users in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of rows indexed per batch (default: 500)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        backend = search.get_backend()
+        if isinstance(backend, search.FallbackSearchBackend):
+            self.stdout.write(self.style.WARNING(
+                'No full-text backend for this database; search uses '
+                'unindexed filters. Nothing to rebuild.'))
+            return
+
+        def progress(kind, count):
+            self.stdout.write(f'Indexed {count} {kind} row(s)...')
+
+        totals = search.rebuild(batch_size=batch_size, progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Indexed {totals[search.KIND_PHOTO]} photo(s) and "
+            f"{totals[search.KIND_USER]} user(s)."))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portfolio.models import Photo
+
+
+class Command(BaseCommand):
+    help = ('Recompute Photo.like_count and Photo.comment_count from the '
+            'like and comment tables and fix any drift.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Photos checked per chunk (default: 1000)')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drift without writing corrections')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checked = drifted = 0
+        last_pk = 0
+
+        while True:
+            # One grouped query per chunk computes both real counts
+            chunk = list(
+                Photo.objects.filter(pk__gt=last_pk).order_by('pk')
+                .with_actual_counts()
+                .only('pk', 'like_count', 'comment_count')[:batch_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            checked += len(chunk)
+
+            fixes = []
+            for photo in chunk:
+                if (photo.like_count != photo.actual_like_count or
+                        photo.comment_count != photo.actual_comment_count):
+                    self.stdout.write(
+                        f'Photo {photo.pk}: likes {photo.like_count} -> '
+                        f'{photo.actual_like_count}, comments '
+                        f'{photo.comment_count} -> '
+                        f'{photo.actual_comment_count}')
+                    photo.like_count = photo.actual_like_count
+                    photo.comment_count = photo.actual_comment_count
+                    fixes.append(photo)
+            drifted += len(fixes)
+            if fixes and not dry_run:
+                with transaction.atomic():
+                    Photo.objects.bulk_update(
+                        fixes, ['like_count', 'comment_count'])
+
+        action = 'Found' if dry_run else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Checked {checked} photo(s). {action} {drifted} with '
+            'drifted counters.'))
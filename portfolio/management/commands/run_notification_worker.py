@@ -0,0 +1,85 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from portfolio import outbox
+
+
+class Command(BaseCommand):
+    help = ('Deliver queued notifications from the outbox. Runs until '
+            'interrupted; several workers may run at once on PostgreSQL.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=outbox.DEFAULT_BATCH_SIZE,
+            help='Events claimed per transaction (default: %(default)s)')
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to wait when the outbox is empty (default: 1)')
+        parser.add_argument(
+            '--max-attempts', type=int, default=None,
+            help='Attempts before an event is marked failed '
+                 '(default: NOTIFICATION_OUTBOX_MAX_ATTEMPTS)')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no events are due instead of waiting')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Without the outbox the cache and broker are not shared, so upload
+        # fan-outs are left to the web process that queued them
+        fanouts = settings.NOTIFICATION_OUTBOX
+        if not fanouts:
+            self.stdout.write(self.style.WARNING(
+                'NOTIFICATION_OUTBOX is off: requests deliver notifications '
+                'inline and web processes send upload fan-outs, so only '
+                'events already queued will be sent.'))
+        if settings.NOTIFICATION_BROKER == 'local':
+            self.stdout.write(self.style.WARNING(
+                "NOTIFICATION_BROKER is 'local': open streams in other "
+                'processes will not see notifications sent from here.'))
+        totals = dict.fromkeys(
+            ('claimed', 'delivered', 'skipped', 'retried', 'failed'), 0)
+        start = time.perf_counter()
+        try:
+            while True:
+                result = outbox.deliver_batch(
+                    batch_size, options['max_attempts'])
+                for key, value in result.items():
+                    totals[key] += value
+                if result['claimed']:
+                    self.stdout.write(
+                        'Delivered {delivered}, skipped {skipped}, '
+                        'retrying {retried}, failed {failed}'.format(**result))
+                fanout = None
+                if fanouts:
+                    fanout = outbox.deliver_fanout(options['max_attempts'])
+                if fanout is not None:
+                    totals['delivered'] += fanout['written']
+                    self._report_fanout(fanout)
+                if result['claimed'] < batch_size and fanout is None:
+                    # Drained what was due; a full batch means more may wait
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{totals['delivered']} delivered in {elapsed:.2f}s; "
+            f"{outbox.pending_count()} still queued.")
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def _report_fanout(self, fanout):
+        if fanout['error']:
+            self.stdout.write(self.style.WARNING(
+                f"Fan-out of photo {fanout['photo_id']} failed after "
+                f"{fanout['written']} notifications: {fanout['error']}"))
+            return
+        seconds = fanout['seconds']
+        rate = fanout['written'] / seconds if seconds else 0
+        self.stdout.write(
+            f"Notified {fanout['written']} followers of photo "
+            f"{fanout['photo_id']} in {seconds:.2f}s ({rate:.0f} rows/s)")
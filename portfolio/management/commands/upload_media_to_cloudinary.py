@@ -1,7 +1,14 @@
-from django.core.management.base import BaseCommand
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+
 from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portfolio import direct_uploads, fragments, images, media_migration
 from portfolio.models import Photo
-import os
 
 try:
     import cloudinary
@@ -9,10 +16,19 @@ try:
 except Exception:
     cloudinary = None
 
+MANIFEST_NAME = '.cloudinary_manifest.jsonl'
+
+
+def upload(path):
+    # Stored as it is: no incoming resize or eager renditions
+    result = cloudinary.uploader.upload(path, resource_type='image')
+    return {key: result[key] for key in ('public_id', 'version', 'format')}
+
 
 class Command(BaseCommand):
     help = ('Upload local media/photos files to Cloudinary and update '
-            'Photo.image field.')
+            'Photo.image field. Safe to rerun: files listed in the '
+            'manifest are not uploaded again.')
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -22,6 +38,16 @@ class Command(BaseCommand):
             '--path',
             default=os.path.join(settings.MEDIA_ROOT, 'photos'),
             help='Path to local photos folder')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Files uploaded at the same time (default: %(default)s)')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Photos loaded and updated per chunk (default: %(default)s)')
+        parser.add_argument(
+            '--manifest', default=None,
+            help=f'Checkpoint file of uploaded files (default: '
+                 f'{MANIFEST_NAME} in the photos folder)')
 
     def handle(self, *args, **options):
         if cloudinary is None:
@@ -31,57 +57,114 @@ class Command(BaseCommand):
             return
 
         photos_path = options['path']
-        dry_run = options['dry_run']
-
         if not os.path.isdir(photos_path):
             self.stderr.write(f'Photos path does not exist: {photos_path}')
             return
 
-        # Map filenames to Photo objects (by basename)
-        photos_map = {}
-        for p in Photo.objects.all():
-            if p.image:
-                name = os.path.basename(p.image.name)
-                photos_map.setdefault(name, []).append(p)
+        manifest = media_migration.Manifest(
+            options['manifest'] or os.path.join(photos_path, MANIFEST_NAME))
+        if len(manifest):
+            self.stdout.write(
+                f'Resuming: {len(manifest)} file(s) in {manifest.path}')
+        self.totals = dict.fromkeys(
+            (media_migration.UPLOADED, media_migration.DEDUPED,
+             media_migration.SKIPPED, 'missing', 'failed', 'photos', 'bytes'),
+            0)
+        self.start = self.last_report = time.perf_counter()
+
+        # Photos already on Cloudinary carry a version and are left out
+        photos = (Photo.objects.exclude(image='')
+                  .exclude(image__startswith='image/upload/v')
+                  .only('pk', 'image', 'renditions').order_by('pk')
+                  .iterator(chunk_size=options['batch_size']))
+        store = media_migration.ContentStore(manifest, upload)
+        with manifest, ThreadPoolExecutor(
+                max_workers=options['workers']) as pool:
+            while chunk := list(islice(photos, options['batch_size'])):
+                if options['dry_run']:
+                    self._dry_run(chunk, photos_path, manifest)
+                else:
+                    self._migrate(chunk, photos_path, store, pool)
 
-        uploaded = 0
-        for fname in sorted(os.listdir(photos_path)):
-            full = os.path.join(photos_path, fname)
+        elapsed = time.perf_counter() - self.start
+        totals = self.totals
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Updated {totals['photos']} Photo(s) in {elapsed:.1f}s: "
+            f"{totals['uploaded']} file(s) uploaded "
+            f"({totals['bytes'] / 2 ** 20:.1f} MB, "
+            f"{totals['bytes'] / 2 ** 20 / max(elapsed, 1e-9):.2f} MB/s), "
+            f"{totals['deduped']} deduplicated by content, "
+            f"{totals['skipped']} already in the manifest, "
+            f"{totals['missing']} missing, {totals['failed']} failed."))
+
+    def _files(self, chunk, photos_path):
+        """Group the chunk's photos by the local file they point at."""
+        files = {}
+        for photo in chunk:
+            name = os.path.basename(
+                media_migration.local_name(photo.image))
+            full = os.path.join(photos_path, name)
             if not os.path.isfile(full):
-                continue
-            self.stdout.write(f'Found file: {fname}')
-            if fname not in photos_map:
+                self.totals['missing'] += 1
                 self.stdout.write(self.style.WARNING(
-                    f'No Photo record references {fname}; skipping'))
-                continue
-            if dry_run:
-                photo_count = len(photos_map[fname])
-                self.stdout.write(self.style.NOTICE(
-                    f'Would upload {full} and update {photo_count} Photo(s)'))
+                    f'Photo {photo.pk}: {name} not found; skipping'))
                 continue
+            files.setdefault(name, []).append(photo)
+        return files
+
+    def _dry_run(self, chunk, photos_path, manifest):
+        for name, photos in self._files(chunk, photos_path).items():
+            action = ('Would reuse' if name in manifest.by_path
+                      else 'Would upload')
+            self.stdout.write(self.style.NOTICE(
+                f'{action} {os.path.join(photos_path, name)} and update '
+                f'{len(photos)} Photo(s)'))
 
-            # Upload to Cloudinary
+    def _migrate(self, chunk, photos_path, store, pool):
+        files = self._files(chunk, photos_path)
+        futures = {
+            pool.submit(store.store, name, os.path.join(photos_path, name)):
+            name for name in files}
+        updated = []
+        for future in as_completed(futures):
+            name = futures[future]
             try:
-                res = cloudinary.uploader.upload(full, resource_type='image')
-                url = res.get('secure_url')
-                public_id = res.get('public_id')
-                self.stdout.write(self.style.SUCCESS(
-                    f'Uploaded {fname} to {url}'))
+                entry, how = future.result()
             except Exception as e:
+                self.totals['failed'] += 1
                 self.stderr.write(self.style.ERROR(
-                    f'Upload failed for {fname}: {e}'))
+                    f'Upload failed for {name}: {e}'))
                 continue
+            self.totals[how] += 1
+            if how == media_migration.UPLOADED:
+                self.totals['bytes'] += os.path.getsize(
+                    os.path.join(photos_path, name))
+            for photo in files[name]:
+                photo.image = direct_uploads.stored_image(
+                    entry['public_id'], entry['version'], entry['format'])
+                photo.renditions = images.photo_renditions(photo)
+                updated.append(photo)
+            self._report()
+        if updated:
+            with transaction.atomic():
+                Photo.objects.bulk_update(updated, ['image', 'renditions'])
+                # bulk_update sends no post_save, so expire cached cards here
+                for photo in updated:
+                    fragments.bump_version(photo.pk)
+            self.totals['photos'] += len(updated)
 
-            # Update Photo instances to point to the public_id
-            # (Cloudinary storage backend will craft URL)
-            for p in photos_map[fname]:
-                # store the public_id or full URL depending on your
-                # storage backend; here set to public_id
-                # If using django-cloudinary-storage, you can store the
-                # public_id with folder if needed.
-                p.image.name = public_id
-                p.save()
-                uploaded += 1
-
-        self.stdout.write(self.style.SUCCESS(
-            f'Done. Uploaded and updated {uploaded} Photo(s).'))
+    def _report(self):
+        """Print throughput at most once a second."""
+        now = time.perf_counter()
+        if now - self.last_report < 1:
+            return
+        self.last_report = now
+        elapsed = now - self.start
+        totals = self.totals
+        files = sum(totals[key] for key in (
+            media_migration.UPLOADED, media_migration.DEDUPED,
+            media_migration.SKIPPED))
+        self.stdout.write(
+            f'  {files} file(s), {totals["failed"]} failed: '
+            f'{files / elapsed:.1f} files/s, '
+            f'{totals["bytes"] / 2 ** 20 / elapsed:.2f} MB/s')
@@ -0,0 +1,151 @@
+"""
+Resumable, concurrent copying of local media files to Cloudinary.
+
+Rows saved before the move still hold a file name relative to
+``MEDIA_ROOT`` (see ``local_name``); rows already on Cloudinary carry a
+version, and both migration commands leave them out in SQL, so they can
+be run again safely.
+
+``create_profiles`` uploads the files behind ``Profile.avatar`` and
+``Photo.image`` from a thread pool, in keyset chunks that can be limited
+with ``--since-profile-id``, ``--since-photo-id`` and ``--limit``. Both
+commands store the files untransformed, without the incoming resize or
+eager renditions of new uploads. ``upload_media_to_cloudinary`` streams
+the photos that still point at local files, stores each chunk's files from
+a thread pool and saves the new image values with one ``bulk_update`` per
+chunk.
+
+Every stored file is appended to a ``Manifest``: one JSON object per line
+with the file's path, its SHA-256 digest and the stored image, flushed as
+it is written. Running the command again after an interruption reads the
+manifest back, so files it lists are not uploaded again, and
+``ContentStore`` reuses the upload of any file whose bytes were already
+stored under another name.
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+UPLOADED = 'uploaded'
+SKIPPED = 'skipped'
+DEDUPED = 'deduped'
+
+
+def local_name(image):
+    """
+    The path under ``MEDIA_ROOT`` of a file saved before Cloudinary, from
+    the ``CloudinaryResource`` its row now parses to.
+    """
+    if image.format:
+        return f'{image.public_id}.{image.format}'
+    return image.public_id
+
+
+def file_digest(path):
+    """SHA-256 hex digest of the file at ``path``, read in chunks."""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+class Manifest:
+    """
+    Append-only record of stored files, looked up by path and by digest.
+
+    Entries are dicts with ``path``, ``sha256``, ``public_id``, ``version``
+    and ``format``. A line cut short by an interruption is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.by_path = {}
+        self.by_digest = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except ValueError:
+                        continue
+
+    def __len__(self):
+        return len(self.by_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _add(self, entry):
+        self.by_path[entry['path']] = entry
+        self.by_digest.setdefault(entry['sha256'], entry)
+
+    def record(self, path, digest, stored):
+        """Append ``stored`` (``public_id``, ``version``, ``format``)."""
+        entry = {'path': path, 'sha256': digest, **stored}
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            self._add(entry)
+        return entry
+
+
+class ContentStore:
+    """
+    Store files through ``upload(path)`` at most once per content.
+
+    ``upload`` returns ``public_id``, ``version`` and ``format``.
+    ``store`` is safe to call from several threads: when two threads hash
+    the same bytes at once, one uploads and the other waits for it.
+    """
+
+    def __init__(self, manifest, upload):
+        self.manifest = manifest
+        self.upload = upload
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def store(self, name, path):
+        """
+        Return ``(entry, how)`` for the file at ``path``, recorded in the
+        manifest under ``name``; ``how`` is ``UPLOADED``, ``SKIPPED`` (the
+        manifest already lists ``name``) or ``DEDUPED``.
+        """
+        entry = self.manifest.by_path.get(name)
+        if entry is not None:
+            return entry, SKIPPED
+        digest = file_digest(path)
+        with self._lock:
+            existing = self.manifest.by_digest.get(digest)
+            future = self._pending.get(digest)
+            uploading = existing is None and future is None
+            if uploading:
+                future = self._pending[digest] = Future()
+        if not uploading:
+            stored = _stored(existing) if existing else future.result()
+            return self.manifest.record(name, digest, stored), DEDUPED
+        try:
+            stored = self.upload(path)
+            # Recorded before the digest leaves _pending, so no other
+            # thread can miss both and upload the bytes again
+            entry = self.manifest.record(name, digest, stored)
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[digest]
+        future.set_result(stored)
+        return entry, UPLOADED
+
+
+def _stored(entry):
+    return {key: entry[key] for key in ('public_id', 'version', 'format')}
@@ -0,0 +1,81 @@
+from django.db import migrations
+
+TABLE = 'portfolio_searchentry'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE {TABLE} ("
+            "id bigserial PRIMARY KEY, "
+            "kind varchar(16) NOT NULL, "
+            "object_id bigint NOT NULL, "
+            "document tsvector NOT NULL, "
+            "UNIQUE (kind, object_id))"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX {TABLE}_document_gin "
+            f"ON {TABLE} USING gin (document)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+            "kind UNINDEXED, object_id UNINDEXED, title, body, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def populate_search_index(apps, schema_editor):
+    """Index existing public photos and users using historical models."""
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('postgresql', 'sqlite'):
+        return
+    Photo = apps.get_model('portfolio', 'Photo')
+    User = apps.get_model('auth', 'User')
+    Profile = apps.get_model('portfolio', 'Profile')
+    display_names = dict(
+        Profile.objects.values_list('user_id', 'display_name'))
+
+    rows = [
+        ('photo', 0, p.pk, p.title, p.description)
+        for p in Photo.objects.filter(is_public=True).iterator()
+    ]
+    for u in User.objects.iterator():
+        body = ' '.join(part for part in (
+            u.first_name, u.last_name, display_names.get(u.pk, '')) if part)
+        rows.append(('user', 1, u.pk, u.username, body))
+
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (kind, object_id, document) VALUES "
+                "(%s, %s, setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B'))",
+                [(kind, pk, title, body)
+                 for kind, _offset, pk, title, body in rows]
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (rowid, kind, object_id, title, body) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [(pk * 2 + offset, kind, pk, title, body)
+                 for kind, offset, pk, title, body in rows]
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0008_alter_like_unique_together_follow_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:54
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Photo = apps.get_model('portfolio', 'Photo')
+    Like = apps.get_model('portfolio', 'Like')
+    Comment = apps.get_model('portfolio', 'Comment')
+    likes = dict(Like.objects.values_list('photo_id').annotate(n=Count('id')))
+    comments = dict(
+        Comment.objects.values_list('photo_id').annotate(n=Count('id')))
+    photos = []
+    for photo in Photo.objects.only('id').iterator():
+        photo.like_count = likes.get(photo.id, 0)
+        photo.comment_count = comments.get(photo.id, 0)
+        photos.append(photo)
+    Photo.objects.bulk_update(
+        photos, ['like_count', 'comment_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0011_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_profile_stats(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    Photo = apps.get_model('portfolio', 'Photo')
+    Follow = apps.get_model('portfolio', 'Follow')
+    ProfileStats = apps.get_model('portfolio', 'ProfileStats')
+    photo_totals = {
+        row['owner_id']: row for row in
+        Photo.objects.order_by().values('owner_id').annotate(
+            photos=Count('id'), likes=Sum('like_count'),
+            comments=Sum('comment_count'))
+    }
+    followers = dict(Follow.objects.order_by().values_list(
+        'following_id').annotate(n=Count('id')))
+    following = dict(Follow.objects.order_by().values_list(
+        'follower_id').annotate(n=Count('id')))
+    rows = []
+    for pk in User.objects.values_list('pk', flat=True).iterator():
+        totals = photo_totals.get(pk, {})
+        rows.append(ProfileStats(
+            user_id=pk,
+            photos_count=totals.get('photos', 0),
+            likes_received=totals.get('likes') or 0,
+            comments_received=totals.get('comments') or 0,
+            followers_count=followers.get(pk, 0),
+            following_count=following.get(pk, 0),
+        ))
+    ProfileStats.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('portfolio', '0012_photo_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('photos_count', models.PositiveIntegerField(default=0)),
+                ('likes_received', models.PositiveIntegerField(default=0)),
+                ('comments_received', models.PositiveIntegerField(default=0)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+                ('following_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'profile stats',
+            },
+        ),
+        migrations.RunPython(backfill_profile_stats,
+                             migrations.RunPython.noop),
+    ]
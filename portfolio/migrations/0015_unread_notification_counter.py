@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:11
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_unread_counts(apps, schema_editor):
+    Notification = apps.get_model('portfolio', 'Notification')
+    ProfileStats = apps.get_model('portfolio', 'ProfileStats')
+    unread = (
+        Notification.objects.filter(is_read=False).order_by()
+        .values_list('recipient_id').annotate(n=Count('id'))
+    )
+    for user_id, count in unread.iterator():
+        ProfileStats.objects.filter(user_id=user_id).update(
+            unread_notifications=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0014_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilestats',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_counts,
+                             migrations.RunPython.noop),
+    ]
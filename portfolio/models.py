@@ -1,8 +1,10 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 
 
@@ -21,23 +23,142 @@ class Profile(models.Model):
     location = models.CharField(max_length=150, blank=True)
     instagram = models.CharField(max_length=100, blank=True)
     show_email = models.BooleanField(default=False)
+    # Skip "new photo" notifications from accounts this user follows
+    mute_upload_notifications = models.BooleanField(default=False)
+    # Accounts with very large audiences are not fanned out to follower
+    # timelines; their photos are merged into the Following feed on read
+    fanout_on_read = models.BooleanField(default=False, db_index=True)
+    # Precomputed delivery URLs for avatar and hero image, keyed by field
+    # (see portfolio.images.profile_renditions)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Profile({self.user.username})"
 
 
+class PhotoQuerySet(models.QuerySet):
+    def feed_for(self, user, recent_comments=3):
+        """
+        Photos annotated with everything a photo card renders.
+
+        Adds ``liked_by_me``, joins the owner and profile, and prefetches the
+        latest ``recent_comments`` comments (with authors) into
+        ``photo.recent_comments`` so a page of cards costs a fixed number of
+        queries regardless of its size. Like and comment totals come from
+        the stored ``like_count``/``comment_count`` counters. Photos still
+        being processed are left out.
+        """
+        if user is not None and user.is_authenticated:
+            liked_by_me = models.Exists(Like.objects.filter(
+                photo=models.OuterRef('pk'), user=user))
+        else:
+            liked_by_me = models.Value(
+                False, output_field=models.BooleanField())
+        comments = (
+            Comment.objects.select_related('author')
+            .order_by('-created_at', '-id')[:recent_comments]
+        )
+        return self.filter(status=Photo.READY).select_related(
+            'owner__profile').annotate(
+            liked_by_me=liked_by_me,
+        ).prefetch_related(
+            models.Prefetch('comments', queryset=comments,
+                            to_attr='recent_comments')
+        )
+
+    def with_actual_counts(self):
+        """
+        Annotate ``actual_like_count``/``actual_comment_count`` computed
+        from the like and comment tables, for reconciling the counters.
+        """
+        return self.annotate(
+            actual_like_count=_count_subquery(Like),
+            actual_comment_count=_count_subquery(Comment),
+        )
+
+
+def _count_subquery(model):
+    """Correlated COUNT of ``model`` rows pointing at the outer photo."""
+    counts = (
+        model.objects.filter(photo=models.OuterRef('pk'))
+        .order_by().values('photo')
+        .annotate(total=models.Count('pk')).values('total')
+    )
+    return Coalesce(
+        models.Subquery(counts, output_field=models.IntegerField()), 0)
+
+
 class Photo(models.Model):
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     image = CloudinaryField('image')
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_public = models.BooleanField(default=True)
+    # Denormalized counters, kept in step with Like/Comment rows by the
+    # handlers in portfolio.signals (see also reconcile_counters)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Precomputed preset URLs and srcset, filled in on upload (see
+    # portfolio.images.photo_renditions and backfill_renditions)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Photos uploaded through the pipeline stay 'processing' (and out of the
+    # feeds) until ``process_uploads`` has stored the image
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=READY)
+
+    objects = PhotoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the public feed and profile grids
+            models.Index(fields=['is_public', '-created_at', '-id'],
+                         name='photo_public_feed_idx'),
+            models.Index(fields=['owner', '-created_at', '-id'],
+                         name='photo_owner_feed_idx'),
+        ]
 
     def __str__(self):
         return f"Photo({self.title} by {self.owner.username})"
 
 
+class PhotoUpload(models.Model):
+    """
+    An uploaded image waiting in the spool directory for
+    ``process_uploads`` to store it.
+    """
+    photo = models.OneToOneField(
+        Photo,
+        on_delete=models.CASCADE,
+        related_name='upload'
+    )
+    # File name inside UPLOAD_SPOOL_DIR
+    spool_name = models.CharField(max_length=255)
+    public_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'],
+                         name='photo_upload_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"PhotoUpload({self.photo_id}, attempts={self.attempts})"
+
+
 class Comment(models.Model):
     photo = models.ForeignKey(
         Photo, on_delete=models.CASCADE, related_name='comments')
@@ -79,6 +200,13 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'following')
+        # Keyset pages of each side of the graph, newest first
+        indexes = [
+            models.Index(fields=['following', 'created_at', 'id'],
+                         name='follow_followers_idx'),
+            models.Index(fields=['follower', 'created_at', 'id'],
+                         name='follow_following_idx'),
+        ]
         constraints = [
             models.CheckConstraint(
                 condition=~models.Q(follower=models.F('following')),
@@ -90,6 +218,78 @@ class Follow(models.Model):
         return f"{self.follower.username} follows {self.following.username}"
 
 
+class ProfileStats(models.Model):
+    """
+    Materialized profile header counters.
+
+    Maintained incrementally by the handlers in ``portfolio.signals`` and
+    rebuilt in bulk by ``portfolio.stats.rebuild_profile_stats``.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    photos_count = models.PositiveIntegerField(default=0)
+    likes_received = models.PositiveIntegerField(default=0)
+    comments_received = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Durable copy of the cached unread notification count (see
+    # portfolio.notifications.unread_count); not part of the public stats
+    unread_notifications = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'profile stats'
+
+    def __str__(self):
+        return f"ProfileStats({self.user_id})"
+
+    def as_dict(self):
+        return {
+            'photos': self.photos_count,
+            'likes_received': self.likes_received,
+            'comments_received': self.comments_received,
+            'followers': self.followers_count,
+            'following': self.following_count,
+        }
+
+
+class TimelineEntry(models.Model):
+    """A photo materialized into one user's Following feed"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    # Denormalized from the photo so reads and unfollow cleanup never join
+    owner = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'photo')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-photo'],
+                         name='timeline_user_feed_idx'),
+            models.Index(fields=['user', 'owner'],
+                         name='timeline_user_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f"TimelineEntry({self.user_id}: photo {self.photo_id})"
+
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('like', 'Like'),
@@ -131,6 +331,14 @@ class Notification(models.Model):
     )
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Likes and comments on one photo are coalesced into a single row (see
+    # portfolio.notifications); ``sender`` is then the latest actor
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actors = models.JSONField(default=list, blank=True)
+    # Key of the outbox event that produced this row, so a redelivered
+    # event cannot create a second notification
+    idempotency_key = models.CharField(
+        max_length=100, unique=True, null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
@@ -158,9 +366,79 @@ class Notification(models.Model):
 
     def mark_as_read(self):
         """Mark this notification as read"""
-        if not self.is_read:
-            self.is_read = True
-            self.save(update_fields=['is_read'])
+        # Imported here: portfolio.notifications imports this module
+        from .notifications import mark_as_read
+        mark_as_read(self)
+
+
+class FollowSuggestion(models.Model):
+    """
+    A precomputed "who to follow" entry, written in bulk by
+    ``compute_follow_suggestions``.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='follow_suggestions'
+    )
+    suggested = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    score = models.FloatField()
+    # Accounts the user follows that follow ``suggested``
+    mutual_follows = models.PositiveIntegerField(default=0)
+    # Photos both of them liked
+    shared_likes = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [
+            models.Index(fields=['user', '-score'],
+                         name='follow_suggestion_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"FollowSuggestion({self.user_id} -> {self.suggested_id})"
+
+
+class NotificationOutbox(models.Model):
+    """
+    A notification waiting to be delivered by ``run_notification_worker``.
+
+    Rows are inserted in the same transaction as the like, comment or
+    follow that caused them. They carry plain ids rather than foreign keys
+    so the insert maintains no extra indexes; the worker drops events whose
+    objects have since been deleted.
+    """
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    notification_type = models.CharField(
+        max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    recipient_id = models.BigIntegerField()
+    sender_id = models.BigIntegerField(null=True, blank=True)
+    photo_id = models.BigIntegerField(null=True, blank=True)
+    comment_id = models.BigIntegerField(null=True, blank=True)
+    title = models.CharField(max_length=255)
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Retry bookkeeping; ``failed`` rows have used up their attempts
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    failed = models.BooleanField(default=False)
+    # Follower fan-outs: last follower id notified, so a retry resumes
+    cursor = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['failed', 'available_at', 'id'],
+                         name='outbox_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"NotificationOutbox({self.idempotency_key})"
 
 
 # auto-create Profile when a User is created
@@ -0,0 +1,391 @@
+"""
+Creating notifications, counting unread ones and pushing both to open
+notification streams.
+
+The unread count is read from the cache; on a miss it is reloaded from
+``ProfileStats.unread_notifications``, so the badge never counts the
+notifications table. Every write adjusts the column in the writer's
+transaction and the cached value after commit.
+
+Each user also has a cached notifications version, bumped whenever one of
+their notifications is added or rewritten; with the unread count it forms
+the dropdown's ETag, so revalidating an unchanged dropdown needs no query.
+
+Likes and comments on the same photo are coalesced: while an unread
+notification of that type for the photo is younger than
+``NOTIFICATION_COALESCE_WINDOW`` seconds, new actors are folded into it
+("alice and 41 others liked your photo") instead of adding rows, and a
+repeat like from someone already counted is dropped.
+"""
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import stats
+from .events import (
+    EVENT_NOTIFICATION, EVENT_NOTIFICATION_UPDATED, EVENT_UNREAD, Event,
+    get_broker, publish)
+from .models import Follow, Notification, ProfileStats
+
+UNREAD_KEY = 'notifications:unread:{}'
+VERSION_KEY = 'notifications:version:{}'
+# Marks an actor as already counted in a photo's coalesced notification
+ACTOR_KEY = 'notifications:actor:{type}:{photo}:{actor}'
+
+COALESCED_TYPES = ('like', 'comment')
+# Usernames kept on a coalesced notification for display
+RECENT_ACTORS = 3
+
+COALESCED_MESSAGES = {
+    'like': '{actors} liked your photo "{title}"',
+    'comment': '{actors} commented on your photo "{title}"',
+}
+
+
+def unread_count(user_id):
+    """``user_id``'s unread notification count, without a COUNT query."""
+    key = UNREAD_KEY.format(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = ProfileStats.objects.filter(user_id=user_id).values_list(
+            'unread_notifications', flat=True).first()
+        if count is None:
+            # No stats row yet: build it, which counts the table once
+            stats.rebuild_profile_stats([user_id])
+            count = ProfileStats.objects.get(
+                user_id=user_id).unread_notifications
+        cache.add(key, count, timeout=settings.UNREAD_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def adjust_unread(user_id, delta):
+    """Move ``user_id``'s unread counter by ``delta`` (never below zero)."""
+    if not delta:
+        return
+    ProfileStats.objects.filter(user_id=user_id).update(
+        unread_notifications=Greatest(F('unread_notifications') + delta, 0))
+
+    def update_cache():
+        key = UNREAD_KEY.format(user_id)
+        try:
+            if cache.incr(key, delta) < 0:
+                cache.delete(key)
+        except ValueError:
+            # Not cached; the next read loads the column
+            pass
+    transaction.on_commit(update_cache)
+
+
+def adjust_unread_many(user_ids, delta):
+    """
+    ``adjust_unread`` for many users with one UPDATE.
+
+    Their cached counts and versions are dropped after commit rather than
+    adjusted one key at a time; the next read reloads them.
+    """
+    ProfileStats.objects.filter(user_id__in=user_ids).update(
+        unread_notifications=Greatest(F('unread_notifications') + delta, 0))
+    keys = [UNREAD_KEY.format(user_id) for user_id in user_ids]
+    keys += [VERSION_KEY.format(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def notifications_version(user_id):
+    """``user_id``'s notifications version, seeded if missing."""
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so an evicted version never comes back with
+        # a value an old ETag was built from
+        cache.add(key, time.time_ns(),
+                  timeout=settings.UNREAD_COUNT_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(user_id):
+    """Change ``user_id``'s notifications version once the write commits."""
+    def bump():
+        key = VERSION_KEY.format(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(),
+                      timeout=settings.UNREAD_COUNT_CACHE_TIMEOUT)
+    transaction.on_commit(bump)
+
+
+def dropdown_etag(user_id):
+    """ETag for ``user_id``'s notification dropdown; cache reads only."""
+    return f'{notifications_version(user_id)}-{unread_count(user_id)}'
+
+
+def serialize_notification(notification):
+    """The JSON shape used by the dropdown and the stream."""
+    return {
+        'id': notification.id,
+        'title': notification.title,
+        'message': notification.message,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M'),
+        'url': notification.get_url(),
+        'sender_username': (
+            notification.sender.username if notification.sender else None
+        ),
+        'type': notification.notification_type,
+        'actor_count': notification.actor_count,
+        'recent_actors': notification.recent_actors,
+    }
+
+
+def notification_event(notification):
+    return Event(EVENT_NOTIFICATION, serialize_notification(notification),
+                 id=notification.pk)
+
+
+def updated_event(notification):
+    # No event id: the stream only replays and dedupes new notifications
+    return Event(EVENT_NOTIFICATION_UPDATED,
+                 serialize_notification(notification))
+
+
+def unread_event(count):
+    return Event(EVENT_UNREAD, {'unread_count': count})
+
+
+def latest_notification_id(user_id):
+    """Id of ``user_id``'s newest notification, 0 if they have none."""
+    latest = Notification.objects.filter(recipient_id=user_id).order_by(
+        '-id').values_list('id', flat=True).first()
+    return latest or 0
+
+
+def backlog(user_id, after_id, limit=20):
+    """
+    Events for a stream (re)connecting after notification ``after_id``:
+    up to ``limit`` newer notifications, oldest first, then the count.
+    """
+    missed = list(
+        Notification.objects.filter(recipient_id=user_id, id__gt=after_id)
+        .select_related('sender', 'photo').order_by('-id')[:limit]
+    )
+    replay = [notification_event(n) for n in reversed(missed)]
+    return replay + [unread_event(unread_count(user_id))]
+
+
+def publish_unread(user_id):
+    """Push ``user_id``'s unread count to their open streams after commit."""
+    # Registered after adjust_unread's cache update, so it reads the new
+    # count
+    transaction.on_commit(lambda: get_broker().publish(
+        user_id, unread_event(unread_count(user_id))))
+
+
+def mark_as_read(notification):
+    """Mark one notification read; only the first caller decrements."""
+    if notification.is_read:
+        return
+    with transaction.atomic():
+        marked = Notification.objects.filter(
+            pk=notification.pk, is_read=False).update(is_read=True)
+        notification.is_read = True
+        if marked:
+            adjust_unread(notification.recipient_id, -1)
+            publish_unread(notification.recipient_id)
+
+
+def mark_all_as_read(user_id):
+    """Mark every unread notification read; returns how many changed."""
+    with transaction.atomic():
+        marked = Notification.objects.filter(
+            recipient_id=user_id, is_read=False).update(is_read=True)
+        # Subtract what was marked rather than writing 0, so a notification
+        # created concurrently keeps its place in the count
+        adjust_unread(user_id, -marked)
+        publish_unread(user_id)
+    return marked
+
+
+def retention_rules():
+    """
+    ``[(notification_type, is_read, days)]`` from ``NOTIFICATION_RETENTION``.
+
+    ``notification_type`` is ``None`` for the default rule, which covers
+    every type without its own entry; rules keeping rows forever are left
+    out.
+    """
+    policy = settings.NOTIFICATION_RETENTION
+    default = policy.get('default', {})
+    types = [None] + [t for t, _ in Notification.NOTIFICATION_TYPES
+                      if t in policy]
+    rules = []
+    for notification_type in types:
+        days = dict(default, **policy.get(notification_type, {}))
+        for state, is_read in (('read', True), ('unread', False)):
+            if days.get(state) is not None:
+                rules.append((notification_type, is_read, days[state]))
+    return rules
+
+
+def expired_notifications(now=None):
+    """Notifications older than their retention rule allows."""
+    now = now or timezone.now()
+    overridden = [t for t, _ in Notification.NOTIFICATION_TYPES
+                  if t in settings.NOTIFICATION_RETENTION]
+    expired = Q(pk__in=[])
+    for notification_type, is_read, days in retention_rules():
+        if notification_type is None:
+            of_type = ~Q(notification_type__in=overridden)
+        else:
+            of_type = Q(notification_type=notification_type)
+        expired |= of_type & Q(
+            is_read=is_read, created_at__lt=now - timedelta(days=days))
+    return Notification.objects.filter(expired)
+
+
+def _actors_text(recent_actors, actor_count):
+    others = actor_count - 1
+    if others <= 0:
+        return recent_actors[0]
+    return f"{recent_actors[0]} and {others} other{'s' if others > 1 else ''}"
+
+
+def _coalesce(recipient, sender, notification_type, photo, comment):
+    """
+    Fold this event into a recent unread notification for the photo.
+
+    Returns ``(handled, notification)``; ``handled`` is False when there
+    is nothing to fold into and a new row should be created.
+    """
+    window = settings.NOTIFICATION_COALESCE_WINDOW
+    existing = (
+        Notification.objects.select_for_update()
+        .filter(recipient=recipient, photo=photo,
+                notification_type=notification_type, is_read=False,
+                created_at__gte=timezone.now() - timedelta(seconds=window))
+        .order_by('-created_at').first()
+    )
+    # Remember every actor for the window, including the one who starts a
+    # new notification, so their repeat events are recognised
+    actor_key = ACTOR_KEY.format(
+        type=notification_type, photo=photo.pk, actor=sender.pk)
+    seen = not cache.add(actor_key, 1, timeout=window) or (
+        existing is not None and sender.username in existing.recent_actors)
+    if seen and notification_type == 'like':
+        # Unlike/relike churn: this liker has already been notified about
+        return True, None
+    if existing is None:
+        return False, None
+
+    recent = [sender.username] + [
+        name for name in existing.recent_actors if name != sender.username]
+    existing.recent_actors = recent[:RECENT_ACTORS]
+    if not seen:
+        existing.actor_count += 1
+    existing.sender = sender
+    if comment is not None:
+        existing.comment = comment
+    existing.message = COALESCED_MESSAGES[notification_type].format(
+        actors=_actors_text(existing.recent_actors, existing.actor_count),
+        title=photo.title)
+    existing.save(update_fields=[
+        'recent_actors', 'actor_count', 'sender', 'comment', 'message'])
+    bump_version(recipient.pk)
+    publish(recipient.pk, updated_event(existing))
+    return True, existing
+
+
+def create_notification(recipient, sender, notification_type, title, message,
+                        photo=None, comment=None, idempotency_key=None):
+    """
+    Utility function to create notifications
+
+    Likes and comments on a photo may be coalesced into an existing
+    notification, which is returned instead; a suppressed duplicate like
+    returns ``None``. ``idempotency_key`` is recorded on a new row so the
+    outbox worker cannot deliver the same event twice.
+    """
+    # Don't create notification if sender is same as recipient
+    if sender == recipient:
+        return None
+
+    with transaction.atomic():
+        if (notification_type in COALESCED_TYPES and photo is not None
+                and sender is not None):
+            handled, notification = _coalesce(
+                recipient, sender, notification_type, photo, comment)
+            if handled:
+                return notification
+
+        # Create the notification
+        notification = Notification.objects.create(
+            recipient=recipient,
+            sender=sender,
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            photo=photo,
+            comment=comment,
+            recent_actors=[sender.username] if sender else [],
+            idempotency_key=idempotency_key,
+        )
+        adjust_unread(recipient.pk, 1)
+        bump_version(recipient.pk)
+        publish(recipient.pk, notification_event(notification))
+        publish_unread(recipient.pk)
+    return notification
+
+
+def fan_out_upload(photo, title, message, after=0, on_chunk=None):
+    """
+    Notify the owner's followers about a newly uploaded ``photo``.
+
+    Followers are streamed in id order with ``.iterator()`` and notified
+    with one ``bulk_create`` and one counter UPDATE per chunk of
+    ``NOTIFICATION_FANOUT_BATCH_SIZE``, each chunk in its own transaction.
+    Followers who muted upload notifications are skipped. ``after`` resumes
+    past a follower id; ``on_chunk(last_follower_id)`` runs inside each
+    chunk's transaction so a checkpoint commits with the rows. Returns the
+    number of notifications written.
+    """
+    batch_size = settings.NOTIFICATION_FANOUT_BATCH_SIZE
+    follower_ids = (
+        Follow.objects.filter(following_id=photo.owner_id,
+                              follower_id__gt=after)
+        .exclude(follower__profile__mute_upload_notifications=True)
+        .order_by('follower_id')
+        .values_list('follower_id', flat=True)
+        .iterator(chunk_size=batch_size)
+    )
+    written = 0
+    while True:
+        chunk = list(islice(follower_ids, batch_size))
+        if not chunk:
+            return written
+        with transaction.atomic():
+            created = Notification.objects.bulk_create([
+                Notification(
+                    recipient_id=user_id,
+                    sender=photo.owner,
+                    notification_type='photo_upload',
+                    title=title,
+                    message=message,
+                    photo=photo,
+                    recent_actors=[photo.owner.username],
+                )
+                for user_id in chunk
+            ])
+            adjust_unread_many(chunk, 1)
+            for notification in created:
+                publish(notification.recipient_id,
+                        notification_event(notification))
+            if on_chunk is not None:
+                on_chunk(chunk[-1])
+        written += len(chunk)
@@ -0,0 +1,312 @@
+"""
+Transactional outbox for notifications.
+
+Views call ``enqueue_notification`` inside the transaction that records the
+like, comment or follow, which costs one INSERT into
+``NotificationOutbox`` and nothing else: no coalescing lookup, counter
+update or broadcast on the request path. The event exists exactly when the
+change that caused it commits.
+
+``manage.py run_notification_worker`` drains the outbox with
+``deliver_batch``: it claims due rows (``SKIP LOCKED`` where the database
+supports it, so several workers can share the table), creates the
+notifications with one ``bulk_create`` plus one counter update per
+recipient, and deletes the delivered rows in the same transaction. Likes
+and comments still go through ``create_notification`` one by one so they
+are coalesced. Each event carries an idempotency key that is stored on the
+notification it produces, so an event redelivered after a crash is
+skipped instead of notifying twice. Failed events are retried with
+exponential backoff until ``NOTIFICATION_OUTBOX_MAX_ATTEMPTS``, then kept
+with ``failed`` set for inspection in the admin.
+
+A photo upload queues a single fan-out event instead of one per follower,
+whether or not ``NOTIFICATION_OUTBOX`` is on, so the upload request never
+writes followers' notifications. ``deliver_fanout`` leases it (pushing
+``available_at`` forward rather than holding a row lock) and writes the
+followers' notifications chunk by chunk, checkpointing the last follower id
+on the event in each chunk's transaction so a crashed fan-out resumes where
+it stopped. With ``NOTIFICATION_FANOUT_THREAD`` the process that queued the
+fan-out also drains it on a background thread after commit. The worker
+only delivers fan-outs with ``NOTIFICATION_OUTBOX`` on: otherwise its
+cache is not the web processes', and the counts and versions it drops
+would stay stale there. A fan-out the thread does not finish stays queued
+until the next upload's thread drains it.
+"""
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .events import publish
+from .models import Comment, Notification, NotificationOutbox, Photo
+from .notifications import (
+    COALESCED_TYPES, adjust_unread, bump_version, create_notification,
+    fan_out_upload, notification_event, publish_unread)
+
+DEFAULT_BATCH_SIZE = 500
+# Events delivered to every follower of the sender by ``deliver_fanout``
+FANOUT_TYPES = ('photo_upload',)
+
+# One thread, so fan-outs queued by concurrent uploads run one at a time
+_fanout_thread = ThreadPoolExecutor(max_workers=1,
+                                    thread_name_prefix='upload-fanout')
+
+
+def enqueue_notification(idempotency_key, recipient, sender,
+                         notification_type, title, message, photo=None,
+                         comment=None):
+    """
+    Queue a notification for delivery; call it inside the transaction that
+    makes the change being notified about.
+
+    ``idempotency_key`` names the causing event (``'like:<like id>'``);
+    queueing the same key twice is a no-op. With ``NOTIFICATION_OUTBOX``
+    off the notification is created inline instead.
+    """
+    if sender == recipient:
+        return
+    if not settings.NOTIFICATION_OUTBOX:
+        create_notification(recipient, sender, notification_type, title,
+                            message, photo=photo, comment=comment,
+                            idempotency_key=idempotency_key)
+        return
+    NotificationOutbox.objects.bulk_create([NotificationOutbox(
+        idempotency_key=idempotency_key,
+        notification_type=notification_type,
+        recipient_id=recipient.pk,
+        sender_id=sender.pk if sender else None,
+        photo_id=photo.pk if photo else None,
+        comment_id=comment.pk if comment else None,
+        title=title,
+        message=message,
+    )], ignore_conflicts=True)
+
+
+def enqueue_upload_fanout(photo, title, message):
+    """
+    Queue notifying the owner's followers about ``photo``; call it inside
+    the upload's transaction.
+
+    The fan-out always goes through the outbox, even with
+    ``NOTIFICATION_OUTBOX`` off. With ``NOTIFICATION_FANOUT_THREAD`` it is
+    also started on a background thread once the upload commits.
+    """
+    if not photo.is_public:
+        return
+    if settings.NOTIFICATION_FANOUT_THREAD:
+        transaction.on_commit(
+            lambda: _fanout_thread.submit(_drain_in_background))
+    NotificationOutbox.objects.bulk_create([NotificationOutbox(
+        idempotency_key=f'photo_upload:{photo.pk}',
+        notification_type='photo_upload',
+        recipient_id=photo.owner_id,
+        sender_id=photo.owner_id,
+        photo_id=photo.pk,
+        title=title,
+        message=message,
+    )], ignore_conflicts=True)
+
+
+def drain_fanouts(max_attempts=None):
+    """Run due follower fan-outs until none is left; returns how many ran."""
+    ran = 0
+    while deliver_fanout(max_attempts) is not None:
+        ran += 1
+    return ran
+
+
+def _drain_in_background():
+    try:
+        drain_fanouts()
+    finally:
+        # The thread's connection would otherwise stay open between runs
+        connections.close_all()
+
+
+def pending_count():
+    """Events waiting for delivery, including ones backing off."""
+    return NotificationOutbox.objects.filter(failed=False).count()
+
+
+def _due():
+    return NotificationOutbox.objects.filter(
+        failed=False, available_at__lte=timezone.now()
+    ).order_by('available_at', 'id')
+
+
+def _resolve(event, users, photos, comments):
+    """The event's objects, or ``None`` if any of them has been deleted."""
+    recipient = users.get(event.recipient_id)
+    sender = users.get(event.sender_id) if event.sender_id else None
+    photo = photos.get(event.photo_id) if event.photo_id else None
+    comment = comments.get(event.comment_id) if event.comment_id else None
+    if (recipient is None or (event.sender_id and sender is None)
+            or (event.photo_id and photo is None)
+            or (event.comment_id and comment is None)):
+        return None
+    return recipient, sender, photo, comment
+
+
+def _deliver(events, result):
+    """Create the notifications for ``events``; returns the failures."""
+    users = User.objects.in_bulk(
+        {e.recipient_id for e in events} |
+        {e.sender_id for e in events if e.sender_id})
+    photos = Photo.objects.in_bulk(
+        {e.photo_id for e in events if e.photo_id})
+    comments = Comment.objects.in_bulk(
+        {e.comment_id for e in events if e.comment_id})
+    delivered = set(Notification.objects.filter(
+        idempotency_key__in=[e.idempotency_key for e in events]
+    ).values_list('idempotency_key', flat=True))
+
+    rows, failures = [], []
+    for event in events:
+        objects = None
+        if event.idempotency_key not in delivered:
+            objects = _resolve(event, users, photos, comments)
+        if objects is None:
+            # Already delivered, or about something that no longer exists
+            result['skipped'] += 1
+            continue
+        recipient, sender, photo, comment = objects
+        if (event.notification_type in COALESCED_TYPES and photo is not None
+                and sender is not None):
+            try:
+                with transaction.atomic():
+                    create_notification(
+                        recipient, sender, event.notification_type,
+                        event.title, event.message, photo=photo,
+                        comment=comment,
+                        idempotency_key=event.idempotency_key)
+            except Exception as exc:
+                failures.append((event, exc))
+                continue
+        else:
+            rows.append(Notification(
+                recipient=recipient,
+                sender=sender,
+                notification_type=event.notification_type,
+                title=event.title,
+                message=event.message,
+                photo=photo,
+                comment=comment,
+                recent_actors=[sender.username] if sender else [],
+                idempotency_key=event.idempotency_key,
+            ))
+        result['delivered'] += 1
+
+    created = Notification.objects.bulk_create(rows)
+    for notification in created:
+        publish(notification.recipient_id, notification_event(notification))
+    for user_id, count in Counter(
+            n.recipient_id for n in created).items():
+        adjust_unread(user_id, count)
+        bump_version(user_id)
+        publish_unread(user_id)
+    return failures
+
+
+def _retry(failures, max_attempts):
+    """Reschedule failed events with backoff, or give up on them."""
+    now = timezone.now()
+    for event, exc in failures:
+        event.attempts += 1
+        event.last_error = f'{type(exc).__name__}: {exc}'
+        if event.attempts >= max_attempts:
+            event.failed = True
+        else:
+            delay = settings.NOTIFICATION_OUTBOX_RETRY_DELAY * 2 ** (
+                event.attempts - 1)
+            event.available_at = now + timedelta(seconds=delay)
+    NotificationOutbox.objects.bulk_update(
+        [event for event, _ in failures],
+        ['attempts', 'last_error', 'failed', 'available_at'])
+
+
+def deliver_batch(batch_size=DEFAULT_BATCH_SIZE, max_attempts=None):
+    """
+    Deliver up to ``batch_size`` due events in one transaction.
+
+    Returns counts: ``claimed``, ``delivered``, ``skipped`` (duplicates and
+    events about deleted objects), ``retried`` and ``failed``.
+    """
+    max_attempts = max_attempts or settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS
+    result = dict.fromkeys(
+        ('claimed', 'delivered', 'skipped', 'retried', 'failed'), 0)
+    with transaction.atomic():
+        events = list(
+            _due().exclude(notification_type__in=FANOUT_TYPES)
+            .select_for_update(skip_locked=True)[:batch_size])
+        if not events:
+            return result
+        result['claimed'] = len(events)
+        try:
+            with transaction.atomic():
+                failures = _deliver(events, result)
+        except Exception as exc:
+            # The bulk insert failed: nothing in this batch was delivered
+            result['delivered'] = result['skipped'] = 0
+            failures = [(event, exc) for event in events]
+
+        failed_ids = {event.pk for event, _ in failures}
+        NotificationOutbox.objects.filter(
+            pk__in=[e.pk for e in events if e.pk not in failed_ids]
+        ).delete()
+        if failures:
+            _retry(failures, max_attempts)
+            gave_up = sum(1 for event, _ in failures if event.failed)
+            result['failed'] = gave_up
+            result['retried'] = len(failures) - gave_up
+    return result
+
+
+def _lease_until():
+    return timezone.now() + timedelta(
+        seconds=settings.NOTIFICATION_FANOUT_LEASE)
+
+
+def deliver_fanout(max_attempts=None):
+    """
+    Run one due follower fan-out, or return ``None`` if there is none.
+
+    Returns ``photo_id``, ``written`` (notifications created), ``seconds``
+    and ``error`` (``None`` on success).
+    """
+    max_attempts = max_attempts or settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS
+    with transaction.atomic():
+        event = (_due().filter(notification_type__in=FANOUT_TYPES)
+                 .select_for_update(skip_locked=True).first())
+        if event is None:
+            return None
+        event.available_at = _lease_until()
+        event.save(update_fields=['available_at'])
+
+    result = {'photo_id': event.photo_id, 'written': 0, 'seconds': 0.0,
+              'error': None}
+    photo = Photo.objects.select_related('owner').filter(
+        pk=event.photo_id, is_public=True).first()
+    if photo is not None:
+        def checkpoint(follower_id):
+            # Also renews the lease while the fan-out makes progress
+            NotificationOutbox.objects.filter(pk=event.pk).update(
+                cursor=follower_id, available_at=_lease_until())
+
+        start = time.perf_counter()
+        try:
+            result['written'] = fan_out_upload(
+                photo, event.title, event.message, after=event.cursor,
+                on_chunk=checkpoint)
+        except Exception as exc:
+            result['error'] = f'{type(exc).__name__}: {exc}'
+            _retry([(event, exc)], max_attempts)
+            return result
+        finally:
+            result['seconds'] = time.perf_counter() - start
+    event.delete()
+    return result
@@ -0,0 +1,68 @@
+"""
+Keyset (cursor) pagination for newest-first listings.
+
+Pages are addressed by an opaque cursor holding the ``(created_at, id)`` of
+the last row already shown, so fetching page N is the same indexed range
+scan as fetching page 1 instead of an ever-growing OFFSET.
+"""
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(created_at, pk):
+    """Return an opaque, URL-safe cursor for a ``(created_at, pk)`` key."""
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor produced by ``encode_cursor``.
+
+    Returns ``(created_at, pk)`` or ``None`` for a missing or malformed
+    cursor, which callers treat as "start from the first page".
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        timestamp, pk = raw.rsplit('|', 1)
+        created_at = parse_datetime(timestamp)
+        if created_at is None:
+            return None
+        return created_at, int(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, cursor, page_size, field='created_at',
+                tiebreak='id'):
+    """
+    Return ``(items, next_cursor)`` for one page of ``queryset``.
+
+    Rows are ordered by ``(-field, -tiebreak)``; ``next_cursor`` is ``None``
+    on the last page. The queryset should be backed by a composite index on
+    the filter columns followed by ``(field, tiebreak)``.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        value, pk = position
+        # The leading ``field <= value`` bound lets the database start an
+        # index range scan at the cursor; the OR only breaks ties.
+        queryset = queryset.filter(**{f'{field}__lte': value}).filter(
+            Q(**{f'{field}__lt': value}) | Q(**{f'{tiebreak}__lt': pk})
+        )
+    # Fetch one extra row to learn whether another page exists
+    items = list(
+        queryset.order_by(f'-{field}', f'-{tiebreak}')[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(
+            getattr(last, field), getattr(last, tiebreak))
+    return items, next_cursor
@@ -0,0 +1,377 @@
+"""
+Full-text search index for photos and users.
+
+The index lives in the ``portfolio_searchentry`` table created by migration
+0009. Its shape depends on the database vendor:
+
+* PostgreSQL: a regular table with a ``tsvector`` column and a GIN index,
+  ranked with ``ts_rank``.
+* SQLite: an FTS5 virtual table, ranked with ``bm25``.
+
+Any other vendor falls back to the old ``icontains`` filters so search keeps
+working, just without an index. Entries are kept in sync by the signal
+handlers in ``portfolio.signals`` and can be rebuilt from scratch with
+``python manage.py rebuild_search_index``.
+"""
+import re
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+
+from .models import Photo
+
+TABLE = 'portfolio_searchentry'
+KIND_PHOTO = 'photo'
+KIND_USER = 'user'
+
+# Tokens shorter than this are ignored to keep prefix queries selective
+MIN_TOKEN_LENGTH = 2
+MAX_QUERY_TOKENS = 8
+
+
+def tokenize(query):
+    """Split a raw search string into safe, lower-cased word tokens."""
+    tokens = [t for t in re.findall(r'\w+', query.lower())
+              if len(t) >= MIN_TOKEN_LENGTH]
+    return tokens[:MAX_QUERY_TOKENS]
+
+
+def photo_document(photo):
+    """Return the (title, body) pair indexed for a photo."""
+    return photo.title or '', photo.description or ''
+
+
+def user_document(user):
+    """Return the (title, body) pair indexed for a user."""
+    display_name = ''
+    profile = getattr(user, 'profile', None)
+    if profile is not None:
+        display_name = profile.display_name
+    body = ' '.join(
+        part for part in (user.first_name, user.last_name, display_name)
+        if part
+    )
+    return user.username, body
+
+
+class SearchPage:
+    """
+    A page of ranked results.
+
+    Mirrors the parts of ``django.core.paginator.Page`` the templates use,
+    without running a COUNT over the whole match set.
+    """
+
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class BaseSearchBackend:
+    """Interface shared by the vendor-specific backends."""
+
+    def upsert(self, kind, rows):
+        """Insert or replace ``(object_id, title, body)`` rows."""
+        raise NotImplementedError
+
+    def delete(self, kind, object_ids):
+        raise NotImplementedError
+
+    def clear(self, kind=None):
+        raise NotImplementedError
+
+    def search(self, kind, tokens, limit, offset=0):
+        """Return matching object ids, best match first."""
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector column with a GIN index, ranked by ts_rank."""
+
+    # 'simple' avoids stemming so usernames and prefixes match literally
+    config = 'simple'
+
+    def upsert(self, kind, rows):
+        sql = (
+            f"INSERT INTO {TABLE} (kind, object_id, document) VALUES "
+            f"(%s, %s, setweight(to_tsvector('{self.config}', %s), 'A') || "
+            f"setweight(to_tsvector('{self.config}', %s), 'B')) "
+            "ON CONFLICT (kind, object_id) "
+            "DO UPDATE SET document = EXCLUDED.document"
+        )
+        params = [(kind, pk, title, body) for pk, title, body in rows]
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    def delete(self, kind, object_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {TABLE} WHERE kind = %s "
+                "AND object_id = ANY(%s)",
+                [kind, list(object_ids)]
+            )
+
+    def clear(self, kind=None):
+        with connection.cursor() as cursor:
+            if kind is None:
+                cursor.execute(f"TRUNCATE {TABLE}")
+            else:
+                cursor.execute(
+                    f"DELETE FROM {TABLE} WHERE kind = %s", [kind])
+
+    def search(self, kind, tokens, limit, offset=0):
+        tsquery = ' & '.join(f"{t}:*" for t in tokens)
+        sql = (
+            f"SELECT object_id FROM {TABLE}, "
+            f"to_tsquery('{self.config}', %s) AS query "
+            "WHERE kind = %s AND document @@ query "
+            "ORDER BY ts_rank(document, query) DESC, object_id DESC "
+            "LIMIT %s OFFSET %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [tsquery, kind, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    FTS5 virtual table ranked by bm25.
+
+    Rows use a deterministic rowid (``object_id * 2 + kind offset``) so
+    updates and deletes are primary-key operations rather than scans.
+    """
+
+    kind_offsets = {KIND_PHOTO: 0, KIND_USER: 1}
+    # bm25 weights for (kind, object_id, title, body)
+    rank_expression = f"bm25({TABLE}, 0.0, 0.0, 10.0, 1.0)"
+
+    def _rowid(self, kind, object_id):
+        return int(object_id) * 2 + self.kind_offsets[kind]
+
+    def upsert(self, kind, rows):
+        rows = list(rows)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {TABLE} WHERE rowid = %s",
+                [(self._rowid(kind, pk),) for pk, _title, _body in rows]
+            )
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (rowid, kind, object_id, title, body) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [(self._rowid(kind, pk), kind, pk, title, body)
+                 for pk, title, body in rows]
+            )
+
+    def delete(self, kind, object_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {TABLE} WHERE rowid = %s",
+                [(self._rowid(kind, pk),) for pk in object_ids]
+            )
+
+    def clear(self, kind=None):
+        with connection.cursor() as cursor:
+            if kind is None:
+                cursor.execute(f"DELETE FROM {TABLE}")
+            else:
+                cursor.execute(
+                    f"DELETE FROM {TABLE} WHERE kind = %s", [kind])
+
+    def search(self, kind, tokens, limit, offset=0):
+        match = ' '.join(f'"{t}"*' for t in tokens)
+        sql = (
+            f"SELECT object_id FROM {TABLE} "
+            f"WHERE {TABLE} MATCH %s AND kind = %s "
+            f"ORDER BY {self.rank_expression}, object_id DESC "
+            "LIMIT %s OFFSET %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, kind, limit, offset])
+            return [int(row[0]) for row in cursor.fetchall()]
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """Unindexed icontains filters for databases without a FTS backend."""
+
+    def upsert(self, kind, rows):
+        pass
+
+    def delete(self, kind, object_ids):
+        pass
+
+    def clear(self, kind=None):
+        pass
+
+    def search(self, kind, tokens, limit, offset=0):
+        if kind == KIND_PHOTO:
+            queryset = Photo.objects.filter(is_public=True, status=Photo.READY)
+            for token in tokens:
+                queryset = queryset.filter(
+                    Q(title__icontains=token) |
+                    Q(description__icontains=token)
+                )
+        else:
+            queryset = User.objects.all()
+            for token in tokens:
+                queryset = queryset.filter(
+                    Q(username__icontains=token) |
+                    Q(first_name__icontains=token) |
+                    Q(last_name__icontains=token) |
+                    Q(profile__display_name__icontains=token)
+                )
+        queryset = queryset.order_by('-pk').values_list('pk', flat=True)
+        return list(queryset[offset:offset + limit])
+
+
+_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend():
+    """Return the search backend for the default database connection."""
+    return _BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+# ===== INDEX MAINTENANCE =====
+
+
+def index_photo(photo):
+    """Add or refresh a photo in the index; private photos are removed."""
+    backend = get_backend()
+    if photo.is_public:
+        title, body = photo_document(photo)
+        backend.upsert(KIND_PHOTO, [(photo.pk, title, body)])
+    else:
+        backend.delete(KIND_PHOTO, [photo.pk])
+
+
+def index_photos(photos):
+    """Add newly created public ``photos`` to the index in one upsert."""
+    rows = [(p.pk, *photo_document(p)) for p in photos if p.is_public]
+    if rows:
+        get_backend().upsert(KIND_PHOTO, rows)
+
+
+def remove_photo(photo_id):
+    get_backend().delete(KIND_PHOTO, [photo_id])
+
+
+def index_user(user):
+    title, body = user_document(user)
+    get_backend().upsert(KIND_USER, [(user.pk, title, body)])
+
+
+def remove_user(user_id):
+    get_backend().delete(KIND_USER, [user_id])
+
+
+def _batches(queryset, batch_size):
+    """Yield lists of objects from ``queryset`` using primary-key keysets."""
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[
+            :batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def rebuild(batch_size=500, progress=None):
+    """
+    Rebuild the whole index in primary-key batches.
+
+    ``progress`` is called with ``(kind, indexed_so_far)`` after each batch.
+    Returns a dict with the number of indexed rows per kind.
+    """
+    backend = get_backend()
+    backend.clear()
+    totals = {KIND_PHOTO: 0, KIND_USER: 0}
+
+    photos = Photo.objects.filter(is_public=True, status=Photo.READY).only(
+        'pk', 'title', 'description')
+    for batch in _batches(photos, batch_size):
+        backend.upsert(
+            KIND_PHOTO, [(p.pk, *photo_document(p)) for p in batch])
+        totals[KIND_PHOTO] += len(batch)
+        if progress:
+            progress(KIND_PHOTO, totals[KIND_PHOTO])
+
+    users = User.objects.select_related('profile').only(
+        'pk', 'username', 'first_name', 'last_name', 'profile__display_name')
+    for batch in _batches(users, batch_size):
+        backend.upsert(KIND_USER, [(u.pk, *user_document(u)) for u in batch])
+        totals[KIND_USER] += len(batch)
+        if progress:
+            progress(KIND_USER, totals[KIND_USER])
+    return totals
+
+
+# ===== QUERIES =====
+
+
+def _page_number(page):
+    try:
+        return max(int(page), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def search_photos(query, page=1, per_page=None, viewer=None):
+    """
+    Return a ``SearchPage`` of public photos ranked by relevance.
+
+    Photos are loaded through ``Photo.objects.feed_for(viewer)`` so result
+    cards carry the same annotations as the home feed.
+    """
+    per_page = per_page or settings.SEARCH_RESULTS_PER_PAGE
+    number = _page_number(page)
+    tokens = tokenize(query)
+    if not tokens:
+        return SearchPage([], number, False)
+    # Fetch one extra id to learn whether a next page exists
+    ids = get_backend().search(
+        KIND_PHOTO, tokens, per_page + 1, (number - 1) * per_page)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    photos = Photo.objects.filter(is_public=True).feed_for(viewer).in_bulk(
+        ids)
+    return SearchPage(
+        [photos[pk] for pk in ids if pk in photos], number, has_next)
+
+
+def search_users(query, limit=None):
+    """Return the best matching users for ``query``, best match first."""
+    limit = limit or settings.SEARCH_USER_RESULTS
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    ids = get_backend().search(KIND_USER, tokens, limit)
+    users = User.objects.select_related('profile').in_bulk(ids)
+    return [users[pk] for pk in ids if pk in users]
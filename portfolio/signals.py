@@ -0,0 +1,270 @@
+"""
+Signal handlers that keep derived data in sync with the core models.
+"""
+import weakref
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import (
+    follows, fragments, notifications, search, stats, suggest, uploads)
+from .models import (
+    Comment, Follow, Like, Notification, Photo, Profile, ProfileStats)
+
+
+# ===== PHOTO DELETION =====
+# Deleting a photo cascades to its likes and comments. Their delete handlers
+# skip rows whose photo goes in the same ``delete()`` call (its ``origin``),
+# so a photo with N likes does not update itself, its owner's stats and its
+# card N times. They are tallied instead, and ``count_photo_on_delete``
+# uncounts the tally with one update once the photo itself is deleted.
+
+# delete() origin -> {id of a photo it deletes: Counter of skipped rows}
+_deleting_photos = weakref.WeakKeyDictionary()
+
+
+@receiver(pre_delete, sender=Photo)
+def remember_deleting_photo(sender, instance, origin=None, **kwargs):
+    if origin is not None:
+        _deleting_photos.setdefault(origin, {})[instance.pk] = Counter()
+
+
+def _photo_deleted(instance, origin, stat=None):
+    """
+    Whether a like's or comment's photo is deleted along with it; if so,
+    ``stat`` is tallied for the photo's owner.
+    """
+    if origin is None:
+        return False
+    tally = _deleting_photos.get(origin, {}).get(instance.photo_id)
+    if tally is None:
+        return False
+    if stat:
+        tally[stat] += 1
+    return True
+
+
+# ===== PUBLISHING =====
+# A photo is counted, indexed and suggested once it is ready: when it is
+# created ready here, or by ``uploads`` when a processed upload turns ready.
+# Saves that change ``status`` belong to that transition and are skipped by
+# the edit handlers below.
+
+
+def _edited(instance, created, update_fields):
+    """Whether a save is an edit of an already published photo."""
+    return (not created and instance.status == Photo.READY
+            and 'status' not in (update_fields or ()))
+
+
+@receiver(post_save, sender=Photo)
+def publish_photo_on_create(sender, instance, created, **kwargs):
+    if created and instance.status == Photo.READY:
+        uploads.photos_published(instance.owner_id, [instance])
+
+
+# ===== SEARCH INDEX =====
+
+
+@receiver(post_save, sender=Photo)
+def index_photo_on_save(sender, instance, created, update_fields, **kwargs):
+    if _edited(instance, created, update_fields):
+        search.index_photo(instance)
+
+
+@receiver(post_delete, sender=Photo)
+def unindex_photo_on_delete(sender, instance, **kwargs):
+    search.remove_photo(instance.pk)
+
+
+def _user_document_changed(update_fields):
+    """Whether a User save can change what is indexed for the user."""
+    # Logging in saves only last_login
+    return update_fields is None or not update_fields.isdisjoint(
+        ('username', 'first_name', 'last_name'))
+
+
+@receiver(post_save, sender=User)
+def index_user_on_save(sender, instance, update_fields, **kwargs):
+    if _user_document_changed(update_fields):
+        search.index_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user_on_delete(sender, instance, **kwargs):
+    search.remove_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def index_profile_on_save(sender, instance, **kwargs):
+    search.index_user(instance.user)
+
+
+# ===== SEARCH SUGGESTIONS =====
+
+
+@receiver(post_save, sender=Photo)
+def suggest_photo_changed(sender, instance, created, update_fields,
+                          **kwargs):
+    if _edited(instance, created, update_fields):
+        suggest.record_change(suggest.KIND_PHOTO, instance.pk)
+
+
+@receiver(post_delete, sender=Photo)
+def suggest_photo_removed(sender, instance, **kwargs):
+    suggest.record_change(suggest.KIND_PHOTO, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def suggest_user_changed(sender, instance, update_fields, **kwargs):
+    if _user_document_changed(update_fields):
+        suggest.record_change(suggest.KIND_USER, instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def suggest_user_removed(sender, instance, **kwargs):
+    suggest.record_change(suggest.KIND_USER, instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def suggest_profile_changed(sender, instance, **kwargs):
+    suggest.record_change(suggest.KIND_USER, instance.user_id)
+
+
+# ===== PHOTO CARD CACHE =====
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Photo)
+def expire_card_on_photo_change(sender, instance, **kwargs):
+    fragments.bump_version(instance.pk)
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_card_on_activity(sender, instance, origin=None, **kwargs):
+    if not _photo_deleted(instance, origin):
+        fragments.bump_version(instance.photo_id)
+
+
+# ===== PHOTO COUNTERS =====
+# These run inside the caller's transaction, including the one Django opens
+# for cascade deletes, so the counters move together with the rows.
+
+
+def _bump(photo_id, field, delta):
+    photos = Photo.objects.filter(pk=photo_id)
+    if delta < 0:
+        # Never push a drifted counter below zero
+        photos = photos.filter(**{f'{field}__gt': 0})
+    photos.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Like)
+def count_like_on_create(sender, instance, created, **kwargs):
+    if created:
+        _bump(instance.photo_id, 'like_count', 1)
+
+
+@receiver(post_delete, sender=Like)
+def count_like_on_delete(sender, instance, origin=None, **kwargs):
+    if not _photo_deleted(instance, origin):
+        _bump(instance.photo_id, 'like_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_on_create(sender, instance, created, **kwargs):
+    if created:
+        _bump(instance.photo_id, 'comment_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_comment_on_delete(sender, instance, origin=None, **kwargs):
+    if not _photo_deleted(instance, origin):
+        _bump(instance.photo_id, 'comment_count', -1)
+
+
+# ===== PROFILE STATS =====
+
+
+@receiver(post_save, sender=User)
+def create_profile_stats(sender, instance, created, **kwargs):
+    if created:
+        ProfileStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_delete, sender=Photo)
+def count_photo_on_delete(sender, instance, origin=None, **kwargs):
+    # The likes and comments deleted with the photo, tallied as they went
+    tally = Counter()
+    if origin is not None:
+        tally = _deleting_photos.get(origin, {}).pop(instance.pk, tally)
+    deltas = {field: -count for field, count in tally.items()}
+    # Processing and failed photos were never counted
+    if instance.status == Photo.READY:
+        deltas['photos_count'] = -1
+    if deltas:
+        stats.adjust(instance.owner_id, **deltas)
+
+
+@receiver(post_save, sender=Like)
+def count_like_received(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust(stats.photo_owner(instance.photo_id), likes_received=1)
+
+
+@receiver(post_delete, sender=Like)
+def uncount_like_received(sender, instance, origin=None, **kwargs):
+    if not _photo_deleted(instance, origin, 'likes_received'):
+        stats.adjust(
+            stats.photo_owner(instance.photo_id), likes_received=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_received(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust(
+            stats.photo_owner(instance.photo_id), comments_received=1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment_received(sender, instance, origin=None, **kwargs):
+    if not _photo_deleted(instance, origin, 'comments_received'):
+        stats.adjust(
+            stats.photo_owner(instance.photo_id), comments_received=-1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust(instance.following_id, followers_count=1)
+        stats.adjust(instance.follower_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    stats.adjust(instance.following_id, followers_count=-1)
+    stats.adjust(instance.follower_id, following_count=-1)
+
+
+# ===== FOLLOW GRAPH =====
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def forget_following_on_change(sender, instance, **kwargs):
+    follows.forget_following(instance.follower_id)
+
+
+# ===== UNREAD NOTIFICATIONS =====
+
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_unread(sender, instance, **kwargs):
+    if not instance.is_read:
+        notifications.adjust_unread(instance.recipient_id, -1)
@@ -0,0 +1,104 @@
+"""
+Materialized profile statistics.
+
+``ProfileStats`` rows are adjusted in place by the signal handlers on every
+photo, like, comment and follow write, so the profile header is a single
+primary-key lookup. ``rebuild_profile_stats`` recomputes rows from scratch
+with grouped aggregates for backfills and drift repair.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Subquery, Sum
+
+from .models import Follow, Notification, Photo, ProfileStats
+
+
+def adjust(user_id, **deltas):
+    """
+    Apply ``field=delta`` increments to one user's stats row.
+
+    ``user_id`` may be a subquery expression so callers can address the
+    owner of a photo without loading it.
+    """
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    rows = ProfileStats.objects.filter(user_id=user_id)
+    for field, delta in deltas.items():
+        if delta < 0:
+            # Never push a drifted counter below zero
+            rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**updates)
+
+
+def photo_owner(photo_id):
+    """Subquery resolving a photo id to its owner id inside an UPDATE."""
+    return Subquery(Photo.objects.filter(pk=photo_id).values('owner_id')[:1])
+
+
+def stats_for(user):
+    """Return ``user``'s stats, rebuilding the row if it is missing."""
+    try:
+        return ProfileStats.objects.get(user=user)
+    except ProfileStats.DoesNotExist:
+        rebuild_profile_stats([user.pk])
+        return ProfileStats.objects.get(user=user)
+
+
+def _grouped_counts(queryset, key):
+    """Return ``{key: row count}`` from one grouped aggregate query."""
+    return dict(
+        queryset.order_by().values_list(key).annotate(total=Count('pk')))
+
+
+def rebuild_profile_stats(user_ids=None, batch_size=1000):
+    """
+    Recompute stats rows for ``user_ids`` (or everyone) in batches.
+
+    Each batch costs four grouped aggregate queries plus one bulk write.
+    Likes and comments received are summed from the per-photo counters
+    (see ``reconcile_counters``). Returns the number of rows rebuilt.
+    """
+    users = User.objects.order_by('pk').values_list('pk', flat=True)
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    rebuilt = 0
+    last_pk = 0
+    while True:
+        ids = list(users.filter(pk__gt=last_pk)[:batch_size])
+        if not ids:
+            return rebuilt
+        last_pk = ids[-1]
+
+        photo_totals = {
+            row['owner_id']: row for row in
+            Photo.objects.filter(owner_id__in=ids, status=Photo.READY)
+            .order_by()
+            .values('owner_id').annotate(
+                photos=Count('pk'),
+                likes=Sum('like_count'),
+                comments=Sum('comment_count'),
+            )
+        }
+        followers = _grouped_counts(
+            Follow.objects.filter(following_id__in=ids), 'following_id')
+        following = _grouped_counts(
+            Follow.objects.filter(follower_id__in=ids), 'follower_id')
+        unread = _grouped_counts(
+            Notification.objects.filter(recipient_id__in=ids, is_read=False),
+            'recipient_id')
+
+        rows = []
+        for pk in ids:
+            totals = photo_totals.get(pk, {})
+            rows.append(ProfileStats(
+                user_id=pk,
+                photos_count=totals.get('photos', 0),
+                likes_received=totals.get('likes') or 0,
+                comments_received=totals.get('comments') or 0,
+                followers_count=followers.get(pk, 0),
+                following_count=following.get(pk, 0),
+                unread_notifications=unread.get(pk, 0),
+            ))
+        with transaction.atomic():
+            ProfileStats.objects.filter(user_id__in=ids).delete()
+            ProfileStats.objects.bulk_create(rows)
+        rebuilt += len(rows)
@@ -0,0 +1,238 @@
+"""
+Search-as-you-type suggestions from an in-memory prefix index.
+
+Each worker process keeps a sorted array of ``(token, kind, object_id)``
+keys built lazily from users, profiles and public photos, and answers
+prefix queries with two bisections instead of a database round trip.
+
+Workers stay consistent through the shared cache: every write bumps
+``suggest:version`` and records which object changed under
+``suggest:change:<version>``. A worker whose local version is behind
+replays the missing change records (reloading just those objects) and
+falls back to a full rebuild when records have expired or it is too far
+behind. Memory is bounded by ``SUGGEST_MAX_ENTRIES``.
+"""
+import bisect
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Photo
+
+KIND_USER = 'user'
+KIND_PHOTO = 'photo'
+
+VERSION_KEY = 'suggest:version'
+CHANGE_KEY = 'suggest:change:{}'
+# Replaying more change records than this is slower than a rebuild
+MAX_REPLAY = 200
+
+
+def _tokens(text):
+    """Lower-cased keys to index ``text`` under: the whole text and words."""
+    text = (text or '').strip().lower()
+    if not text:
+        return []
+    keys = [text]
+    keys.extend(w for w in re.findall(r'\w+', text) if w != text)
+    return keys
+
+
+class PrefixIndex:
+    """A sorted key array with per-object bookkeeping for updates."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.keys = []      # sorted (token, kind, object_id)
+        self.docs = {}      # (kind, object_id) -> payload dict
+        self.tokens = {}    # (kind, object_id) -> indexed tokens
+        self.dropped = 0    # objects skipped because the index was full
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _admit(self, kind, object_id, payload, texts):
+        tokens = {t for text in texts for t in _tokens(text)}
+        if len(self.keys) + len(tokens) > self.max_entries:
+            self.dropped += 1
+            return ()
+        self.docs[(kind, object_id)] = payload
+        self.tokens[(kind, object_id)] = tokens
+        return tokens
+
+    def bulk_load(self, entries):
+        """Load many entries with a single sort instead of insorts."""
+        for kind, object_id, payload, texts in entries:
+            self.remove(kind, object_id)
+            self.keys.extend(
+                (token, kind, object_id)
+                for token in self._admit(kind, object_id, payload, texts))
+        self.keys.sort()
+
+    def add(self, kind, object_id, payload, texts):
+        self.remove(kind, object_id)
+        for token in self._admit(kind, object_id, payload, texts):
+            bisect.insort(self.keys, (token, kind, object_id))
+
+    def remove(self, kind, object_id):
+        self.docs.pop((kind, object_id), None)
+        for token in self.tokens.pop((kind, object_id), ()):
+            key = (token, kind, object_id)
+            pos = bisect.bisect_left(self.keys, key)
+            if pos < len(self.keys) and self.keys[pos] == key:
+                del self.keys[pos]
+
+    def lookup(self, prefix, limit, scan_limit=500):
+        """Return ``{kind: [payload, ...]}`` for objects matching prefix."""
+        seen = set()
+        candidates = []
+        start = bisect.bisect_left(self.keys, (prefix,))
+        for token, kind, object_id in self.keys[start:start + scan_limit]:
+            if not token.startswith(prefix):
+                break
+            if (kind, object_id) in seen:
+                continue
+            seen.add((kind, object_id))
+            doc = self.docs[(kind, object_id)]
+            # Prefer objects whose label starts with the prefix, then
+            # shorter labels
+            label = doc['label'].lower()
+            candidates.append(
+                (not label.startswith(prefix), len(label), kind, doc))
+        candidates.sort(key=lambda c: (c[0], c[1]))
+        results = {KIND_USER: [], KIND_PHOTO: []}
+        for _, _, kind, doc in candidates:
+            if len(results[kind]) < limit:
+                results[kind].append(doc)
+        return results
+
+
+def _user_entry(user_id, username, display_name):
+    payload = {
+        'id': user_id,
+        'label': username,
+        'username': username,
+        'display_name': display_name or '',
+    }
+    return KIND_USER, user_id, payload, (username, display_name)
+
+
+def _photo_entry(photo_id, title):
+    payload = {'id': photo_id, 'label': title, 'title': title}
+    return KIND_PHOTO, photo_id, payload, (title,)
+
+
+def _load_users(ids=None):
+    users = User.objects.values_list('pk', 'username', 'profile__display_name')
+    if ids is not None:
+        users = users.filter(pk__in=ids)
+    return [_user_entry(*row) for row in users.iterator()]
+
+
+def _load_photos(ids=None, limit=None):
+    photos = Photo.objects.filter(is_public=True, status=Photo.READY).order_by(
+        '-created_at').values_list('pk', 'title')
+    if ids is not None:
+        photos = photos.filter(pk__in=ids)
+    if limit is not None:
+        photos = photos[:limit]
+    return [_photo_entry(*row) for row in photos.iterator()]
+
+
+class SuggestionService:
+    """Per-process owner of the prefix index and its cache version."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def _shared_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 0, timeout=None)
+            version = cache.get(VERSION_KEY, 0)
+        return version
+
+    def _rebuild(self, version):
+        index = PrefixIndex(settings.SUGGEST_MAX_ENTRIES)
+        # Users go in first, then photos newest-first, so a full index
+        # drops the oldest titles
+        index.bulk_load(_load_users())
+        index.bulk_load(_load_photos(limit=settings.SUGGEST_MAX_ENTRIES))
+        self._index = index
+        self._version = version
+
+    def _replay(self, version):
+        """Apply change records since our version; False if impossible."""
+        if version - self._version > MAX_REPLAY:
+            return False
+        wanted = [CHANGE_KEY.format(v)
+                  for v in range(self._version + 1, version + 1)]
+        records = cache.get_many(wanted)
+        if len(records) != len(wanted):
+            return False
+        changed = {KIND_USER: set(), KIND_PHOTO: set()}
+        for kind, object_id in records.values():
+            changed[kind].add(object_id)
+        self._apply(changed)
+        self._version = version
+        return True
+
+    def _apply(self, changed):
+        for kind, ids in changed.items():
+            if not ids:
+                continue
+            loader = _load_users if kind == KIND_USER else _load_photos
+            current = loader(ids=ids)
+            for entry in current:
+                self._index.add(*entry)
+            # Anything not reloaded was deleted or made private
+            for object_id in ids - {entry[1] for entry in current}:
+                self._index.remove(kind, object_id)
+
+    def index(self):
+        """Return an index that is current with the shared version."""
+        version = self._shared_version()
+        with self._lock:
+            if self._index is None or (
+                    version != self._version and not self._replay(version)):
+                self._rebuild(version)
+            return self._index
+
+    def suggest(self, query, limit=None):
+        limit = limit or settings.SUGGEST_RESULTS
+        prefix = query.strip().lower()
+        if len(prefix) < settings.SUGGEST_MIN_LENGTH:
+            return {KIND_USER: [], KIND_PHOTO: []}
+        return self.index().lookup(prefix, limit)
+
+    def reset(self):
+        with self._lock:
+            self._index = None
+            self._version = None
+
+
+service = SuggestionService()
+
+
+def record_change(kind, object_id):
+    """
+    Publish that an object changed once the current transaction commits.
+
+    Other workers replay the change record on their next lookup; this
+    worker's own index catches up the same way.
+    """
+    def publish():
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 0, timeout=None)
+            version = cache.incr(VERSION_KEY)
+        cache.set(CHANGE_KEY.format(version), (kind, object_id),
+                  timeout=settings.SUGGEST_CHANGE_TTL)
+    transaction.on_commit(publish)
@@ -0,0 +1,20 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from portfolio import fragments
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def photo_cards(context, photos, variant='home'):
+    """
+    Render a grid of photo cards through the versioned fragment cache.
+    Args:
+        photos: Photos from ``Photo.objects.feed_for``
+        variant: Card layout, ``home`` or ``profile``
+    Returns:
+        Card HTML for the current viewer
+    """
+    viewer = context.get('user') or context['request'].user
+    return mark_safe(fragments.render_cards(photos, variant, viewer))
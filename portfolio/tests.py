@@ -1,8 +1,39 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import cloudinary
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Photo, Notification
+from django.db import transaction
+from django.db.models.signals import post_delete
+from .models import (
+    Photo, PhotoUpload, Notification, NotificationOutbox, Like, Comment,
+    Follow, FollowSuggestion, Profile, ProfileStats, TimelineEntry)
+from . import (
+    bulk_uploads, direct_uploads, events, follow_suggestions, follows,
+    fragments, images, likes, notifications, outbox, search, stats, suggest,
+    timeline, uploads)
+from .pagination import keyset_page
+from .templatetags.image_optimization import (
+    optimized_image_url, responsive_image_srcset)
 
 
 class CommentWorkflowTests(TestCase):
@@ -185,3 +216,2012 @@ class SecurityTests(TestCase):
         response = self.client.get(reverse('notifications_api'))
         expected = '/accounts/login/?next=/portfolio/notifications/api/'
         self.assertRedirects(response, expected)
+
+
+class PhotoFixtureMixin:
+    """Helpers for tests that need users and photos without uploads"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Photos store a public id; URL building only needs a cloud name
+        cloudinary.config(cloud_name='shutterspace-test')
+
+    def make_user(self, username, **extra):
+        return User.objects.create_user(
+            username=username, password='testpass123', **extra)
+
+    def make_photo(self, owner, title='Test Photo', **extra):
+        extra.setdefault('image', 'sample')
+        return Photo.objects.create(owner=owner, title=title, **extra)
+
+
+class SearchIndexTests(PhotoFixtureMixin, TestCase):
+    """Test the full-text search index and the home search results"""
+
+    def setUp(self):
+        self.user = self.make_user('searcher')
+        self.owner = self.make_user('landscaper', first_name='Ansel')
+        self.client.login(username='searcher', password='testpass123')
+
+    def test_prefix_search_ranks_title_matches_first(self):
+        in_body = self.make_photo(
+            self.owner, title='Morning walk',
+            description='Fog over the mountains')
+        in_title = self.make_photo(self.owner, title='Mountain lake')
+        page = search.search_photos('mount')
+        self.assertEqual(
+            [p.id for p in page], [in_title.id, in_body.id])
+
+    def test_private_and_deleted_photos_are_not_found(self):
+        private = self.make_photo(
+            self.owner, title='Secret sunset', is_public=False)
+        public = self.make_photo(self.owner, title='Public sunset')
+        self.assertEqual(
+            [p.id for p in search.search_photos('sunset')], [public.id])
+        public.delete()
+        private.is_public = True
+        private.save()
+        self.assertEqual(
+            [p.id for p in search.search_photos('sunset')], [private.id])
+
+    def test_index_follows_title_edits(self):
+        photo = self.make_photo(self.owner, title='Harbour lights')
+        photo.title = 'Desert dunes'
+        photo.save()
+        self.assertEqual(len(search.search_photos('harbour')), 0)
+        self.assertEqual(len(search.search_photos('dunes')), 1)
+
+    def test_users_found_by_display_name(self):
+        self.owner.profile.display_name = 'Wildlife Wanderer'
+        self.owner.profile.save()
+        users = search.search_users('wander')
+        self.assertEqual([u.id for u in users], [self.owner.id])
+
+    def test_results_are_paginated(self):
+        for i in range(5):
+            self.make_photo(self.owner, title=f'Forest study {i}')
+        with self.settings(SEARCH_RESULTS_PER_PAGE=2):
+            response = self.client.get(
+                reverse('home'), {'q': 'forest', 'page': 3})
+        page = response.context['photos']
+        self.assertEqual(page.number, 3)
+        self.assertEqual(len(page), 1)
+        self.assertFalse(page.has_next())
+
+    def test_single_photo_match_redirects(self):
+        photo = self.make_photo(self.owner, title='Lonely lighthouse')
+        response = self.client.get(reverse('home'), {'q': 'lighthouse'})
+        self.assertRedirects(
+            response, reverse('photo_detail', kwargs={'photo_id': photo.id}))
+
+    def test_rebuild_command_restores_index(self):
+        photo = self.make_photo(self.owner, title='Glacier panorama')
+        search.get_backend().clear()
+        self.assertEqual(len(search.search_photos('glacier')), 0)
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            [p.id for p in search.search_photos('glacier')], [photo.id])
+        self.assertEqual(
+            [u.id for u in search.search_users('ansel')], [self.owner.id])
+
+
+class FeedQueryCountTests(PhotoFixtureMixin, TestCase):
+    """Photo listings must cost a fixed number of queries"""
+
+    def setUp(self):
+        self.viewer = self.make_user('viewer')
+        self.owner = self.make_user('prolific')
+        self.client.login(username='viewer', password='testpass123')
+
+    def add_photos(self, count):
+        for i in range(count):
+            photo = self.make_photo(self.owner, title=f'Frame {i}')
+            Like.objects.create(photo=photo, user=self.viewer)
+            for j in range(4):
+                Comment.objects.create(
+                    photo=photo, author=self.viewer, text=f'Nice {j}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_feed_for_annotations(self):
+        self.add_photos(1)
+        other = self.make_photo(self.owner, title='Unliked frame')
+        photos = {p.id: p for p in Photo.objects.feed_for(self.viewer)}
+        liked = next(p for p in photos.values() if p.id != other.id)
+        self.assertEqual(liked.like_count, 1)
+        self.assertEqual(liked.comment_count, 4)
+        self.assertTrue(liked.liked_by_me)
+        self.assertEqual(len(liked.recent_comments), 3)
+        self.assertEqual(liked.recent_comments[0].text, 'Nice 3')
+        self.assertFalse(photos[other.id].liked_by_me)
+        self.assertEqual(photos[other.id].like_count, 0)
+
+    def test_home_query_count_is_constant(self):
+        self.add_photos(1)
+        few = self.count_queries(reverse('home'))
+        self.add_photos(5)
+        with self.assertNumQueries(few):
+            self.client.get(reverse('home'))
+
+    def test_profile_query_count_is_constant(self):
+        url = reverse('profile_view', kwargs={'username': 'prolific'})
+        self.add_photos(2)
+        # Warm the viewer's cached followed-id set first
+        self.client.get(url)
+        few = self.count_queries(url)
+        self.add_photos(10)
+        with self.assertNumQueries(few):
+            response = self.client.get(url)
+        self.assertEqual(response.context['total_likes'], 12)
+        self.assertEqual(response.context['total_comments'], 48)
+
+
+class KeysetFeedTests(PhotoFixtureMixin, TestCase):
+    """Test cursor pagination of the home and profile grids"""
+
+    def setUp(self):
+        self.viewer = self.make_user('scroller')
+        self.owner = self.make_user('shooter')
+        self.client.login(username='scroller', password='testpass123')
+
+    def test_keyset_pages_cover_every_photo_once(self):
+        photos = [self.make_photo(self.owner, title=f'Shot {i}')
+                  for i in range(7)]
+        # Identical timestamps must still page deterministically by id
+        Photo.objects.filter(id__in=[p.id for p in photos[:4]]).update(
+            created_at=photos[0].created_at)
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(
+                Photo.objects.filter(owner=self.owner), cursor, 3)
+            seen.extend(p.id for p in page)
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted(p.id for p in photos))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_malformed_cursor_starts_from_first_page(self):
+        photo = self.make_photo(self.owner)
+        page, cursor = keyset_page(Photo.objects.all(), 'not-a-cursor', 5)
+        self.assertEqual([p.id for p in page], [photo.id])
+        self.assertIsNone(cursor)
+
+    def test_feed_endpoint_returns_next_page_fragment(self):
+        for i in range(5):
+            self.make_photo(self.owner, title=f'Roll {i}')
+        with self.settings(FEED_PAGE_SIZE=2):
+            first = self.client.get(reverse('home'))
+            cursor = first.context['next_cursor']
+            response = self.client.get(
+                reverse('photo_feed'),
+                {'owner': 'shooter', 'cursor': cursor})
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertIn('Roll 2', data['html'])
+        self.assertIn('Roll 1', data['html'])
+        self.assertNotIn('Roll 4', data['html'])
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_feed_endpoint_requires_login_for_home_feed(self):
+        self.client.logout()
+        response = self.client.get(reverse('photo_feed'))
+        self.assertEqual(response.status_code, 403)
+
+
+class FollowingFeedTests(PhotoFixtureMixin, TestCase):
+    """Test the fan-out-on-write Following feed"""
+
+    def setUp(self):
+        self.reader = self.make_user('reader')
+        self.artist = self.make_user('artist')
+        self.star = self.make_user('star')
+        self.client.login(username='reader', password='testpass123')
+
+    def follow(self, username):
+        return self.client.post(
+            reverse('follow_user', kwargs={'username': username}))
+
+    def test_follow_backfills_and_upload_fans_out(self):
+        old = self.make_photo(self.artist, title='Old work')
+        self.make_photo(self.artist, title='Private', is_public=False)
+        self.follow('artist')
+        new = self.make_photo(self.artist, title='New work')
+        self.assertEqual(timeline.fan_out_photo(new), 1)
+        photos, cursor = timeline.following_feed(self.reader)
+        self.assertEqual([p.id for p in photos], [new.id, old.id])
+        self.assertIsNone(cursor)
+
+    def test_unfollow_removes_timeline_rows(self):
+        self.make_photo(self.artist)
+        self.follow('artist')
+        self.client.post(
+            reverse('unfollow_user', kwargs={'username': 'artist'}))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists())
+
+    def test_large_accounts_are_merged_on_read(self):
+        mine = self.make_photo(self.artist, title='Fanned out')
+        self.follow('artist')
+        with self.settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0):
+            self.follow('star')
+            starred = self.make_photo(self.star, title='Served on read')
+            self.assertEqual(timeline.fan_out_photo(starred), 0)
+        self.assertTrue(Profile.objects.get(user=self.star).fanout_on_read)
+        self.assertFalse(TimelineEntry.objects.filter(
+            photo=starred).exists())
+
+        first, cursor = timeline.following_feed(self.reader, page_size=1)
+        second, cursor = timeline.following_feed(
+            self.reader, cursor, page_size=1)
+        self.assertEqual(
+            [p.id for p in first + second], [starred.id, mine.id])
+        self.assertIsNone(cursor)
+
+    def test_backfill_seeds_existing_follows(self):
+        old = self.make_photo(self.artist, title='Old work')
+        starred = self.make_photo(self.star, title='Star work')
+        # Follows made before timelines existed
+        Follow.objects.create(follower=self.reader, following=self.artist)
+        Follow.objects.create(follower=self.artist, following=self.star)
+        Follow.objects.create(follower=self.reader, following=self.star)
+        TimelineEntry.objects.all().delete()
+        with self.settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1):
+            out = StringIO()
+            call_command('backfill_timelines', '--batch-size', '1',
+                         stdout=out)
+        self.assertIn('Wrote 1 timeline row(s)', out.getvalue())
+        self.assertTrue(Profile.objects.get(user=self.star).fanout_on_read)
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user_id', 'photo_id')),
+            [(self.reader.pk, old.pk)])
+        photos, _ = timeline.following_feed(self.reader)
+        self.assertEqual([p.id for p in photos], [starred.id, old.id])
+        # A second run writes nothing new
+        timeline.backfill_timelines()
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+
+    def test_following_page_renders_cards(self):
+        self.make_photo(self.artist, title='Street scene')
+        self.follow('artist')
+        response = self.client.get(reverse('following_feed'))
+        self.assertContains(response, 'Street scene')
+
+
+class PhotoCounterTests(PhotoFixtureMixin, TestCase):
+    """Test the denormalized like and comment counters"""
+
+    def setUp(self):
+        self.owner = self.make_user('counted')
+        self.fan = self.make_user('fan')
+        self.photo = self.make_photo(self.owner)
+        self.client.login(username='fan', password='testpass123')
+
+    def counts(self):
+        self.photo.refresh_from_db()
+        return self.photo.like_count, self.photo.comment_count
+
+    def test_toggle_like_returns_stored_count(self):
+        url = reverse('toggle_like', kwargs={'photo_id': self.photo.id})
+        self.assertEqual(self.client.post(url).json()['likes_count'], 1)
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(self.client.post(url).json()['likes_count'], 0)
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_comment_create_and_delete_update_count(self):
+        self.client.post(
+            reverse('photo_detail', kwargs={'photo_id': self.photo.id}),
+            {'text': 'Lovely light here'})
+        self.assertEqual(self.counts(), (0, 1))
+        comment = Comment.objects.get(photo=self.photo)
+        self.client.post(
+            reverse('delete_comment', kwargs={'comment_id': comment.id}))
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_cascade_delete_updates_counts(self):
+        Like.objects.create(photo=self.photo, user=self.fan)
+        Comment.objects.create(photo=self.photo, author=self.fan, text='Hi')
+        self.assertEqual(self.counts(), (1, 1))
+        self.fan.delete()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_reconcile_counters_fixes_drift(self):
+        Like.objects.create(photo=self.photo, user=self.fan)
+        Photo.objects.filter(pk=self.photo.pk).update(
+            like_count=7, comment_count=3)
+        out = StringIO()
+        call_command('reconcile_counters', batch_size=1, stdout=out)
+        self.assertIn('Fixed 1', out.getvalue())
+        self.assertEqual(self.counts(), (1, 0))
+
+
+class ProfileStatsTests(PhotoFixtureMixin, TestCase):
+    """Test the materialized profile statistics"""
+
+    def setUp(self):
+        self.owner = self.make_user('statted')
+        self.fan = self.make_user('admirer')
+        self.client.login(username='admirer', password='testpass123')
+
+    def stats(self):
+        return ProfileStats.objects.get(user=self.owner).as_dict()
+
+    def test_writes_keep_stats_current(self):
+        photo = self.make_photo(self.owner)
+        Like.objects.create(photo=photo, user=self.fan)
+        Comment.objects.create(photo=photo, author=self.fan, text='Wow')
+        Follow.objects.create(follower=self.fan, following=self.owner)
+        self.assertEqual(self.stats(), {
+            'photos': 1, 'likes_received': 1, 'comments_received': 1,
+            'followers': 1, 'following': 0,
+        })
+        self.assertEqual(
+            ProfileStats.objects.get(user=self.fan).following_count, 1)
+        photo.delete()
+        Follow.objects.all().delete()
+        self.assertEqual(set(self.stats().values()), {0})
+
+    def test_photo_delete_uncounts_its_activity_once(self):
+        kept = self.make_photo(self.owner, title='Kept')
+        Like.objects.create(photo=kept, user=self.fan)
+        photo = self.make_photo(self.owner)
+        fans = [self.make_user(f'fan{i}') for i in range(4)]
+        for fan in fans:
+            Like.objects.create(photo=photo, user=fan)
+            Comment.objects.create(photo=photo, author=fan, text='Wow')
+        with CaptureQueriesContext(connection) as queries:
+            photo.delete()
+        updates = [q['sql'] for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1, updates)
+        self.assertEqual(self.stats(), {
+            'photos': 1, 'likes_received': 1, 'comments_received': 0,
+            'followers': 0, 'following': 0,
+        })
+        # Later deletes of the kept photo's likes are still counted
+        Like.objects.filter(photo=kept).delete()
+        self.assertEqual(self.stats()['likes_received'], 0)
+
+    def test_stats_lookup_is_one_query(self):
+        with self.assertNumQueries(1):
+            stats.stats_for(self.owner)
+
+    def test_rebuild_restores_missing_and_drifted_rows(self):
+        photo = self.make_photo(self.owner)
+        Like.objects.create(photo=photo, user=self.fan)
+        ProfileStats.objects.filter(user=self.owner).update(
+            photos_count=9, likes_received=0)
+        ProfileStats.objects.filter(user=self.fan).delete()
+        call_command('rebuild_profile_stats', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.stats()['photos'], 1)
+        self.assertEqual(self.stats()['likes_received'], 1)
+        self.assertTrue(ProfileStats.objects.filter(user=self.fan).exists())
+
+    def test_stats_endpoint(self):
+        self.make_photo(self.owner)
+        response = self.client.get(
+            reverse('profile_stats', kwargs={'username': 'statted'}))
+        self.assertEqual(response.json()['stats']['photos'], 1)
+
+
+class SearchSuggestTests(PhotoFixtureMixin, TestCase):
+    """Test the in-memory prefix index behind search-as-you-type"""
+
+    def setUp(self):
+        cache.clear()
+        suggest.service.reset()
+        self.user = self.make_user('sunsetfan')
+        self.client.login(username='sunsetfan', password='testpass123')
+
+    def titles(self, query):
+        return [p['title'] for p in suggest.service.suggest(query)['photo']]
+
+    def test_prefix_matches_words_and_users(self):
+        self.make_photo(self.user, title='Golden Hour Sunset')
+        self.make_photo(self.user, title='Private Sunset', is_public=False)
+        self.assertEqual(self.titles('sun'), ['Golden Hour Sunset'])
+        self.assertEqual(self.titles('gold'), ['Golden Hour Sunset'])
+        users = suggest.service.suggest('sunset')['user']
+        self.assertEqual([u['username'] for u in users], ['sunsetfan'])
+
+    def test_writes_replay_without_rebuild(self):
+        self.assertEqual(self.titles('harbor'), [])
+        index = suggest.service.index()
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = self.make_photo(self.user, title='Harbor Lights')
+        self.assertEqual(self.titles('harbor'), ['Harbor Lights'])
+        self.assertIs(suggest.service.index(), index)
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.delete()
+        self.assertEqual(self.titles('harbor'), [])
+
+    def test_login_does_not_touch_the_indexes(self):
+        with mock.patch.object(suggest, 'record_change') as record, \
+                mock.patch.object(search, 'index_user') as index:
+            self.client.login(username='sunsetfan', password='testpass123')
+            self.user.first_name = 'Sol'
+            self.user.save(update_fields=['first_name'])
+        record.assert_called_once_with(suggest.KIND_USER, self.user.pk)
+        index.assert_called_once_with(self.user)
+
+    def test_missing_change_records_force_rebuild(self):
+        index = suggest.service.index()
+        self.make_photo(self.user, title='Quiet Forest')
+        # Another worker bumped the version but its record has expired
+        cache.incr(suggest.VERSION_KEY)
+        self.assertEqual(self.titles('forest'), ['Quiet Forest'])
+        self.assertIsNot(suggest.service.index(), index)
+
+    def test_index_respects_entry_cap(self):
+        with self.settings(SUGGEST_MAX_ENTRIES=3):
+            self.make_photo(self.user, title='One Two Three Four')
+            suggest.service.reset()
+            index = suggest.service.index()
+        self.assertLessEqual(len(index), 3)
+        self.assertEqual(index.dropped, 1)
+
+    def test_suggest_endpoint(self):
+        photo = self.make_photo(self.user, title='Misty Mountains')
+        response = self.client.get(reverse('search_suggest'), {'q': 'mis'})
+        self.assertEqual(response.json()['photos'], [{
+            'id': photo.pk, 'title': 'Misty Mountains',
+            'url': reverse('photo_detail', args=[photo.pk]),
+        }])
+
+
+class PhotoCardCacheTests(PhotoFixtureMixin, TestCase):
+    """Test the versioned photo card fragment cache"""
+
+    def setUp(self):
+        cache.clear()
+        fragments.reset_card_cache_stats()
+        self.owner = self.make_user('cardmaker')
+        self.viewer = self.make_user('cardviewer')
+        self.other = self.make_user('cardother')
+        self.photo = self.make_photo(self.owner, title='Cached Card')
+
+    def render(self, viewer):
+        photos = Photo.objects.filter(pk=self.photo.pk).feed_for(viewer)
+        return fragments.render_cards(photos, 'home', viewer)
+
+    def test_fragment_is_shared_and_like_button_is_per_viewer(self):
+        Like.objects.create(photo=self.photo, user=self.viewer)
+        liked = self.render(self.viewer)
+        not_liked = self.render(self.other)
+        self.assertIn('♥ Liked', liked)
+        self.assertIn('♡ Like', not_liked)
+        self.assertNotIn('<!--like-button-->', liked)
+        stats = fragments.card_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_activity_bumps_version(self):
+        self.render(self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(photo=self.photo, user=self.viewer)
+        html = self.render(self.other)
+        self.assertIn('data-likes-count="%d">1<' % self.photo.pk, html)
+        self.assertEqual(fragments.card_cache_stats()['misses'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.photo.title = 'Renamed Card'
+            self.photo.save()
+        self.assertIn('Renamed Card', self.render(self.other))
+
+    def test_comment_actions_never_leak_between_viewers(self):
+        Comment.objects.create(
+            photo=self.photo, author=self.viewer, text='Lovely')
+        # The owner and the commenter see actions; other viewers do not
+        self.assertIn('(as photo owner)', self.render(self.owner))
+        self.assertIn('Edit', self.render(self.viewer))
+        self.assertNotIn('deleteCommentModal', self.render(self.other))
+        self.assertEqual(fragments.card_cache_stats()['bypassed'], 1)
+
+    def test_stats_hook_receives_counts(self):
+        received = []
+
+        def listener(sender, **kwargs):
+            received.append((sender, kwargs['hits'], kwargs['misses']))
+
+        fragments.cards_rendered.connect(listener)
+        self.addCleanup(fragments.cards_rendered.disconnect, listener)
+        self.render(self.other)
+        self.render(self.other)
+        self.assertEqual(received, [('home', 0, 1), ('home', 1, 0)])
+
+
+class ImageUrlCacheTests(PhotoFixtureMixin, TestCase):
+    """Test memoized Cloudinary URL building"""
+
+    def setUp(self):
+        images.clear_url_cache()
+
+    def test_tags_are_memoized_per_preset(self):
+        url = optimized_image_url('sample', 'detail')
+        self.assertEqual(url, images._build('sample', 'detail'))
+        self.assertIn('w_800', url)
+        optimized_image_url('sample', 'detail')
+        optimized_image_url('sample', 'thumbnail')
+        info = images.url_cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+
+    def test_unknown_preset_uses_thumbnail(self):
+        self.assertEqual(optimized_image_url('sample', 'poster'),
+                         optimized_image_url('sample', 'thumbnail'))
+        self.assertEqual(images.url_cache_info().currsize, 1)
+
+    def test_srcset_and_empty_fields(self):
+        srcset = responsive_image_srcset('sample')
+        self.assertEqual(
+            [entry.rsplit(' ', 1)[1] for entry in srcset.split(', ')],
+            ['400w', '800w', '1200w', '1600w'])
+        self.assertEqual(optimized_image_url(''), '')
+        self.assertEqual(responsive_image_srcset(None), '')
+
+    def test_urls_keep_the_version(self):
+        first = direct_uploads.stored_image('sample', 11, 'jpg')
+        again = direct_uploads.stored_image('sample', 12, 'jpg')
+        self.assertIn('/v11/', optimized_image_url(first, 'detail'))
+        self.assertIn('/v12/', optimized_image_url(again, 'detail'))
+        self.assertIn('/v12/', responsive_image_srcset(again))
+
+
+class ImageRenditionTests(PhotoFixtureMixin, TestCase):
+    """Test stored preset URLs and srcsets"""
+
+    def setUp(self):
+        self.owner = self.make_user('renderer')
+
+    def test_stored_renditions_are_used(self):
+        photo = self.make_photo(
+            self.owner, renditions={'public_id': 'sample',
+                                    'thumbnail': 'https://cdn/stored.jpg'})
+        self.assertEqual(
+            optimized_image_url(photo.image, 'thumbnail', photo.renditions),
+            'https://cdn/stored.jpg')
+        # Presets missing from the stored dict are built live
+        self.assertIn('w_800', optimized_image_url(
+            photo.image, 'detail', photo.renditions))
+
+    def test_renditions_for_a_replaced_image_are_ignored(self):
+        renditions = {'public_id': 'old', 'thumbnail': 'https://cdn/old.jpg'}
+        self.assertEqual(
+            optimized_image_url('sample', 'thumbnail', renditions),
+            optimized_image_url('sample', 'thumbnail'))
+
+    def test_renditions_for_another_version_are_ignored(self):
+        renditions = images.renditions_for(
+            direct_uploads.stored_image('sample', 11, 'jpg'))
+        self.assertIn('/v11/', renditions['thumbnail'])
+        again = direct_uploads.stored_image('sample', 12, 'jpg')
+        self.assertIn('/v12/', optimized_image_url(
+            again, 'thumbnail', renditions))
+
+    def test_backfill_fills_legacy_rows(self):
+        photo = self.make_photo(self.owner)
+        Profile.objects.filter(user=self.owner).update(avatar='face')
+        call_command('backfill_renditions', batch_size=1, stdout=StringIO())
+        photo.refresh_from_db()
+        self.assertEqual(set(photo.renditions), {
+            'public_id', 'thumbnail', 'detail', 'hero', 'avatar', 'srcset'})
+        self.assertEqual(photo.renditions['detail'],
+                         images._build('sample', 'detail'))
+        profile = Profile.objects.get(user=self.owner)
+        self.assertEqual(profile.renditions['avatar']['public_id'], 'face')
+        self.assertEqual(profile.renditions['hero_image'], {})
+
+
+class NotificationStreamTests(PhotoFixtureMixin, TestCase):
+    """Test the server-sent notification stream and its brokers"""
+
+    def setUp(self):
+        cache.clear()
+        events.reset_broker()
+        self.addCleanup(events.reset_broker)
+        self.user = self.make_user('listener')
+        self.sender = self.make_user('talker')
+
+    def notify(self, title='Hello'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return notifications.create_notification(
+                self.user, self.sender, 'follow', title, 'message')
+
+    async def read_stream(self, **headers):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            reverse('notifications_stream'), headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return ''.join([chunk.decode() async for chunk in
+                        response.streaming_content])
+
+    @override_settings(NOTIFICATION_STREAM_MAX_AGE=0.05,
+                       NOTIFICATION_STREAM_HEARTBEAT=0.01)
+    async def test_stream_replays_after_last_event_id(self):
+        first = await sync_to_async(self.notify)('First')
+        second = await sync_to_async(self.notify)('Second')
+        body = await self.read_stream(**{'Last-Event-ID': str(first.pk)})
+        self.assertIn(f'id: {second.pk}\nevent: notification\n', body)
+        self.assertNotIn('"First"', body)
+        self.assertIn('event: unread\ndata: {"unread_count": 2}', body)
+        self.assertIn(': heartbeat', body)
+
+    def test_stream_is_refused_under_wsgi(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('notifications_stream'))
+        self.assertEqual(response.status_code, 204)
+
+    async def test_stream_requires_login(self):
+        response = await self.async_client.get(reverse('notifications_stream'))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_local_broker_delivers_across_threads(self):
+        broker = events.LocalBroker()
+        subscription = broker.subscribe(self.user.pk, 0)
+        event = notifications.unread_event(3)
+        thread = threading.Thread(
+            target=broker.publish, args=(self.user.pk, event))
+        thread.start()
+        thread.join()
+        self.assertEqual(await subscription.next(1), event)
+        self.assertIsNone(await subscription.next(0.01))
+        subscription.close()
+        self.assertEqual(broker._subscriptions, {})
+
+    @override_settings(NOTIFICATION_POLL_INTERVAL=0.01)
+    async def test_database_broker_polls_for_new_rows(self):
+        subscription = events.DatabaseBroker().subscribe(self.user.pk, 0)
+        self.assertIsNone(await subscription.next(0.02))
+        created = await sync_to_async(self.notify)()
+        event = await subscription.next(1)
+        self.assertEqual((event.name, event.id), ('notification', created.pk))
+        self.assertEqual(await subscription.next(1),
+                         notifications.unread_event(1))
+
+    def test_publish_waits_for_commit(self):
+        published = []
+        with mock.patch.object(events.LocalBroker, 'publish',
+                               lambda self, *args: published.append(args)):
+            with self.captureOnCommitCallbacks(execute=True):
+                notification = notifications.create_notification(
+                    self.user, self.sender, 'follow', 'Hello', 'message')
+                self.assertEqual(published, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                notification.mark_as_read()
+        self.assertEqual(
+            [event.name for _, event in published],
+            ['notification', 'unread', 'unread'])
+        self.assertEqual(published[-1][1].data, {'unread_count': 0})
+
+
+class UnreadCounterTests(PhotoFixtureMixin, TestCase):
+    """Test the cached per-user unread notification counter"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = self.make_user('reader')
+        self.sender = self.make_user('writer')
+        self.client.login(username='reader', password='testpass123')
+
+    def notify(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return notifications.create_notification(
+                self.user, self.sender, 'follow', 'Hi', 'message')
+
+    def stored(self):
+        return ProfileStats.objects.get(user=self.user).unread_notifications
+
+    def test_counter_follows_writes(self):
+        first = self.notify()
+        self.notify()
+        self.assertEqual(notifications.unread_count(self.user.pk), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.mark_as_read()
+            Notification.objects.get(pk=first.pk).mark_as_read()
+        self.assertEqual(notifications.unread_count(self.user.pk), 1)
+        self.notify()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('notifications_mark_all_read'))
+        self.assertEqual(notifications.unread_count(self.user.pk), 0)
+        self.assertEqual(self.stored(), 0)
+
+    def test_hot_path_skips_notifications_table(self):
+        self.notify()
+        notifications.unread_count(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(notifications.unread_count(self.user.pk), 1)
+        cache.clear()
+        # A miss reloads the stored column with one primary-key lookup
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(notifications.unread_count(self.user.pk), 1)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('portfolio_notification',
+                         ctx.captured_queries[0]['sql'])
+
+    def test_deleting_unread_notifications_decrements(self):
+        notification = self.notify()
+        with self.captureOnCommitCallbacks(execute=True):
+            notification.delete()
+        self.assertEqual(self.stored(), 0)
+        self.assertEqual(notifications.unread_count(self.user.pk), 0)
+
+    def test_badge_endpoint(self):
+        self.notify()
+        response = self.client.get(reverse('notifications_count'))
+        self.assertEqual(response.json(), {'unread_count': 1})
+
+
+class NotificationCoalescingTests(PhotoFixtureMixin, TestCase):
+    """Test folding likes and comments on a photo into one notification"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('viral')
+        self.photo = self.make_photo(self.owner, title='Crowd Pleaser')
+        self.fans = [self.make_user(f'fan{i}') for i in range(3)]
+
+    def like(self, fan):
+        return notifications.create_notification(
+            self.owner, fan, 'like', 'Someone liked your photo',
+            f'{fan.username} liked your photo', photo=self.photo)
+
+    def comment(self, fan):
+        comment = Comment.objects.create(
+            photo=self.photo, author=fan, text='Great shot')
+        return notifications.create_notification(
+            self.owner, fan, 'comment', 'New comment on your photo',
+            f'{fan.username} commented', photo=self.photo, comment=comment)
+
+    def test_likes_share_one_row(self):
+        for fan in self.fans:
+            self.like(fan)
+        notification = Notification.objects.get(recipient=self.owner)
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.recent_actors, ['fan2', 'fan1', 'fan0'])
+        self.assertEqual(notification.sender, self.fans[2])
+        self.assertEqual(notification.message,
+                         'fan2 and 2 others liked your photo "Crowd Pleaser"')
+        self.assertEqual(
+            ProfileStats.objects.get(user=self.owner).unread_notifications, 1)
+
+    def test_repeat_likes_are_suppressed(self):
+        self.like(self.fans[0])
+        self.assertIsNone(self.like(self.fans[0]))
+        self.like(self.fans[1])
+        self.assertIsNone(self.like(self.fans[0]))
+        self.assertEqual(
+            Notification.objects.get(recipient=self.owner).actor_count, 2)
+
+    def test_comments_count_distinct_actors(self):
+        self.comment(self.fans[0])
+        self.comment(self.fans[0])
+        latest = self.comment(self.fans[1])
+        notification = Notification.objects.get(recipient=self.owner)
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.comment, latest.comment)
+        self.assertEqual(notification.message,
+                         'fan1 and 1 other commented on your photo '
+                         '"Crowd Pleaser"')
+
+    def test_read_or_expired_notifications_are_not_reused(self):
+        first = self.like(self.fans[0])
+        first.mark_as_read()
+        self.like(self.fans[1])
+        Notification.objects.update(
+            created_at=timezone.now() - timedelta(hours=2))
+        self.like(self.fans[2])
+        self.assertEqual(
+            Notification.objects.filter(recipient=self.owner).count(), 3)
+
+
+@override_settings(NOTIFICATION_OUTBOX=True)
+class NotificationOutboxTests(PhotoFixtureMixin, TestCase):
+    """Test queueing notifications and delivering them from the outbox"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('owner')
+        self.fan = self.make_user('fan')
+        self.photo = self.make_photo(self.owner)
+        self.client.login(username='fan', password='testpass123')
+
+    def like(self):
+        self.client.post(
+            reverse('toggle_like', kwargs={'photo_id': self.photo.id}))
+
+    def deliver(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return outbox.deliver_batch(**kwargs)
+
+    def test_request_only_queues(self):
+        self.like()
+        event = NotificationOutbox.objects.get()
+        like = Like.objects.get(photo=self.photo, user=self.fan)
+        self.assertEqual(event.idempotency_key, f'like:{like.pk}')
+        self.assertFalse(Notification.objects.exists())
+
+    def test_worker_delivers_and_clears(self):
+        self.like()
+        call_command('run_notification_worker', '--once', stdout=StringIO())
+        notification = Notification.objects.get(recipient=self.owner)
+        self.assertEqual(notification.notification_type, 'like')
+        self.assertEqual(notification.photo, self.photo)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(notifications.unread_count(self.owner.pk), 1)
+
+    def test_rolled_back_change_queues_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                outbox.enqueue_notification(
+                    'follow:1', self.owner, self.fan, 'follow',
+                    'New Follower', 'fan started following you!')
+                raise RuntimeError
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_follows_are_bulk_delivered(self):
+        followers = [self.make_user(f'follower{i}') for i in range(5)]
+        for i, follower in enumerate(followers):
+            outbox.enqueue_notification(
+                f'follow:{i}', self.owner, follower, 'follow',
+                'New Follower', f'{follower.username} started following you!')
+        result = self.deliver()
+        self.assertEqual(result['delivered'], 5)
+        self.assertEqual(
+            Notification.objects.filter(recipient=self.owner).count(), 5)
+        self.assertEqual(
+            ProfileStats.objects.get(user=self.owner).unread_notifications, 5)
+
+    def test_redelivered_event_is_skipped(self):
+        self.like()
+        key = NotificationOutbox.objects.get().idempotency_key
+        self.deliver()
+        # A worker that crashed after delivering would leave the row behind
+        NotificationOutbox.objects.create(
+            idempotency_key=key, notification_type='like',
+            recipient_id=self.owner.pk, sender_id=self.fan.pk,
+            photo_id=self.photo.pk, title='t', message='m')
+        result = self.deliver()
+        self.assertEqual(result['skipped'], 1)
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(notifications.unread_count(self.owner.pk), 1)
+
+    def test_events_for_deleted_objects_are_dropped(self):
+        self.like()
+        self.photo.delete()
+        result = self.deliver()
+        self.assertEqual(result['skipped'], 1)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_failures_back_off_then_give_up(self):
+        self.like()
+        with mock.patch.object(outbox, 'create_notification',
+                               side_effect=ValueError('boom')):
+            result = self.deliver(max_attempts=2)
+            self.assertEqual(result['retried'], 1)
+            event = NotificationOutbox.objects.get()
+            self.assertEqual(event.attempts, 1)
+            self.assertGreater(event.available_at, timezone.now())
+            self.assertEqual(event.last_error, 'ValueError: boom')
+            # Not due yet
+            self.assertEqual(self.deliver()['claimed'], 0)
+
+            NotificationOutbox.objects.update(available_at=timezone.now())
+            result = self.deliver(max_attempts=2)
+        self.assertEqual(result['failed'], 1)
+        self.assertTrue(NotificationOutbox.objects.get().failed)
+        self.assertFalse(Notification.objects.exists())
+
+    @override_settings(NOTIFICATION_OUTBOX=False)
+    def test_inline_delivery_without_outbox(self):
+        self.like()
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertTrue(
+            Notification.objects.filter(recipient=self.owner).exists())
+
+
+@override_settings(NOTIFICATION_RETENTION={
+    'default': {'read': 90, 'unread': 365},
+    'follow': {'read': 30},
+})
+class NotificationRetentionTests(PhotoFixtureMixin, TestCase):
+    """Test pruning notifications past their retention period"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('owner')
+        self.fan = self.make_user('fan')
+
+    def notification(self, notification_type, days_old, is_read):
+        notification = Notification.objects.create(
+            recipient=self.owner, sender=self.fan,
+            notification_type=notification_type, title='t', message='m',
+            is_read=is_read)
+        Notification.objects.filter(pk=notification.pk).update(
+            created_at=timezone.now() - timedelta(days=days_old))
+        if not is_read:
+            notifications.adjust_unread(self.owner.pk, 1)
+        return notification
+
+    def prune(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('prune_notifications', *args, stdout=out)
+        return out.getvalue()
+
+    def test_rules_merge_per_type_overrides(self):
+        self.assertIn(('follow', True, 30), notifications.retention_rules())
+        self.assertIn(('follow', False, 365), notifications.retention_rules())
+
+    def test_prunes_only_expired_rows(self):
+        old_read = self.notification('like', 100, True)
+        recent_read = self.notification('like', 10, True)
+        old_follow = self.notification('follow', 40, True)
+        old_unread = self.notification('comment', 400, False)
+        kept_unread = self.notification('comment', 100, False)
+
+        output = self.prune('--chunk-size', '2')
+
+        remaining = set(Notification.objects.values_list('pk', flat=True))
+        self.assertEqual(remaining, {recent_read.pk, kept_unread.pk})
+        self.assertNotIn(old_read.pk, remaining)
+        self.assertNotIn(old_follow.pk, remaining)
+        self.assertNotIn(old_unread.pk, remaining)
+        self.assertIn('deleted 3/3', output)
+        self.assertEqual(notifications.unread_count(self.owner.pk), 1)
+        self.assertEqual(
+            ProfileStats.objects.get(user=self.owner).unread_notifications, 1)
+
+    def test_prune_expires_the_dropdown(self):
+        self.notification('like', 100, True)
+        version = notifications.notifications_version(self.owner.pk)
+        self.prune()
+        self.assertNotEqual(
+            notifications.notifications_version(self.owner.pk), version)
+
+    def test_dry_run_deletes_nothing(self):
+        self.notification('like', 100, True)
+        output = self.prune('--dry-run')
+        self.assertIn('would delete 1 like (read)', output)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_archive_holds_deleted_rows(self):
+        old = self.notification('like', 100, True)
+        with tempfile.TemporaryDirectory() as archive_dir:
+            self.prune('--archive-dir', archive_dir)
+            [name] = os.listdir(archive_dir)
+            with gzip.open(os.path.join(archive_dir, name), 'rt') as archive:
+                rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['id'] for row in rows], [old.pk])
+        self.assertEqual(rows[0]['notification_type'], 'like')
+
+    def test_failed_delete_keeps_archived_rows(self):
+        old = self.notification('like', 100, True)
+        with tempfile.TemporaryDirectory() as archive_dir:
+            with mock.patch('django.db.models.query.QuerySet.delete',
+                            side_effect=OSError('disk full')):
+                with self.assertRaises(OSError):
+                    self.prune('--archive-dir', archive_dir)
+            [name] = os.listdir(archive_dir)
+            with gzip.open(os.path.join(archive_dir, name), 'rt') as archive:
+                rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['id'] for row in rows], [old.pk])
+        self.assertTrue(Notification.objects.filter(pk=old.pk).exists())
+
+
+class NotificationDropdownTests(PhotoFixtureMixin, TestCase):
+    """Test the dropdown's single query and conditional responses"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('owner')
+        self.photo = self.make_photo(self.owner)
+        self.fans = [self.make_user(f'fan{i}') for i in range(3)]
+        self.client.login(username='owner', password='testpass123')
+        self.url = reverse('notifications_dropdown')
+
+    def like(self, fan):
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.create_notification(
+                self.owner, fan, 'like', 'Someone liked your photo',
+                f'{fan.username} liked your photo', photo=self.photo)
+
+    def follow(self, fan):
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.create_notification(
+                self.owner, fan, 'follow', 'New Follower',
+                f'{fan.username} started following you!')
+
+    def test_one_notifications_query(self):
+        self.like(self.fans[0])
+        for fan in self.fans:
+            self.follow(fan)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        data = response.json()
+        self.assertEqual(len(data['notifications']), 4)
+        self.assertEqual(data['unread_count'], 4)
+        self.assertEqual(data['notifications'][0]['sender_username'], 'fan2')
+        self.assertEqual(
+            [n['url'] for n in data['notifications']][-1],
+            reverse('photo_detail', kwargs={'photo_id': self.photo.id}))
+        notification_queries = [
+            q for q in queries.captured_queries
+            if 'portfolio_notification' in q['sql']]
+        self.assertEqual(len(notification_queries), 1,
+                         [q['sql'] for q in notification_queries])
+
+    def test_unchanged_dropdown_is_not_modified(self):
+        self.follow(self.fans[0])
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([
+            q for q in queries.captured_queries
+            if 'portfolio_notification' in q['sql']])
+
+    def test_etag_changes_with_new_rewritten_and_read(self):
+        self.like(self.fans[0])
+        first = self.client.get(self.url)['ETag']
+        # Coalesced into the same row; the count does not move
+        self.like(self.fans[1])
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first)
+        self.assertEqual(second.status_code, 200)
+        self.assertIn('fan1 and 1 other',
+                      second.json()['notifications'][0]['message'])
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.mark_all_as_read(self.owner.pk)
+        third = self.client.get(self.url, HTTP_IF_NONE_MATCH=second['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(third.json()['notifications'], [])
+
+
+@override_settings(NOTIFICATION_OUTBOX=True, NOTIFICATION_FANOUT_BATCH_SIZE=2)
+class UploadFanoutTests(PhotoFixtureMixin, TestCase):
+    """Test notifying followers about new uploads in chunks"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('artist')
+        self.followers = [self.make_user(f'fan{i}') for i in range(5)]
+        for follower in self.followers:
+            Follow.objects.create(follower=follower, following=self.owner)
+        Profile.objects.filter(user=self.followers[1]).update(
+            mute_upload_notifications=True)
+        self.photo = self.make_photo(self.owner, title='Dawn')
+
+    def queue(self):
+        outbox.enqueue_upload_fanout(self.photo, 'New photo', 'artist: Dawn')
+
+    def run_fanout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return outbox.deliver_fanout()
+
+    def recipients(self):
+        return set(Notification.objects.filter(
+            notification_type='photo_upload'
+        ).values_list('recipient_id', flat=True))
+
+    def test_upload_queues_one_event(self):
+        self.queue()
+        self.queue()
+        event = NotificationOutbox.objects.get()
+        self.assertEqual(event.idempotency_key,
+                         f'photo_upload:{self.photo.pk}')
+        # Regular batches leave fan-outs to deliver_fanout
+        self.assertEqual(outbox.deliver_batch()['claimed'], 0)
+
+    @override_settings(NOTIFICATION_OUTBOX=False,
+                       NOTIFICATION_FANOUT_THREAD=True, UPLOAD_PIPELINE=False,
+                       DIRECT_UPLOAD_BACKEND='local',
+                       MEDIA_ROOT=tempfile.mkdtemp())
+    def test_upload_request_does_not_write_follower_notifications(self):
+        self.client.login(username='artist', password='testpass123')
+        image = SimpleUploadedFile('dusk.gif', DirectUploadTests.GIF,
+                                   content_type='image/gif')
+        with mock.patch.object(outbox._fanout_thread, 'submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('upload_photo'), {
+                    'image': image, 'title': 'Dusk', 'is_public': 'on'})
+        photo = Photo.objects.get(title='Dusk')
+        self.assertFalse(Notification.objects.filter(photo=photo).exists())
+        self.assertTrue(
+            NotificationOutbox.objects.filter(photo_id=photo.pk).exists())
+        submit.assert_called_once_with(outbox._drain_in_background)
+
+        # What the background thread runs once the upload has committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.drain_fanouts(), 1)
+        self.assertEqual(len(self.recipients()), 4)
+
+    def test_fanout_skips_muted_followers(self):
+        self.queue()
+        result = self.run_fanout()
+        self.assertEqual(result['written'], 4)
+        self.assertIsNone(result['error'])
+        self.assertEqual(
+            self.recipients(),
+            {f.pk for f in self.followers} - {self.followers[1].pk})
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(notifications.unread_count(self.followers[0].pk), 1)
+        self.assertEqual(notifications.unread_count(self.followers[1].pk), 0)
+
+    def test_failed_fanout_resumes_from_checkpoint(self):
+        self.queue()
+        real_bulk_create = Notification.objects.bulk_create
+        calls = []
+
+        def fail_second_chunk(rows, *args, **kwargs):
+            calls.append(len(rows))
+            if len(calls) == 2:
+                raise ValueError('disk full')
+            return real_bulk_create(rows, *args, **kwargs)
+
+        with mock.patch.object(Notification.objects, 'bulk_create',
+                               side_effect=fail_second_chunk):
+            result = self.run_fanout()
+        self.assertEqual(result['error'], 'ValueError: disk full')
+        event = NotificationOutbox.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.cursor, self.followers[2].pk)
+
+        NotificationOutbox.objects.update(available_at=timezone.now())
+        result = self.run_fanout()
+        self.assertEqual(result['written'], 2)
+        self.assertEqual(Notification.objects.filter(
+            notification_type='photo_upload').count(), 4)
+
+    def test_leased_fanout_is_not_claimed_twice(self):
+        self.queue()
+        # Another worker is part way through this fan-out
+        NotificationOutbox.objects.update(available_at=outbox._lease_until())
+        self.assertIsNone(self.run_fanout())
+
+    def test_worker_reports_throughput(self):
+        self.queue()
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_notification_worker', '--once', stdout=out)
+        self.assertIn('Notified 4 followers', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+    @override_settings(NOTIFICATION_OUTBOX=False)
+    def test_worker_leaves_fanouts_to_the_web_process_without_outbox(self):
+        self.queue()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_notification_worker', '--once',
+                         stdout=StringIO())
+        self.assertFalse(self.recipients())
+        self.assertTrue(NotificationOutbox.objects.exists())
+
+
+class LikeToggleTests(PhotoFixtureMixin, TestCase):
+    """Test race-free like toggling and bulk like state"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('owner')
+        self.fan = self.make_user('fan')
+        self.photo = self.make_photo(self.owner)
+        self.client.login(username='fan', password='testpass123')
+
+    def toggle(self):
+        return self.client.post(
+            reverse('toggle_like', kwargs={'photo_id': self.photo.id})).json()
+
+    def test_toggle_round_trip(self):
+        self.assertEqual(self.toggle(), {'liked': True, 'likes_count': 1})
+        self.assertEqual(self.toggle(), {'liked': False, 'likes_count': 0})
+        self.assertEqual(
+            ProfileStats.objects.get(user=self.owner).likes_received, 0)
+
+    def test_concurrent_like_is_not_an_error(self):
+        # The other click's insert won the race
+        self.assertIsNotNone(likes.like(self.photo, self.fan))
+        self.assertIsNone(likes.like(self.photo, self.fan))
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.like_count, 1)
+
+    def test_unlike_uncounts_once(self):
+        likes.like(self.photo, self.fan)
+        self.assertTrue(likes.unlike(self.photo.pk, self.fan))
+        self.assertFalse(likes.unlike(self.photo.pk, self.fan))
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.like_count, 0)
+        self.assertEqual(
+            ProfileStats.objects.get(user=self.owner).likes_received, 0)
+
+    def test_unlike_expires_card_cache(self):
+        likes.like(self.photo, self.fan)
+        version = fragments.versions_for([self.photo.pk])[self.photo.pk]
+        with self.captureOnCommitCallbacks(execute=True):
+            likes.unlike(self.photo.pk, self.fan)
+        self.assertNotEqual(
+            fragments.versions_for([self.photo.pk])[self.photo.pk], version)
+
+    def test_like_states_in_one_query(self):
+        other = self.make_photo(self.owner, title='Other')
+        private = self.make_photo(self.owner, title='Hidden', is_public=False)
+        likes.like(self.photo, self.fan)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('like_states'),
+                data=json.dumps(
+                    {'photo_ids': [self.photo.pk, other.pk, private.pk]}),
+                content_type='application/json')
+        self.assertEqual(response.json()['likes'], {
+            str(self.photo.pk): {'liked': True, 'likes_count': 1},
+            str(other.pk): {'liked': False, 'likes_count': 0},
+        })
+        photo_queries = [q for q in queries.captured_queries
+                         if 'portfolio_photo' in q['sql']]
+        self.assertEqual(len(photo_queries), 1)
+
+    def test_unlike_sends_post_delete_for_the_row(self):
+        like = likes.like(self.photo, self.fan)
+        received = []
+
+        def handler(sender, instance, **kwargs):
+            received.append(instance.pk)
+        post_delete.connect(handler, sender=Like)
+        try:
+            likes.unlike(self.photo.pk, self.fan)
+        finally:
+            post_delete.disconnect(handler, sender=Like)
+        self.assertEqual(received, [like.pk])
+
+    def test_like_states_leaves_out_unpublished_photos(self):
+        processing = self.make_photo(
+            self.owner, title='Uploading', status=Photo.PROCESSING)
+        response = self.client.post(
+            reverse('like_states'),
+            data=json.dumps({'photo_ids': [self.photo.pk, processing.pk]}),
+            content_type='application/json')
+        self.assertEqual(list(response.json()['likes']), [str(self.photo.pk)])
+
+    def test_like_states_rejects_too_many_ids(self):
+        response = self.client.post(
+            reverse('like_states'),
+            data=json.dumps(
+                {'photo_ids': list(range(likes.MAX_STATE_IDS + 1))}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_like_states_rejects_bad_body(self):
+        response = self.client.post(
+            reverse('like_states'), data='[1, 2]',
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(FOLLOW_LIST_PAGE_SIZE=2)
+class FollowGraphTests(PhotoFixtureMixin, TestCase):
+    """Test follower list pages and the cached followed-id set"""
+
+    def setUp(self):
+        cache.clear()
+        self.star = self.make_user('star')
+        self.viewer = self.make_user('viewer')
+        self.fans = [self.make_user(f'fan{i}') for i in range(3)]
+        for i, fan in enumerate(self.fans):
+            Follow.objects.create(follower=fan, following=self.star)
+            Follow.objects.filter(follower=fan).update(
+                created_at=timezone.now() - timedelta(minutes=10 - i))
+        Follow.objects.create(follower=self.viewer, following=self.fans[2])
+        self.client.login(username='viewer', password='testpass123')
+
+    def test_pages_carry_viewer_follow_state(self):
+        url = reverse('followers_list', kwargs={'username': 'star'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        page = response.context['followers']
+        self.assertEqual([f.follower for f in page],
+                         [self.fans[2], self.fans[1]])
+        self.assertEqual([f.viewer_follows for f in page], [True, False])
+        follow_queries = [q for q in queries.captured_queries
+                          if 'portfolio_follow' in q['sql']]
+        self.assertEqual(len(follow_queries), 2)
+
+        cursor = response.context['next_cursor']
+        response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual([f.follower for f in response.context['followers']],
+                         [self.fans[0]])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_following_list_for_another_viewer(self):
+        response = self.client.get(
+            reverse('following_list', kwargs={'username': 'fan2'}))
+        self.assertEqual(
+            [f.viewer_follows for f in response.context['following']],
+            [False])
+
+    def test_cached_set_follows_changes(self):
+        self.assertTrue(follows.is_following(self.viewer.pk, self.fans[2].pk))
+        self.assertFalse(follows.is_following(self.viewer.pk, self.star.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.viewer, following=self.star)
+        self.assertTrue(follows.is_following(self.viewer.pk, self.star.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.viewer).delete()
+        self.assertFalse(follows.is_following(self.viewer.pk, self.fans[2].pk))
+
+    def test_profile_uses_cached_set(self):
+        follows.following_ids(self.viewer.pk)
+        url = reverse('profile_view', kwargs={'username': 'fan2'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertTrue(response.context['is_following'])
+        self.assertFalse([q for q in queries.captured_queries
+                          if 'portfolio_follow' in q['sql']])
+
+
+class FollowSuggestionTests(PhotoFixtureMixin, TestCase):
+    """Test the batch "who to follow" scoring and the pages reading it"""
+
+    def setUp(self):
+        cache.clear()
+        self.viewer = self.make_user('viewer')
+        self.friends = [self.make_user(f'friend{i}') for i in range(2)]
+        self.popular = self.make_user('popular')
+        self.taste = self.make_user('taste')
+        for friend in self.friends:
+            Follow.objects.create(follower=self.viewer, following=friend)
+            Follow.objects.create(follower=friend, following=self.popular)
+        photo = self.make_photo(self.friends[0], 'Shared')
+        Like.objects.create(photo=photo, user=self.viewer)
+        Like.objects.create(photo=photo, user=self.taste)
+
+    def compute(self):
+        call_command('compute_follow_suggestions', stdout=StringIO())
+
+    def test_scores_mutual_follows_and_shared_likes(self):
+        self.compute()
+        rows = FollowSuggestion.objects.filter(
+            user=self.viewer).order_by('-score')
+        self.assertEqual(
+            [(r.suggested, r.score, r.mutual_follows, r.shared_likes)
+             for r in rows],
+            [(self.popular, 2.0, 2, 0), (self.taste, 0.5, 0, 1)])
+
+    def test_recompute_replaces_rows(self):
+        self.compute()
+        count = FollowSuggestion.objects.count()
+        self.compute()
+        self.assertEqual(FollowSuggestion.objects.count(), count)
+
+    @override_settings(FOLLOW_SUGGESTION_MAX_LIKERS=1)
+    def test_photos_with_many_likers_are_ignored(self):
+        self.compute()
+        self.assertFalse(FollowSuggestion.objects.filter(
+            user=self.viewer, suggested=self.taste).exists())
+
+    def test_backends_agree(self):
+        graph = follow_suggestions.synthetic_graph(300, seed=1)
+        python = dict(follow_suggestions.score(graph, backend='python'))
+        scipy = dict(follow_suggestions.score(graph, backend='scipy'))
+        self.assertEqual(python.keys(), scipy.keys())
+        for user, top in python.items():
+            self.assertEqual([s for _, s, _, _ in top],
+                             [s for _, s, _, _ in scipy[user]])
+            followed = set(follow_suggestions._row(graph.follows, user))
+            for candidate, value, mutual, shared in scipy[user]:
+                self.assertNotIn(candidate, followed | {user})
+                self.assertAlmostEqual(value, mutual + 0.5 * shared, 5)
+
+    def test_scipy_backend_stores_the_same_suggestions(self):
+        call_command('compute_follow_suggestions', '--backend', 'scipy',
+                     stdout=StringIO())
+        rows = FollowSuggestion.objects.filter(
+            user=self.viewer).order_by('-score')
+        self.assertEqual(
+            [(r.suggested, r.score, r.mutual_follows, r.shared_likes)
+             for r in rows],
+            [(self.popular, 2.0, 2, 0), (self.taste, 0.5, 0, 1)])
+
+    def test_rows_added_during_load_are_skipped(self):
+        late = self.make_user('late')
+        real = Follow.objects.values_list
+
+        def values_list(*fields, **kwargs):
+            # A follow by a user created after the user ids were read
+            Follow.objects.get_or_create(follower=late, following=self.viewer)
+            return real(*fields, **kwargs)
+
+        with mock.patch('django.contrib.auth.models.User.objects.order_by',
+                        return_value=User.objects.exclude(pk=late.pk)
+                        .order_by('pk')), \
+                mock.patch.object(Follow.objects, 'values_list',
+                                  side_effect=values_list):
+            graph = follow_suggestions.load_graph()
+        self.assertNotIn(late.pk, graph.user_ids)
+
+    def test_home_reads_suggestions_in_one_query(self):
+        self.compute()
+        self.client.login(username='viewer', password='testpass123')
+        follows.following_ids(self.viewer.pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('portfolio_home'))
+        self.assertEqual(
+            [s.suggested for s in response.context['suggestions']],
+            [self.popular, self.taste])
+        self.assertContains(response, 'Who to follow')
+        self.assertEqual(len([
+            q for q in queries.captured_queries
+            if 'portfolio_followsuggestion' in q['sql']]), 1)
+
+    def test_followed_accounts_drop_out_before_recompute(self):
+        self.compute()
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.viewer, following=self.popular)
+        self.assertEqual(
+            [s.suggested for s in
+             follow_suggestions.suggestions_for(self.viewer)],
+            [self.taste])
+
+    def test_only_owner_sees_suggestions_on_profile(self):
+        self.compute()
+        self.client.login(username='viewer', password='testpass123')
+        response = self.client.get(
+            reverse('profile_view', kwargs={'username': 'viewer'}))
+        self.assertEqual(len(response.context['suggestions']), 2)
+        response = self.client.get(
+            reverse('profile_view', kwargs={'username': 'friend0'}))
+        self.assertEqual(response.context['suggestions'], [])
+
+
+@override_settings(DIRECT_UPLOAD_BACKEND='local',
+                   MEDIA_ROOT=tempfile.mkdtemp())
+class DirectUploadTests(PhotoFixtureMixin, TestCase):
+    """Test signed browser-to-storage uploads against the local stand-in"""
+
+    GIF = (
+        b'\x47\x49\x46\x38\x39\x61\x02\x00\x01\x00\x80\x00\x00\x00\x00\x00'
+        b'\x00\x00\x00\x21\xF9\x04\x00\x00\x00\x00\x00\x2C\x00\x00\x00\x00'
+        b'\x02\x00\x01\x00\x00\x02\x02\x0C\x0A\x00\x3B'
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.user = self.make_user('shooter')
+        self.client.login(username='shooter', password='testpass123')
+
+    def ticket(self):
+        response = self.client.post(reverse('direct_upload_ticket'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def store(self, ticket, name='frame.gif'):
+        upload = SimpleUploadedFile(name, self.GIF, content_type='image/gif')
+        return self.client.post(ticket['upload_url'],
+                                dict(ticket['fields'], file=upload))
+
+    def confirm(self, stored, **fields):
+        data = {key: stored[key]
+                for key in ('public_id', 'version', 'signature', 'format')}
+        data.update(title='Harbour at dusk', is_public='on')
+        data.update(fields)
+        return self.client.post(reverse('direct_upload_confirm'), data)
+
+    def test_ticket_upload_confirm_creates_photo(self):
+        stored = self.store(self.ticket()).json()
+        self.assertTrue(stored['public_id'].startswith(
+            f'photos/u{self.user.pk}/'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.confirm(stored)
+        self.assertEqual(response.status_code, 200)
+        photo = Photo.objects.get(pk=response.json()['photo_id'])
+        self.assertEqual(photo.owner, self.user)
+        # Served from default storage, where the stand-in saved the file
+        name = f"direct_uploads/{stored['public_id']}.gif"
+        self.assertEqual(str(photo.image), name[:-4])
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(photo.renditions['detail'], default_storage.url(name))
+        self.assertEqual(photo.renditions['srcset'], '')
+        self.assertContains(
+            self.client.get(reverse('photo_detail', args=[photo.pk])),
+            f'src="{default_storage.url(name)}"')
+
+        # Confirming again does not create a second photo
+        self.assertEqual(self.confirm(stored).json()['photo_id'], photo.pk)
+        self.assertEqual(Photo.objects.count(), 1)
+
+    def test_tampered_response_is_rejected(self):
+        stored = self.store(self.ticket()).json()
+        response = self.confirm(stored, version=int(stored['version']) + 1)
+        self.assertEqual(response.status_code, 403)
+        response = self.confirm(stored, format='png')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Photo.objects.exists())
+
+    def test_confirm_is_idempotent_per_public_id(self):
+        stored = self.store(self.ticket()).json()
+        # Cloudinary does not sign the format, so it is not trusted there
+        with self.settings(DIRECT_UPLOAD_BACKEND='cloudinary'), \
+                mock.patch.object(direct_uploads, 'response_signature',
+                                  return_value=stored['signature']):
+            with self.captureOnCommitCallbacks(execute=True):
+                photo_id = self.confirm(stored).json()['photo_id']
+            response = self.confirm(stored, format='png')
+        self.assertEqual(response.json()['photo_id'], photo_id)
+        photo = Photo.objects.get()
+        self.assertIsNone(photo.image.format)
+        self.assertEqual(photo.image.public_id, stored['public_id'])
+
+    def test_cannot_claim_another_users_upload(self):
+        stored = self.store(self.ticket()).json()
+        self.make_user('thief')
+        self.client.login(username='thief', password='testpass123')
+        self.assertEqual(self.confirm(stored).status_code, 403)
+
+    def test_storage_rejects_bad_tickets(self):
+        ticket = self.ticket()
+        forged = dict(ticket, fields=dict(
+            ticket['fields'], public_id='photos/u999/mine'))
+        self.assertEqual(self.store(forged).status_code, 400)
+        self.assertEqual(self.store(ticket, name='notes.txt').status_code, 400)
+        with mock.patch('time.time', return_value=(
+                ticket['fields']['timestamp'] + 60 * 60)):
+            self.assertEqual(self.store(ticket).status_code, 400)
+
+    def test_local_storage_is_not_served_with_cloudinary(self):
+        ticket = self.ticket()
+        with self.settings(DIRECT_UPLOAD_BACKEND='cloudinary'):
+            self.assertEqual(self.store(ticket).status_code, 404)
+        self.assertFalse(Photo.objects.exists())
+
+    def test_invalid_details_are_reported(self):
+        stored = self.store(self.ticket()).json()
+        response = self.confirm(stored, title='ab')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('title', response.json()['errors'])
+
+
+@override_settings(UPLOAD_PIPELINE=True, UPLOAD_SPOOL_DIR=tempfile.mkdtemp(),
+                   DIRECT_UPLOAD_BACKEND='local',
+                   MEDIA_ROOT=tempfile.mkdtemp())
+class UploadPipelineTests(PhotoFixtureMixin, TestCase):
+    """Test spooled uploads stored later by the process_uploads worker"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('shooter')
+        self.fan = self.make_user('fan')
+        Follow.objects.create(follower=self.fan, following=self.owner)
+        self.client.login(username='shooter', password='testpass123')
+
+    def upload(self, title='Harbour at dusk'):
+        image = SimpleUploadedFile(
+            'frame.gif', DirectUploadTests.GIF, content_type='image/gif')
+        return self.client.post(reverse('upload_photo'), {
+            'image': image, 'title': title, 'is_public': 'on'})
+
+    def status(self, photo):
+        return self.client.get(
+            reverse('upload_status', args=[photo.pk])).json()
+
+    def process(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return uploads.process_batch(**kwargs)
+
+    def published(self):
+        """The owner's photo count and the photos in the search index."""
+        return (ProfileStats.objects.get(user=self.owner).photos_count,
+                search.get_backend().search(
+                    search.KIND_PHOTO, ['harbour'], 10))
+
+    def test_upload_returns_before_storing(self):
+        response = self.upload()
+        photo = Photo.objects.get()
+        self.assertRedirects(
+            response, f"{reverse('upload_photo')}?processing={photo.pk}")
+        self.assertEqual(photo.status, Photo.PROCESSING)
+        job = photo.upload
+        self.assertTrue(os.path.exists(uploads.spool_path(job.spool_name)))
+        self.assertEqual(self.status(photo)['status'], 'processing')
+        self.assertEqual(self.published(), (0, []))
+
+        # Hidden from feeds and from other people until it is stored
+        home = self.client.get(reverse('home'))
+        self.assertNotIn(photo, list(home.context['photos']))
+        self.assertRedirects(
+            self.client.get(reverse('photo_detail', args=[photo.pk])),
+            f"{reverse('upload_photo')}?processing={photo.pk}",
+            fetch_redirect_response=False)
+        self.client.login(username='fan', password='testpass123')
+        response = self.client.get(reverse('photo_detail', args=[photo.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_worker_stores_and_publishes(self):
+        self.upload()
+        photo = Photo.objects.get()
+        spooled = uploads.spool_path(photo.upload.spool_name)
+        result = self.process()
+        self.assertEqual(result, {'claimed': 1, 'ready': 1, 'retried': 0,
+                                  'failed': 0})
+        photo.refresh_from_db()
+        self.assertEqual(photo.status, Photo.READY)
+        self.assertTrue(photo.image.public_id.startswith(
+            f'direct_uploads/photos/u{self.owner.pk}/'))
+        self.assertTrue(photo.renditions)
+        self.assertEqual(self.published(), (1, [photo.pk]))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.fan, photo=photo).exists())
+        self.assertFalse(PhotoUpload.objects.exists())
+        self.assertFalse(os.path.exists(spooled))
+        self.assertEqual(self.status(photo)['url'],
+                         reverse('photo_detail', args=[photo.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            outbox.drain_fanouts()
+        self.assertTrue(Notification.objects.filter(
+            recipient=self.fan, photo=photo,
+            notification_type='photo_upload').exists())
+        home = self.client.get(reverse('home'))
+        self.assertIn(photo, list(home.context['photos']))
+
+    def test_timeline_fan_out_waits_for_commit(self):
+        self.upload()
+        with mock.patch.object(uploads.timeline, 'fan_out_photo') as fan_out:
+            with self.captureOnCommitCallbacks() as callbacks:
+                uploads.process_batch()
+            fan_out.assert_not_called()
+            for callback in callbacks:
+                callback()
+        fan_out.assert_called_once()
+
+    def test_failed_transfers_back_off_then_give_up(self):
+        self.upload()
+        photo = Photo.objects.get()
+        with mock.patch.object(uploads.direct_uploads, 'upload_file',
+                               side_effect=OSError('storage down')):
+            result = self.process(max_attempts=2)
+            self.assertEqual(result['retried'], 1)
+            job = PhotoUpload.objects.get()
+            self.assertEqual(job.attempts, 1)
+            self.assertGreater(job.available_at, timezone.now())
+            # Not due yet
+            self.assertEqual(self.process(max_attempts=2)['claimed'], 0)
+
+            PhotoUpload.objects.update(available_at=timezone.now())
+            self.assertEqual(self.process(max_attempts=2)['failed'], 1)
+        status = self.status(photo)
+        self.assertEqual(status['status'], 'failed')
+        self.assertIn('storage down', status['error'])
+        self.assertEqual(self.process()['claimed'], 0)
+        self.assertEqual(self.published(), (0, []))
+        # Deleting the failed photo does not uncount a published one
+        self.make_photo(self.owner)
+        photo.delete()
+        self.assertEqual(
+            ProfileStats.objects.get(user=self.owner).photos_count, 1)
+
+    def test_command_drains_queue(self):
+        for i in range(3):
+            self.upload(title=f'Frame number {i}')
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('process_uploads', '--once', '--workers', '2',
+                         stdout=out)
+        self.assertIn('Stored 3 upload(s)', out.getvalue())
+        self.assertFalse(Photo.objects.exclude(status=Photo.READY).exists())
+
+    @override_settings(UPLOAD_PIPELINE=False)
+    def test_inline_upload_without_pipeline(self):
+        response = self.upload()
+        self.assertRedirects(response, reverse('home'),
+                             fetch_redirect_response=False)
+        photo = Photo.objects.get()
+        self.assertEqual(photo.status, Photo.READY)
+        self.assertFalse(PhotoUpload.objects.exists())
+
+
+@override_settings(DIRECT_UPLOAD_BACKEND='local',
+                   MEDIA_ROOT=tempfile.mkdtemp())
+class BulkUploadTests(PhotoFixtureMixin, TestCase):
+    """Test uploading many files and zip archives in one request"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('shooter')
+        self.fan = self.make_user('fan')
+        Follow.objects.create(follower=self.fan, following=self.owner)
+        self.client.login(username='shooter', password='testpass123')
+
+    def gif(self, name):
+        return SimpleUploadedFile(name, DirectUploadTests.GIF,
+                                  content_type='image/gif')
+
+    def archive(self, members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            for name, data in members.items():
+                zf.writestr(name, data)
+        return SimpleUploadedFile('shoot.zip', buffer.getvalue(),
+                                  content_type='application/zip')
+
+    def post(self, files, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('bulk_upload'), {'files': files, 'is_public': 'on'},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest', **extra)
+
+    def test_files_and_archives_report_per_file_status(self):
+        archive = self.archive({
+            'day1/harbour_dawn.gif': DirectUploadTests.GIF,
+            'day1/notes.txt': b'f/8, 1/250',
+            'day1/broken.gif': b'GIF89a not really',
+            '__MACOSX/day1/._harbour_dawn.gif': b'',
+        })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([self.gif('pier-at-night.gif'), archive])
+        results = response.json()['results']
+        self.assertEqual(
+            [(r['name'], r['status']) for r in results],
+            [('pier-at-night.gif', 'created'),
+             ('day1/harbour_dawn.gif', 'created'),
+             ('day1/notes.txt', 'invalid'),
+             ('day1/broken.gif', 'invalid')])
+        self.assertEqual(
+            set(Photo.objects.values_list('title', flat=True)),
+            {'pier at night', 'harbour dawn'})
+        inserts = [q for q in queries.captured_queries
+                   if q['sql'].startswith('INSERT INTO "portfolio_photo"')]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertEqual(stats.stats_for(self.owner).photos_count, 2)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.fan).count(),
+                         2)
+        self.assertFalse(Notification.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            outbox.drain_fanouts()
+        notification = Notification.objects.get(recipient=self.fan)
+        self.assertEqual(notification.message, 'shooter uploaded 2 photos')
+
+    @override_settings(BULK_UPLOAD_MAX_FILES=2)
+    def test_file_limit(self):
+        results = self.post(
+            [self.gif(f'frame{i}.gif') for i in range(3)]).json()['results']
+        self.assertEqual([r['status'] for r in results],
+                         ['created', 'created', 'invalid'])
+
+    def test_storage_failures_are_reported(self):
+        calls = []
+
+        def flaky(fileobj, public_id, image_format):
+            calls.append(public_id)
+            if len(calls) == 1:
+                raise OSError('storage down')
+            return direct_uploads.stored_image(public_id, 1, image_format)
+
+        results = bulk_uploads.bulk_upload(
+            self.owner, [self.gif('one.gif'), self.gif('two.gif')],
+            workers=1, store=flaky)
+        self.assertEqual([r['status'] for r in results], ['failed', 'created'])
+        self.assertIn('storage down', results[0]['error'])
+        self.assertEqual(Photo.objects.count(), 1)
+
+    def test_failed_insert_deletes_stored_files(self):
+        stored = []
+
+        def store(fileobj, public_id, image_format):
+            image = direct_uploads.upload_file(
+                fileobj, public_id, image_format)
+            stored.append(f'{image}.{image.format}')
+            return image
+
+        with mock.patch.object(Photo.objects, 'bulk_create',
+                               side_effect=IntegrityError('boom')):
+            with self.assertRaises(IntegrityError):
+                bulk_uploads.bulk_upload(
+                    self.owner, [self.gif('one.gif'), self.gif('two.gif')],
+                    store=store)
+        self.assertEqual(len(stored), 2)
+        self.assertFalse(any(default_storage.exists(name) for name in stored))
+        self.assertEqual(stats.stats_for(self.owner).photos_count, 0)
+
+    def test_page_renders_results(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('bulk_upload'), {
+                'files': [self.gif('one.gif')], 'is_public': 'on'})
+        self.assertContains(response, '1 of 1 file uploaded')
+
+
+class UploadMediaToCloudinaryTests(PhotoFixtureMixin, TestCase):
+    """Test the resumable, deduplicating upload_media_to_cloudinary"""
+
+    def setUp(self):
+        self.owner = self.make_user('archivist')
+        self.folder = tempfile.mkdtemp()
+        for name, data in (('a.jpg', b'same bytes'), ('b.jpg', b'same bytes'),
+                           ('c.jpg', b'other bytes')):
+            with open(os.path.join(self.folder, name), 'wb') as f:
+                f.write(data)
+        self.shared = [self.make_photo(self.owner, image='photos/a.jpg')
+                       for _ in range(2)]
+        self.copy = self.make_photo(self.owner, image='photos/b.jpg')
+        self.other = self.make_photo(self.owner, image='photos/c.jpg')
+        self.missing = self.make_photo(self.owner, image='photos/gone.jpg')
+        self.migrated = self.make_photo(
+            self.owner, image='image/upload/v5/photos/u1/done.jpg')
+        self.uploaded = []
+
+    def upload(self, path, resource_type):
+        self.uploaded.append(os.path.basename(path))
+        return {'public_id': f'photos/u1/{len(self.uploaded)}',
+                'version': 7, 'format': 'jpg',
+                'secure_url': 'https://res.cloudinary.com/x.jpg'}
+
+    def run_command(self, *args):
+        out = StringIO()
+        with mock.patch('cloudinary.uploader.upload', side_effect=self.upload):
+            call_command('upload_media_to_cloudinary', '--path', self.folder,
+                         '--batch-size', '2', *args, stdout=out,
+                         stderr=StringIO())
+        return out.getvalue()
+
+    def image(self, photo):
+        photo.refresh_from_db()
+        return photo.image.public_id, photo.image.version
+
+    def test_uploads_each_content_once_and_updates_photos(self):
+        out = self.run_command('--workers', '3')
+        self.assertEqual(sorted(self.uploaded), ['a.jpg', 'c.jpg'])
+        a_image = self.image(self.shared[0])
+        self.assertEqual(a_image[1], '7')
+        self.assertEqual(self.image(self.shared[1]), a_image)
+        # b.jpg has a.jpg's bytes, so it reuses that upload
+        self.assertEqual(self.image(self.copy), a_image)
+        self.assertNotEqual(self.image(self.other), a_image)
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.renditions['public_id'],
+                         self.copy.image.public_id)
+        self.assertEqual(self.image(self.missing), ('photos/gone', None))
+        self.assertEqual(self.image(self.migrated), ('photos/u1/done', '5'))
+        self.assertIn('Updated 4 Photo(s)', out)
+        self.assertIn('2 file(s) uploaded', out)
+        self.assertIn('1 deduplicated by content', out)
+        self.assertIn('1 missing', out)
+
+    def test_rerun_resumes_from_the_manifest(self):
+        with mock.patch.object(self, 'upload',
+                               side_effect=OSError('connection reset')):
+            out = self.run_command('--workers', '1')
+        self.assertIn('3 failed', out)
+        self.assertEqual(self.image(self.other), ('photos/c', None))
+
+        self.run_command('--workers', '1')
+        self.assertEqual(sorted(self.uploaded), ['a.jpg', 'c.jpg'])
+        # An interruption between upload and update: the photo is reset but
+        # its file is in the manifest, so it is updated without uploading
+        Photo.objects.filter(pk=self.other.pk).update(image='photos/c.jpg')
+        out = self.run_command('--workers', '1')
+        self.assertEqual(len(self.uploaded), 2)
+        self.assertIn('1 already in the manifest', out)
+        self.assertEqual(self.image(self.other), ('photos/u1/2', '7'))
+        manifest = os.path.join(self.folder, '.cloudinary_manifest.jsonl')
+        with open(manifest) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_dry_run_changes_nothing(self):
+        out = self.run_command('--dry-run')
+        self.assertEqual(self.uploaded, [])
+        self.assertIn('Would upload', out)
+        self.assertEqual(self.image(self.copy), ('photos/b', None))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.folder, '.cloudinary_manifest.jsonl')))
+
+
+@override_settings(DIRECT_UPLOAD_BACKEND='cloudinary',
+                   MEDIA_ROOT=tempfile.mkdtemp())
+class CreateProfilesMigrationTests(PhotoFixtureMixin, TestCase):
+    """Test the chunked, parallel media migration in create_profiles"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = self.make_user('collector')
+        self.photos = []
+        for i in range(5):
+            name = f'photos/shot{self.owner.pk}-{i}.jpg'
+            self.write(name)
+            self.photos.append(self.make_photo(self.owner, image=name))
+        self.missing = self.make_photo(self.owner, image='photos/lost.jpg')
+        self.migrated = self.make_photo(
+            self.owner, image='image/upload/v3/photos/u1/kept.jpg')
+        self.profile = Profile.objects.get(user=self.owner)
+        self.profile.avatar = f'avatars/face{self.owner.pk}.png'
+        self.profile.save()
+        self.write(f'avatars/face{self.owner.pk}.png')
+        self.uploaded = []
+        self.report = os.path.join(tempfile.mkdtemp(), 'report.json')
+
+    def write(self, name):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(name.encode())
+
+    def upload(self, path, public_id, **kwargs):
+        self.uploaded.append(os.path.relpath(path, settings.MEDIA_ROOT))
+        # Migrated files keep their original bytes
+        self.assertEqual(kwargs, {})
+        return {'public_id': public_id, 'version': 9,
+                'format': path.rsplit('.', 1)[-1]}
+
+    def run_command(self, *args):
+        out = StringIO()
+        with mock.patch('cloudinary.uploader.upload',
+                        side_effect=self.upload):
+            call_command('create_profiles', '--batch-size', '2',
+                         '--workers', '3', '--report', self.report, *args,
+                         stdout=out, stderr=StringIO())
+        with open(self.report) as f:
+            return out.getvalue(), json.load(f)
+
+    def test_migrates_in_chunks_and_skips_migrated_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            out, report = self.run_command()
+        self.assertEqual(len(self.uploaded), 6)
+        for photo in self.photos:
+            photo.refresh_from_db()
+            self.assertEqual(photo.image.version, '9')
+            self.assertTrue(photo.image.public_id.startswith(
+                direct_uploads.user_folder(self.owner) + '/'))
+            self.assertEqual(photo.renditions['public_id'],
+                             photo.image.public_id)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar.version, '9')
+        self.assertTrue(self.profile.avatar.public_id.startswith(
+            f'avatars/u{self.owner.pk}/'))
+        self.assertEqual(self.profile.renditions['avatar']['public_id'],
+                         self.profile.avatar.public_id)
+        self.missing.refresh_from_db()
+        self.assertIsNone(self.missing.image.version)
+        self.migrated.refresh_from_db()
+        self.assertEqual(self.migrated.image.version, '3')
+
+        self.assertTrue(report['finished'])
+        self.assertEqual(report['photos']['migrated'], 5)
+        self.assertEqual(report['photos']['missing'], 1)
+        self.assertEqual(report['photos']['last_id'], self.missing.pk)
+        self.assertEqual(report['avatars']['migrated'], 1)
+        self.assertIn('"model": "photos"', out)
+        # One UPDATE per chunk, not one per row
+        updates = [q for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE "portfolio_photo"')]
+        self.assertEqual(len(updates), 3)
+
+        # Already migrated rows are skipped on a second run
+        out, report = self.run_command()
+        self.assertEqual(len(self.uploaded), 6)
+        self.assertEqual(report['photos']['examined'], 1)
+
+    def test_since_ids_and_limit(self):
+        out, report = self.run_command('--only', 'photos', '--limit', '3')
+        self.assertEqual(len(self.uploaded), 3)
+        self.assertNotIn('avatars', report)
+        last_id = report['photos']['last_id']
+        self.assertEqual(last_id, self.photos[2].pk)
+
+        out, report = self.run_command(
+            '--only', 'photos', '--since-photo-id', str(last_id))
+        self.assertEqual(len(self.uploaded), 5)
+        self.assertEqual(report['photos']['examined'], 3)
+
+        # Each model resumes from its own cursor
+        out, report = self.run_command(
+            '--since-profile-id', str(self.profile.pk),
+            '--since-photo-id', str(self.missing.pk))
+        self.assertEqual(report['avatars']['examined'], 0)
+        self.assertEqual(report['photos']['examined'], 0)
+        out, report = self.run_command('--since-photo-id', str(last_id))
+        self.assertEqual(report['avatars']['migrated'], 1)
+        self.assertEqual(len(self.uploaded), 6)
+
+    @override_settings(DIRECT_UPLOAD_BACKEND='local')
+    def test_skips_without_cloud_storage(self):
+        out = StringIO()
+        call_command('create_profiles', stdout=out)
+        self.assertIn('Cloud storage not detected', out.getvalue())
+        self.photos[0].refresh_from_db()
+        self.assertIsNone(self.photos[0].image.version)
@@ -0,0 +1,214 @@
+"""
+Following feed backed by a materialized per-user timeline.
+
+Uploading a public photo writes one ``TimelineEntry`` per follower
+(fan-out-on-write), so reading the feed is a single range scan over
+``(user, created_at, photo)``. Accounts whose audience is larger than
+``TIMELINE_FANOUT_MAX_FOLLOWERS`` are flagged ``fanout_on_read``; their
+photos are not copied to every follower and are instead merged into the
+feed at read time from the photo table's own owner index.
+
+Follows that predate the timelines are seeded with ``manage.py
+backfill_timelines`` (``backfill_timelines``).
+"""
+import heapq
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Follow, Photo, Profile, TimelineEntry
+from .pagination import encode_cursor, keyset_page
+
+
+def _entry(user_id, photo):
+    return TimelineEntry(
+        user_id=user_id,
+        photo_id=photo.pk,
+        owner_id=photo.owner_id,
+        created_at=photo.created_at,
+    )
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def uses_fanout_on_read(user):
+    return Profile.objects.filter(user=user, fanout_on_read=True).exists()
+
+
+def update_fanout_mode(user, followers_count):
+    """
+    Switch ``user`` to fan-out-on-read once they pass the follower limit.
+
+    The flag is sticky: flipping back would leave followers' timelines
+    without the photos that were served on read in the meantime.
+    """
+    if followers_count > settings.TIMELINE_FANOUT_MAX_FOLLOWERS:
+        Profile.objects.filter(user=user, fanout_on_read=False).update(
+            fanout_on_read=True)
+
+
+def fan_out_photo(photo):
+    """
+    Copy a newly uploaded public photo into every follower's timeline.
+
+    Followers are streamed with ``.iterator()`` and written with chunked
+    ``bulk_create`` calls, each in its own short transaction. Returns the
+    number of timeline rows written (0 for fan-out-on-read accounts).
+    """
+    return fan_out_photos(photo.owner, [photo])
+
+
+def fan_out_photos(owner, photos):
+    """
+    Like ``fan_out_photo`` for several new photos by ``owner``, streaming
+    the followers once.
+    """
+    photos = [photo for photo in photos if photo.is_public]
+    if not photos or uses_fanout_on_read(owner):
+        return 0
+    # Keep each bulk insert near TIMELINE_FANOUT_BATCH_SIZE rows
+    batch_size = max(settings.TIMELINE_FANOUT_BATCH_SIZE // len(photos), 1)
+    follower_ids = (
+        Follow.objects.filter(following=owner)
+        .values_list('follower_id', flat=True)
+        .iterator(chunk_size=batch_size)
+    )
+    written = 0
+    for chunk in _chunks(follower_ids, batch_size):
+        with transaction.atomic():
+            TimelineEntry.objects.bulk_create(
+                [_entry(user_id, photo)
+                 for user_id in chunk for photo in photos],
+                ignore_conflicts=True,
+            )
+        written += len(chunk) * len(photos)
+    return written
+
+
+def _recent_photos(owner):
+    """The photos a new follower's timeline is seeded with."""
+    return list(
+        Photo.objects.filter(owner=owner, is_public=True)
+        .order_by('-created_at', '-id')
+        .only('id', 'owner_id', 'created_at')
+        [:settings.TIMELINE_BACKFILL_LIMIT]
+    )
+
+
+def backfill_follow(follower, following):
+    """Seed a new follower's timeline with the account's recent photos."""
+    if uses_fanout_on_read(following):
+        return 0
+    photos = _recent_photos(following)
+    TimelineEntry.objects.bulk_create(
+        [_entry(follower.pk, photo) for photo in photos],
+        ignore_conflicts=True,
+    )
+    return len(photos)
+
+
+def backfill_timelines(batch_size=None, progress=None):
+    """
+    Seed timelines from the follows that existed before them.
+
+    Walks followed accounts in id order: flags those past the follower
+    limit ``fanout_on_read`` (as ``update_fanout_mode`` does on a new
+    follow) and copies the others' recent photos, as ``backfill_follow``
+    would, into their followers' timelines in chunked ``bulk_create``
+    calls. Existing rows are kept, so it can be run again. ``progress`` is
+    called with ``(accounts, rows)`` after each account. Returns the number
+    of rows written.
+    """
+    batch_size = batch_size or settings.TIMELINE_FANOUT_BATCH_SIZE
+    accounts = (
+        Follow.objects.order_by('following_id').values('following_id')
+        .annotate(followers=Count('pk')).values_list(
+            'following_id', 'followers'))
+    written = done = 0
+    for owner_id, followers_count in accounts.iterator():
+        update_fanout_mode(owner_id, followers_count)
+        photos = [] if uses_fanout_on_read(owner_id) else _recent_photos(
+            owner_id)
+        # One follower's share of a batch, as in fan_out_photos
+        chunk_size = max(batch_size // max(len(photos), 1), 1)
+        follower_ids = (
+            Follow.objects.filter(following_id=owner_id)
+            .values_list('follower_id', flat=True)
+            .iterator(chunk_size=chunk_size))
+        for chunk in _chunks(follower_ids if photos else (), chunk_size):
+            with transaction.atomic():
+                TimelineEntry.objects.bulk_create(
+                    [_entry(user_id, photo)
+                     for user_id in chunk for photo in photos],
+                    ignore_conflicts=True,
+                )
+            written += len(chunk) * len(photos)
+        done += 1
+        if progress:
+            progress(done, written)
+    return written
+
+
+def remove_follow(follower, following):
+    """Drop an unfollowed account's photos from the follower's timeline."""
+    deleted, _ = TimelineEntry.objects.filter(
+        user=follower, owner=following).delete()
+    return deleted
+
+
+def following_feed(user, cursor=None, page_size=None):
+    """
+    Return ``(photos, next_cursor)`` for ``user``'s Following feed.
+
+    Materialized timeline rows and photos from followed fan-out-on-read
+    accounts are paged with the same ``(created_at, photo id)`` cursor and
+    merged newest-first. Photos carry the ``feed_for`` card annotations.
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    entries, more_entries = keyset_page(
+        TimelineEntry.objects.filter(user=user, photo__is_public=True),
+        cursor, page_size, tiebreak='photo_id')
+    keys = [(e.created_at, e.photo_id) for e in entries]
+
+    more_on_read = None
+    read_owner_ids = list(
+        Follow.objects.filter(
+            follower=user, following__profile__fanout_on_read=True)
+        .values_list('following_id', flat=True)
+    )
+    if read_owner_ids:
+        on_read, more_on_read = keyset_page(
+            Photo.objects.filter(owner_id__in=read_owner_ids,
+                                 is_public=True)
+            .only('id', 'created_at'),
+            cursor, page_size)
+        keys = list(heapq.merge(
+            keys, [(p.created_at, p.id) for p in on_read], reverse=True))
+
+    # Drop duplicates (an account may have been fanned out before it
+    # switched to fan-out-on-read) and trim to one page
+    seen, page_keys = set(), []
+    for key in keys:
+        if key[1] not in seen:
+            seen.add(key[1])
+            page_keys.append(key)
+    has_more = (len(page_keys) > page_size or more_entries is not None
+                or more_on_read is not None)
+    page_keys = page_keys[:page_size]
+
+    photos = Photo.objects.feed_for(user).in_bulk(
+        [pk for _, pk in page_keys])
+    next_cursor = None
+    if page_keys and has_more:
+        next_cursor = encode_cursor(*page_keys[-1])
+    return [photos[pk] for _, pk in page_keys if pk in photos], next_cursor
@@ -0,0 +1,200 @@
+"""
+Publishing uploaded photos, inline or through the background pipeline.
+
+Without ``UPLOAD_PIPELINE`` the upload view stores the image with
+``direct_uploads.upload_file`` during the request and publishes the photo.
+
+With it, ``submit`` copies the upload into ``UPLOAD_SPOOL_DIR`` chunk by
+chunk and saves the ``Photo`` as ``processing`` together with a
+``PhotoUpload`` job, so the request returns as soon as the file is on local
+disk. Processing photos are left out of the feeds (``feed_for``), the
+profile counter, the search index and the suggestions until they are ready
+(``photos_published``); the upload page polls ``upload_status`` meanwhile.
+
+``manage.py process_uploads`` runs ``process_batch``: it leases due jobs
+(pushing ``available_at`` forward, as notification fan-outs do), stores
+the files from a bounded thread pool, and in the main thread marks each
+photo ready, deletes its job and publishes it. Failures are retried with
+exponential backoff; after ``UPLOAD_PIPELINE_MAX_ATTEMPTS`` the photo is
+marked failed and the job kept for inspection in the admin.
+"""
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import direct_uploads, images, search, stats, suggest, timeline
+from .models import Photo, PhotoUpload
+from .outbox import enqueue_upload_fanout
+
+DEFAULT_BATCH_SIZE = 20
+
+
+def image_format(upload):
+    return os.path.splitext(upload.name)[1].lstrip('.').lower() or 'jpg'
+
+
+def photos_published(owner_id, photos):
+    """
+    Count, index and suggest ``photos`` now that they are ready.
+
+    Called by the ``Photo`` post_save handler for photos created ready, by
+    ``_finish`` when a processed upload turns ready and by the bulk upload
+    path, whose ``bulk_create`` sends no signals.
+    """
+    stats.adjust(owner_id, photos_count=len(photos))
+    search.index_photos(photos)
+    for photo in photos:
+        suggest.record_change(suggest.KIND_PHOTO, photo.pk)
+
+
+def publish(photo, update_fields=None):
+    """Save a stored photo and tell the owner's followers about it."""
+    photo.renditions = images.photo_renditions(photo)
+    with transaction.atomic():
+        photo.save(update_fields=update_fields)
+        # Queue the followers' notifications; the fan-out runs in the
+        # notification worker
+        enqueue_upload_fanout(
+            photo,
+            title='New photo',
+            message=f'{photo.owner.username} uploaded "{photo.title}"',
+        )
+        # Copy the photo into followers' Following feeds once it is
+        # committed, outside any transaction the caller holds open
+        transaction.on_commit(lambda: timeline.fan_out_photo(photo))
+
+
+def store_and_publish(photo, upload):
+    """Store ``upload`` during the request and publish ``photo``."""
+    photo.image = direct_uploads.upload_file(
+        upload, direct_uploads.new_public_id(photo.owner),
+        image_format(upload))
+    publish(photo)
+
+
+def spool_path(name):
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, name)
+
+
+def spool(upload):
+    """Copy ``upload`` into the spool directory; returns the file name."""
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    name = f'{uuid.uuid4().hex}.{image_format(upload)}'
+    with open(spool_path(name), 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    return name
+
+
+def submit(photo, upload):
+    """Spool ``upload`` and save ``photo`` as processing."""
+    name = spool(upload)
+    photo.status = Photo.PROCESSING
+    try:
+        with transaction.atomic():
+            photo.save()
+            PhotoUpload.objects.create(
+                photo=photo, spool_name=name,
+                public_id=direct_uploads.new_public_id(photo.owner))
+    except Exception:
+        os.remove(spool_path(name))
+        raise
+
+
+def upload_status(photo):
+    """What the upload page shows while it polls."""
+    status = {'photo_id': photo.pk, 'status': photo.status}
+    if photo.status == Photo.FAILED:
+        job = PhotoUpload.objects.filter(photo=photo).first()
+        status['error'] = job.last_error if job else ''
+    return status
+
+
+def pending_count():
+    return PhotoUpload.objects.filter(photo__status=Photo.PROCESSING).count()
+
+
+def _claim(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            PhotoUpload.objects.filter(
+                photo__status=Photo.PROCESSING, available_at__lte=now)
+            .order_by('available_at', 'id')
+            .select_for_update(skip_locked=True)
+            .values_list('pk', flat=True)[:batch_size])
+        PhotoUpload.objects.filter(pk__in=ids).update(
+            available_at=now + timedelta(
+                seconds=settings.UPLOAD_PIPELINE_LEASE))
+    return list(PhotoUpload.objects.filter(pk__in=ids)
+                .select_related('photo__owner').order_by('id'))
+
+
+def _transfer(job):
+    """Store the spooled file; runs in a pool thread, without the DB."""
+    return direct_uploads.upload_file(
+        spool_path(job.spool_name), job.public_id,
+        os.path.splitext(job.spool_name)[1].lstrip('.'))
+
+
+def _finish(job, image):
+    photo = job.photo
+    photo.image = image
+    photo.status = Photo.READY
+    with transaction.atomic():
+        job.delete()
+        # Saving a status change skips the post_save publishing handler, so
+        # the photo is counted and indexed only once it is ready
+        publish(photo, update_fields=['image', 'status', 'renditions'])
+        photos_published(photo.owner_id, [photo])
+        transaction.on_commit(lambda: os.remove(spool_path(job.spool_name)))
+
+
+def _retry(job, exc, max_attempts):
+    job.attempts += 1
+    job.last_error = f'{type(exc).__name__}: {exc}'
+    if job.attempts >= max_attempts:
+        with transaction.atomic():
+            job.save(update_fields=['attempts', 'last_error'])
+            Photo.objects.filter(pk=job.photo_id).update(status=Photo.FAILED)
+        return False
+    delay = settings.UPLOAD_PIPELINE_RETRY_DELAY * 2 ** (job.attempts - 1)
+    job.available_at = timezone.now() + timedelta(seconds=delay)
+    job.save(update_fields=['attempts', 'last_error', 'available_at'])
+    return True
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE, workers=None,
+                  max_attempts=None):
+    """
+    Store and publish up to ``batch_size`` due uploads, transferring at most
+    ``workers`` files at a time.
+
+    Returns counts: ``claimed``, ``ready``, ``retried`` and ``failed``.
+    """
+    workers = workers or settings.UPLOAD_PIPELINE_WORKERS
+    max_attempts = max_attempts or settings.UPLOAD_PIPELINE_MAX_ATTEMPTS
+    result = dict.fromkeys(('claimed', 'ready', 'retried', 'failed'), 0)
+    jobs = _claim(batch_size)
+    if not jobs:
+        return result
+    result['claimed'] = len(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_transfer, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                _finish(job, future.result())
+            except Exception as exc:
+                if _retry(job, exc, max_attempts):
+                    result['retried'] += 1
+                else:
+                    result['failed'] += 1
+            else:
+                result['ready'] += 1
+    return result
@@ -3,8 +3,20 @@ from . import views
 
 urlpatterns = [
     path('', views.portfolio_home, name='portfolio_home'),
+    path('feed/', views.photo_feed, name='photo_feed'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
+    path('following/', views.following_feed, name='following_feed'),
     path('register/', views.register, name='register'),
     path('upload/', views.upload_photo, name='upload_photo'),
+    path('upload/ticket/', views.direct_upload_ticket,
+         name='direct_upload_ticket'),
+    path('upload/confirm/', views.direct_upload_confirm,
+         name='direct_upload_confirm'),
+    path('upload/local-storage/', views.direct_upload_local,
+         name='direct_upload_local'),
+    path('upload/<int:photo_id>/status/', views.upload_status,
+         name='upload_status'),
+    path('upload/bulk/', views.bulk_upload, name='bulk_upload'),
     path('photo/<int:photo_id>/', views.photo_detail, name='photo_detail'),
     path('photo/<int:photo_id>/delete/', views.delete_photo,
          name='delete_photo'),
@@ -12,6 +24,8 @@ urlpatterns = [
     path('profile/<str:username>/edit/', views.edit_profile_user,
          name='profile_edit_user'),
     path('profile/<str:username>/', views.profile, name='profile_view'),
+    path('profile/<str:username>/stats/', views.profile_stats,
+         name='profile_stats'),
 
     path('comment/<int:comment_id>/edit/', views.edit_comment,
          name='edit_comment'),
@@ -19,6 +33,7 @@ urlpatterns = [
          name='delete_comment'),
     path('photo/<int:photo_id>/like/', views.toggle_like,
          name='toggle_like'),
+    path('likes/state/', views.like_states, name='like_states'),
 
     # Follow URLs
     path('user/<str:username>/follow/', views.follow_user,
@@ -37,6 +52,8 @@ urlpatterns = [
          name='notifications_count'),
     path('notifications/dropdown/', views.notifications_dropdown,
          name='notifications_dropdown'),
+    path('notifications/stream/', views.notifications_stream,
+         name='notifications_stream'),
     path('notifications/<int:notification_id>/read/',
          views.notifications_mark_read, name='notifications_mark_read'),
     path('notifications/mark-all-read/', views.notifications_mark_all_read,
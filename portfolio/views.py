@@ -1,12 +1,35 @@
 
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse)
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.views.decorators.cache import cache_control
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import condition
 from .models import Profile, Photo, Comment, Notification, Follow
-from .forms import ProfileForm, PhotoForm, CommentForm
+from .forms import (
+    ProfileForm, PhotoForm, CommentForm, DirectUploadPhotoForm,
+    BulkUploadForm)
+from . import (
+    bulk_uploads, direct_uploads, events, follow_suggestions, follows, likes,
+    search, stats, suggest, timeline, uploads)
+from .notifications import (
+    backlog, dropdown_etag, latest_notification_id, mark_all_as_read,
+    serialize_notification, unread_count)
+from .outbox import enqueue_notification
+from .pagination import keyset_page
 
 
 @login_required
@@ -33,45 +56,117 @@ def portfolio_home(request):
     # Handle search functionality
     search_query = request.GET.get('q', '').strip()
     if search_query:
-        # Search for photos by title or description
-        photos = Photo.objects.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query),
-            is_public=True
-        ).order_by('-created_at')
-        # Also search for users
-        users = User.objects.filter(
-            Q(username__icontains=search_query) |
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query)
-        ).distinct()
-        # If only one photo matches, redirect to it
-        if photos.count() == 1 and users.count() == 0:
-            return redirect('photo_detail', pk=photos.first().id)
-
-        # If only one user matches, redirect to their profile
-        if users.count() == 1 and photos.count() == 0:
-            return redirect('profile_view', username=users.first().username)
+        # Ranked full-text search over photos and users
+        photos = search.search_photos(
+            search_query, page=request.GET.get('page', 1),
+            viewer=request.user)
+        users = search.search_users(search_query)
+        if photos.number == 1 and not photos.has_next():
+            # If only one photo matches, redirect to it
+            if len(photos) == 1 and not users:
+                return redirect('photo_detail',
+                                photo_id=photos.object_list[0].id)
+
+            # If only one user matches, redirect to their profile
+            if len(users) == 1 and not photos:
+                return redirect('profile_view', username=users[0].username)
     else:
-        # Default: show latest photos
-        photos = Photo.objects.filter(is_public=True).order_by(
-            '-created_at')[:6]
+        # Default: first page of the latest photos; later pages are
+        # fetched by cursor from photo_feed as the user scrolls
+        photos, next_cursor = keyset_page(
+            Photo.objects.filter(is_public=True).feed_for(request.user),
+            None, settings.FEED_PAGE_SIZE)
         users = User.objects.none()  # Empty queryset
-    # Add liked status for authenticated users
-    if request.user.is_authenticated:
-        for p in photos:
-            p.liked = p.likes.filter(user=request.user).exists()
-    else:
-        for p in photos:
-            p.liked = False
     context = {
         'photos': photos,
         'users': users,
         'search_query': search_query,
+        'next_cursor': None if search_query else next_cursor,
+        'suggestions': (
+            [] if search_query
+            else follow_suggestions.suggestions_for(request.user)),
     }
     return render(request, 'home.html', context)
 
 
+@login_required
+def search_suggest(request):
+    """Search-as-you-type suggestions served from the in-memory index"""
+    matches = suggest.service.suggest(request.GET.get('q', ''))
+    users = [{
+        'username': u['username'],
+        'display_name': u['display_name'] or u['username'],
+        'url': reverse('profile_view', args=[u['username']]),
+    } for u in matches[suggest.KIND_USER]]
+    photos = [{
+        'id': p['id'],
+        'title': p['title'],
+        'url': reverse('photo_detail', args=[p['id']]),
+    } for p in matches[suggest.KIND_PHOTO]]
+    return JsonResponse({'users': users, 'photos': photos})
+
+
+@login_required
+def following_feed(request):
+    """Photos from the accounts the current user follows"""
+    photos, next_cursor = timeline.following_feed(request.user)
+    return render(request, 'following_feed.html', {
+        'photos': photos,
+        'next_cursor': next_cursor,
+    })
+
+
+def photo_feed(request):
+    """
+    Next page of photo cards for infinite scroll.
+
+    Returns the rendered card fragment and the cursor for the following
+    page. ``?feed=following`` pages through the Following feed and
+    ``?owner=<username>`` through a profile grid; otherwise the public home
+    feed is used.
+    """
+    owner_username = request.GET.get('owner', '').strip()
+    owner = None
+    if request.GET.get('feed') == 'following':
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Login required'}, status=403)
+        photos, next_cursor = timeline.following_feed(
+            request.user, request.GET.get('cursor'))
+        html = render_to_string(
+            'partials/photo_cards_home.html', {'photos': photos},
+            request=request)
+        return JsonResponse({
+            'html': html,
+            'next_cursor': next_cursor,
+            'count': len(photos),
+        })
+    if owner_username:
+        owner = get_object_or_404(User, username=owner_username)
+        # Same visibility rule as the profile page itself
+        if (owner_username != "danielcarson"
+                and not request.user.is_authenticated):
+            return JsonResponse({'error': 'Login required'}, status=403)
+        queryset = Photo.objects.filter(owner=owner).feed_for(
+            request.user, recent_comments=5)
+        template_name = 'partials/photo_cards_profile.html'
+    else:
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Login required'}, status=403)
+        queryset = Photo.objects.filter(is_public=True).feed_for(
+            request.user)
+        template_name = 'partials/photo_cards_home.html'
+
+    photos, next_cursor = keyset_page(
+        queryset, request.GET.get('cursor'), settings.FEED_PAGE_SIZE)
+    html = render_to_string(
+        template_name, {'photos': photos, 'owner': owner}, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_cursor': next_cursor,
+        'count': len(photos),
+    })
+
+
 def register(request):
     # Redirect logged-in users to home
     if request.user.is_authenticated:
@@ -123,12 +218,13 @@ def upload_photo(request):
             try:
                 photo = form.save(commit=False)
                 photo.owner = request.user
-                photo.save()
-
-                # Optional: Create notification for followers
-                # (if follow system exists)
-                # For now, this is a placeholder for future enhancement
-                # create_notification_for_followers(request.user, photo)
+                image = form.cleaned_data['image']
+                if settings.UPLOAD_PIPELINE:
+                    # Spool the file and return; process_uploads stores it
+                    uploads.submit(photo, image)
+                    return redirect(
+                        f"{reverse('upload_photo')}?processing={photo.pk}")
+                uploads.store_and_publish(photo, image)
 
                 return redirect('home')
             except Exception as e:
@@ -142,7 +238,125 @@ def upload_photo(request):
     else:
         form = PhotoForm()
 
-    return render(request, 'upload_photo.html', {'form': form})
+    processing = None
+    if request.GET.get('processing', '').isdigit():
+        processing = Photo.objects.filter(
+            pk=request.GET['processing'], owner=request.user).first()
+    return render(request, 'upload_photo.html', {
+        'form': form,
+        'processing': processing,
+    })
+
+
+@csrf_exempt
+@login_required
+def bulk_upload(request):
+    """Upload many images, or zip archives of them, in one request"""
+    # Stream every file to a temporary file: the default handlers keep
+    # files under 2.5MB in memory, which adds up over a 200-file upload.
+    # Handlers must be replaced before the body is read, so CSRF is
+    # checked by the inner view instead of the middleware.
+    request.upload_handlers = [TemporaryFileUploadHandler(request)]
+    return _bulk_upload(request)
+
+
+@csrf_protect
+def _bulk_upload(request):
+    results = None
+    if request.method == 'POST':
+        form = BulkUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            results = bulk_uploads.bulk_upload(
+                request.user, form.cleaned_data['files'],
+                is_public=form.cleaned_data['is_public'])
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'success': True, 'results': results})
+    else:
+        form = BulkUploadForm()
+    created = sum(1 for r in results or []
+                  if r['status'] == bulk_uploads.CREATED)
+    return render(request, 'bulk_upload.html', {
+        'form': form,
+        'results': results,
+        'created': created,
+    })
+
+
+@login_required
+def upload_status(request, photo_id):
+    """Processing state of one of your uploads, polled by the upload page"""
+    photo = get_object_or_404(Photo, pk=photo_id, owner=request.user)
+    status = uploads.upload_status(photo)
+    if photo.status == Photo.READY:
+        status['url'] = reverse('photo_detail', args=[photo.pk])
+    return JsonResponse(status)
+
+
+@login_required
+def direct_upload_ticket(request):
+    """Signed ticket for posting one image straight to storage"""
+    if request.method != 'POST':
+        return JsonResponse(
+            {'success': False, 'error': 'Invalid request method'}, status=405)
+    return JsonResponse(direct_uploads.upload_ticket(request.user))
+
+
+@login_required
+def direct_upload_confirm(request):
+    """Create the Photo for an image the browser uploaded with a ticket
+
+    Expects the storage response (``public_id``, ``version``,
+    ``signature``, ``format``) plus the photo form fields.
+    """
+    if request.method != 'POST':
+        return JsonResponse(
+            {'success': False, 'error': 'Invalid request method'}, status=405)
+    image = direct_uploads.confirmed_image(request.user, request.POST)
+    if image is None:
+        return JsonResponse(
+            {'success': False, 'error': 'Upload could not be verified'},
+            status=403)
+
+    with transaction.atomic():
+        # One confirm at a time per user, so a repeated confirm of the same
+        # upload (whatever format it posts) returns the photo it created
+        User.objects.select_for_update().get(pk=request.user.pk)
+        photo = Photo.objects.filter(
+            direct_uploads.same_upload(image), owner=request.user).first()
+        if photo is None:
+            form = DirectUploadPhotoForm(request.POST)
+            if not form.is_valid():
+                return JsonResponse(
+                    {'success': False, 'errors': form.errors}, status=400)
+            photo = form.save(commit=False)
+            photo.owner = request.user
+            photo.image = image
+            uploads.publish(photo)
+    return JsonResponse({
+        'success': True,
+        'photo_id': photo.pk,
+        'redirect_url': reverse('home'),
+    })
+
+
+@csrf_exempt
+def direct_upload_local(request):
+    """Offline stand-in for the storage upload API
+
+    Authenticated by the ticket signature rather than the session, like
+    the real endpoint. Only served with the ``'local'`` backend, so it can
+    never bypass Cloudinary's signed incoming transformation.
+    """
+    if settings.DIRECT_UPLOAD_BACKEND != 'local':
+        raise Http404
+    if request.method != 'POST':
+        return JsonResponse({'error': {'message': 'Invalid request method'}},
+                            status=405)
+    response, error = direct_uploads.store_local_upload(
+        request.POST, request.FILES.get('file'))
+    if error:
+        return JsonResponse({'error': {'message': error}}, status=400)
+    return JsonResponse(response)
 
 
 def profile(request, username):
@@ -154,29 +368,21 @@ def profile(request, username):
         return redirect("login")
     
     profile, created = Profile.objects.get_or_create(user=user)
-    photos = Photo.objects.filter(owner=user).order_by('-created_at')
-
-    if request.user.is_authenticated:
-        for p in photos:
-            p.liked = p.likes.filter(user=request.user).exists()
-    else:
-        for p in photos:
-            p.liked = False
-    # compute simple stats
-    photos_count = photos.count()
-    total_likes = sum(p.likes.count() for p in photos)
-    total_comments = sum(p.comments.count() for p in photos)
-    followers_count = (
-        user.followers.count() if hasattr(user, 'followers') else 0
-    )
-    following_count = (
-        user.following.count() if hasattr(user, 'following') else 0
-    )
+    photos, next_cursor = keyset_page(
+        Photo.objects.filter(owner=user).feed_for(
+            request.user, recent_comments=5),
+        None, settings.FEED_PAGE_SIZE)
+    # header stats come from the materialized ProfileStats row
+    user_stats = stats.stats_for(user)
     joined = user.date_joined
     is_following = False
     if request.user.is_authenticated and request.user != user:
-        is_following = user.followers.filter(follower=request.user).exists()
+        is_following = follows.is_following(request.user.pk, user.pk)
     initials = user.username[:2].upper()
+    # "Who to follow" is shown only on your own profile
+    suggestions = []
+    if request.user == user:
+        suggestions = follow_suggestions.suggestions_for(user)
 
     # Debug: print website value to server log
     if profile:
@@ -191,20 +397,60 @@ def profile(request, username):
         'owner': user,
         'profile': profile,
         'photos': photos,
-        'photos_count': photos_count,
-        'total_likes': total_likes,
-        'total_comments': total_comments,
-        'followers_count': followers_count,
-        'following_count': following_count,
+        'next_cursor': next_cursor,
+        'photos_count': user_stats.photos_count,
+        'total_likes': user_stats.likes_received,
+        'total_comments': user_stats.comments_received,
+        'followers_count': user_stats.followers_count,
+        'following_count': user_stats.following_count,
         'joined': joined,
         'is_following': is_following,
         'initials': initials,
+        'suggestions': suggestions,
     })
 
 
+def profile_stats(request, username):
+    """JSON stats for the profile sidebar, from one primary-key lookup"""
+    user = get_object_or_404(User, username=username)
+    if username != "danielcarson" and not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=403)
+    return JsonResponse({
+        'username': user.username,
+        'stats': stats.stats_for(user).as_dict(),
+    })
+
+
+def _notify_comment(author, photo, comment):
+    """Queue the photo owner's notification; call inside the save's atomic"""
+    if photo.owner == author:
+        return
+    comment_preview = (
+        comment.text[:50] + "..." if len(comment.text) > 50
+        else comment.text
+    )
+    message_text = f'{author.username} commented: "{comment_preview}"'
+    enqueue_notification(
+        f'comment:{comment.pk}',
+        recipient=photo.owner,
+        sender=author,
+        notification_type='comment',
+        title='New comment on your photo',
+        message=message_text,
+        photo=photo,
+        comment=comment
+    )
+
+
 @login_required
 def photo_detail(request, photo_id):
     photo = get_object_or_404(Photo, id=photo_id)
+    if photo.status != Photo.READY:
+        # Nothing to show until the upload pipeline has stored the image
+        if photo.owner_id == request.user.pk:
+            return redirect(
+                f"{reverse('upload_photo')}?processing={photo.pk}")
+        raise Http404('Photo is not available yet')
     comments = photo.comments.order_by('created_at')
     liked = False
     if request.user.is_authenticated:
@@ -216,51 +462,10 @@ def photo_detail(request, photo_id):
                 comment = form.save(commit=False)
                 comment.photo = photo
                 comment.author = request.user
-                comment.save()
-                # Create notification for photo owner
-                if photo.owner != request.user:
-                    comment_preview = (
-                        comment.text[:50] + "..." if len(comment.text) > 50
-                        else comment.text
-                    )
-                    message_text = (
-                        f'{request.user.username} commented: '
-                        f'"{comment_preview}"'
-                    )
-                    # PEP8: break long line
-                    message_text = (
-                        f'{request.user.username} commented: '  # noqa: E501
-                        f'"{comment_preview}"'
-                    )
-                    # PEP8: break long line
-                    message_text = (
-                        f'{request.user.username} commented: '  # noqa: E501
-                        f'"{comment_preview}"'
-                    )
-                    # PEP8: break long line
-                    message_text = (
-                        f'{request.user.username} commented: '
-                        f'"{comment_preview}"'
-                    )
-                    # PEP8: break long line
-                    message_text = (
-                        f'{request.user.username} commented: '
-                        f'"{comment_preview}"'
-                    )
-                    # PEP8: break long line
-                    message_text = (
-                        f'{request.user.username} commented: '
-                        f'"{comment_preview}"'
-                    )
-                    create_notification(
-                        recipient=photo.owner,
-                        sender=request.user,
-                        notification_type='comment',
-                        title='New comment on your photo',
-                        message=message_text,
-                        photo=photo,
-                        comment=comment
-                    )
+                with transaction.atomic():
+                    comment.save()
+                    # Queue notification for photo owner
+                    _notify_comment(request.user, photo, comment)
                 return JsonResponse({
                     'success': True,
                     'comment': {
@@ -281,25 +486,9 @@ def photo_detail(request, photo_id):
                 comment = form.save(commit=False)
                 comment.photo = photo
                 comment.author = request.user
-                comment.save()
-                if photo.owner != request.user:
-                    comment_preview = (
-                        comment.text[:50] + "..." if len(comment.text) > 50
-                        else comment.text
-                    )
-                    message_text = (
-                        f'{request.user.username} commented: '
-                        f'"{comment_preview}"'
-                    )
-                    create_notification(
-                        recipient=photo.owner,
-                        sender=request.user,
-                        notification_type='comment',
-                        title='New comment on your photo',
-                        message=message_text,
-                        photo=photo,
-                        comment=comment
-                    )
+                with transaction.atomic():
+                    comment.save()
+                    _notify_comment(request.user, photo, comment)
                 return redirect('photo_detail', photo_id=photo.id)
     else:
         form = CommentForm()
@@ -360,7 +549,8 @@ def delete_comment(request, comment_id):
     if request.method == 'POST':
         # Delete the comment and redirect
         photo_id = comment.photo.id
-        comment.delete()
+        with transaction.atomic():
+            comment.delete()
         return redirect('photo_detail', photo_id=photo_id)
     # If GET, show confirmation template
     return render(request, 'confirm_delete_comment.html', {
@@ -394,28 +584,56 @@ def delete_photo(request, photo_id):
 
 @login_required
 def toggle_like(request, photo_id):
-    photo = get_object_or_404(Photo, id=photo_id)
-    like = photo.likes.filter(user=request.user).first()
-    if like:
-        like.delete()
-        liked = False
-    else:
-        photo.likes.create(user=request.user)
-        liked = True
-
-        # Create notification for photo owner when liked (not unliked)
-        like_message = (f'{request.user.username} liked your photo '
-                        f'"{photo.title}"')
-        create_notification(
-            recipient=photo.owner,
-            sender=request.user,
-            notification_type='like',
-            title='Someone liked your photo',
-            message=like_message,
-            photo=photo
-        )
+    photo = get_object_or_404(
+        Photo.objects.select_related('owner').only(
+            'id', 'title', 'owner__id', 'owner__username'),
+        id=photo_id)
+    with transaction.atomic():
+        # Conditional delete, then insert-or-ignore: safe under double-clicks
+        liked, like = likes.toggle(photo, request.user)
+        if like is not None:
+            # Queue notification for photo owner when liked (not unliked)
+            like_message = (f'{request.user.username} liked your photo '
+                            f'"{photo.title}"')
+            enqueue_notification(
+                f'like:{like.pk}',
+                recipient=photo.owner,
+                sender=request.user,
+                notification_type='like',
+                title='Someone liked your photo',
+                message=like_message,
+                photo=photo
+            )
+
+    # Read the stored counter rather than counting the likes table
+    return JsonResponse({'liked': liked,
+                         'likes_count': likes.like_count(photo.pk)})
+
 
-    return JsonResponse({'liked': liked, 'likes_count': photo.likes.count()})
+@login_required
+def like_states(request):
+    """Like state and counts for a batch of photos, in one query
+
+    Expects a JSON body ``{"photo_ids": [...]}`` (at most
+    ``likes.MAX_STATE_IDS``); used to hydrate cards in bulk.
+    """
+    if request.method != 'POST':
+        return JsonResponse(
+            {'success': False, 'error': 'Invalid request method'}, status=405)
+    try:
+        photo_ids = [int(pk) for pk in json.loads(request.body)['photo_ids']]
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse(
+            {'success': False, 'error': 'Expected {"photo_ids": [...]}'},
+            status=400)
+    if len(photo_ids) > likes.MAX_STATE_IDS:
+        return JsonResponse(
+            {'success': False,
+             'error': f'At most {likes.MAX_STATE_IDS} photo ids per request'},
+            status=400)
+    states = likes.like_states(request.user, photo_ids)
+    return JsonResponse(
+        {'likes': {str(pk): state for pk, state in states.items()}})
 
 
 @login_required
@@ -427,28 +645,6 @@ def accounts_profile_redirect(request):
 # ===== NOTIFICATION SYSTEM =====
 
 
-def create_notification(recipient, sender, notification_type, title, message,
-                        photo=None, comment=None):
-    """
-    Utility function to create notifications
-    """
-    # Don't create notification if sender is same as recipient
-    if sender == recipient:
-        return None
-
-    # Create the notification
-    notification = Notification.objects.create(
-        recipient=recipient,
-        sender=sender,
-        notification_type=notification_type,
-        title=title,
-        message=message,
-        photo=photo,
-        comment=comment
-    )
-    return notification
-
-
 @login_required
 def notifications_list(request):
     """Display all notifications for the current user"""
@@ -458,11 +654,9 @@ def notifications_list(request):
         notifications = request.user.notifications.all()[:20]
     else:
         notifications = request.user.notifications.filter(is_read=False)[:20]
-    unread_count = request.user.notifications.filter(is_read=False).count()
-
     context = {
         'notifications': notifications,
-        'unread_count': unread_count,
+        'unread_count': unread_count(request.user.pk),
         'show': show
     }
     return render(request, 'notifications/list.html', context)
@@ -471,7 +665,7 @@ def notifications_list(request):
 @login_required
 def notifications_unread_count(request):
     """AJAX endpoint to get unread notification count"""
-    count = request.user.notifications.filter(is_read=False).count()
+    count = unread_count(request.user.pk)
     return JsonResponse({'unread_count': count})
 
 
@@ -494,40 +688,103 @@ def notifications_mark_read(request, notification_id):
 def notifications_mark_all_read(request):
     """AJAX endpoint to mark all notifications as read"""
     if request.method == 'POST':
-        request.user.notifications.filter(is_read=False).update(is_read=True)
+        mark_all_as_read(request.user.pk)
         return JsonResponse({'success': True})
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
 
+def _dropdown_etag(request):
+    return dropdown_etag(request.user.pk)
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_dropdown_etag)
 def notifications_dropdown(request):
-    """AJAX endpoint to get recent notifications for dropdown"""
-    # Show up to 5 unread notifications only
+    """AJAX endpoint to get recent notifications for dropdown
+
+    Conditional: the browser revalidates its copy with If-None-Match and
+    gets a 304, costing two cache reads, until a notification is added,
+    rewritten or read.
+    """
+    # Show up to 5 unread notifications only, with everything
+    # serialize_notification reads joined in
     notifications = list(
         request.user.notifications.filter(is_read=False)
+        .select_related('sender', 'photo')
+        .only('id', 'recipient_id', 'title', 'message', 'is_read',
+              'created_at', 'notification_type', 'actor_count',
+              'recent_actors', 'sender__username', 'photo__id')
         .order_by('-created_at')[:5]
     )
-    notifications_data = []
-    for notification in notifications:
-        notifications_data.append({
-            'id': notification.id,
-            'title': notification.title,
-            'message': notification.message,
-            'is_read': notification.is_read,
-            'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M'),
-            'url': notification.get_url(),
-            'sender_username': (
-                notification.sender.username if notification.sender else None
-            ),
-            'type': notification.notification_type
-        })
-    unread_count = request.user.notifications.filter(is_read=False).count()
+    notifications_data = [serialize_notification(n) for n in notifications]
     return JsonResponse({
         'notifications': notifications_data,
-        'unread_count': unread_count
+        'unread_count': unread_count(request.user.pk)
     })
 
 
+async def notifications_stream(request):
+    """
+    Server-sent events stream of new notifications and unread counts.
+
+    Served by the ASGI application. Sends the unread count on connect,
+    replays notifications newer than the ``Last-Event-ID`` the browser
+    reconnects with, then forwards broker events with a heartbeat comment
+    while idle. Streams end after ``NOTIFICATION_STREAM_MAX_AGE`` seconds;
+    EventSource reconnects and resumes from its last event id.
+
+    A WSGI server (runserver included) would buffer the whole stream
+    before sending any of it, so there the view answers 204, which makes
+    EventSource stop and the page poll instead.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=403)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    response = StreamingHttpResponse(
+        _notification_events(user.pk, last_event_id),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _notification_events(user_id, last_event_id):
+    if last_event_id is None:
+        last_event_id = await sync_to_async(latest_notification_id)(user_id)
+    # Subscribe before reading the backlog so nothing published in between
+    # is lost; anything seen twice is dropped by id below
+    subscription = events.get_broker().subscribe(user_id, last_event_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.NOTIFICATION_STREAM_MAX_AGE
+    sent_id = last_event_id
+    try:
+        yield f'retry: {settings.NOTIFICATION_STREAM_RETRY_MS}\n\n'
+        for event in await sync_to_async(backlog)(user_id, last_event_id):
+            sent_id = max(sent_id, event.id or 0)
+            yield events.format_event(event)
+        while (remaining := deadline - loop.time()) > 0:
+            event = await subscription.next(
+                min(settings.NOTIFICATION_STREAM_HEARTBEAT, remaining))
+            if event is None:
+                yield ': heartbeat\n\n'
+                continue
+            if event.id is not None:
+                if event.id <= sent_id:
+                    continue
+                sent_id = event.id
+            yield events.format_event(event)
+    finally:
+        subscription.close()
+
+
 @login_required
 def follow_user(request, username):
     """Follow a user"""
@@ -540,23 +797,29 @@ def follow_user(request, username):
                 'error': 'Cannot follow yourself'
             })
         # Create or get the follow relationship
-        follow, created = Follow.objects.get_or_create(
-            follower=request.user,
-            following=user_to_follow
-        )
-        if created:
-            # Create notification for the followed user
-            create_notification(
-                recipient=user_to_follow,
-                sender=request.user,
-                notification_type='follow',
-                title='New Follower',
-                message=f'{request.user.username} started following you!'
+        with transaction.atomic():
+            follow, created = Follow.objects.get_or_create(
+                follower=request.user,
+                following=user_to_follow
             )
+            if created:
+                # Queue notification for the followed user
+                enqueue_notification(
+                    f'follow:{follow.pk}',
+                    recipient=user_to_follow,
+                    sender=request.user,
+                    notification_type='follow',
+                    title='New Follower',
+                    message=f'{request.user.username} started following you!'
+                )
+        if created:
+            followers_count = user_to_follow.followers.count()
+            timeline.update_fanout_mode(user_to_follow, followers_count)
+            timeline.backfill_follow(request.user, user_to_follow)
             return JsonResponse({
                 'success': True,
                 'action': 'followed',
-                'followers_count': user_to_follow.followers.count()
+                'followers_count': followers_count
             })
         else:
             return JsonResponse({
@@ -578,6 +841,7 @@ def unfollow_user(request, username):
                 following=user_to_unfollow
             )
             follow.delete()
+            timeline.remove_follow(request.user, user_to_unfollow)
             return JsonResponse({
                 'success': True,
                 'action': 'unfollowed',
@@ -595,10 +859,12 @@ def unfollow_user(request, username):
 def followers_list(request, username):
     """Display a user's followers"""
     user = get_object_or_404(User, username=username)
-    followers = user.followers.select_related('follower__profile').all()
+    followers, next_cursor = follows.followers_page(
+        user, request.user, request.GET.get('cursor'))
     return render(request, 'followers_list.html', {
         'user': user,
         'followers': followers,
+        'next_cursor': next_cursor,
         'title': f"{user.username}'s Followers"
     })
 
@@ -607,9 +873,11 @@ def followers_list(request, username):
 def following_list(request, username):
     """Display users that this user is following"""
     user = get_object_or_404(User, username=username)
-    following = user.following.select_related('following__profile').all()
+    following, next_cursor = follows.following_page(
+        user, request.user, request.GET.get('cursor'))
     return render(request, 'following_list.html', {
         'user': user,
         'following': following,
+        'next_cursor': next_cursor,
         'title': f"Users {user.username} is Following"
     })
@@ -2,6 +2,8 @@
 ASGI config for shutterspace project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serving through ASGI (gunicorn with uvicorn workers, see the Procfile) lets
+the notification stream hold connections open without tying up a worker.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -168,6 +168,41 @@ if 'DATABASE_URL' in os.environ:
 if 'test' in sys.argv:
     DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
 
+# Cache: per-process local memory by default. Multi-worker deployments
+# should share one cache (CACHE_BACKEND=redis with REDIS_URL, or
+# CACHE_BACKEND=file with CACHE_DIR) so invalidation reaches every worker.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get(
+                'CACHE_DIR', os.path.join(BASE_DIR, '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'shutterspace',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+# Lifetime of cache entries kept exact by invalidating them on every write
+# (unread counts, photo cards, followed-id sets). That only reaches every
+# process through a shared cache; with per-process locmem (e.g. several
+# gunicorn workers) another worker's copy is stale until it expires, so
+# entries expire after a minute there.
+INVALIDATED_CACHE_TIMEOUT = (
+    60 * 60 * 24 if CACHE_BACKEND in ('redis', 'file') else 60)
+
 CSRF_TRUSTED_ORIGINS = [
     "https://*.codeinstitute-ide.net/",
     "https://*.herokuapp.com"
@@ -240,6 +275,127 @@ LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/accounts/profile/'
 LOGOUT_REDIRECT_URL = '/'
 
+# Photo cards per infinite-scroll page on the home and profile grids
+FEED_PAGE_SIZE = 12
+
+# Following feed: accounts above this many followers are merged into
+# timelines on read instead of fanned out on upload
+TIMELINE_FANOUT_MAX_FOLLOWERS = 5000
+TIMELINE_FANOUT_BATCH_SIZE = 1000
+# Recent photos copied into a follower's timeline when they follow someone
+TIMELINE_BACKFILL_LIMIT = 100
+
+# Accounts per page on follower/following lists; cached followed-id sets
+# are dropped on every follow change (see INVALIDATED_CACHE_TIMEOUT)
+FOLLOW_LIST_PAGE_SIZE = 50
+FOLLOWING_CACHE_TIMEOUT = INVALIDATED_CACHE_TIMEOUT
+
+# "Who to follow": suggestions stored per user by compute_follow_suggestions,
+# weight of one shared like relative to one mutual follow, and photos with
+# more likers than this are ignored when counting shared likes
+FOLLOW_SUGGESTION_COUNT = 10
+FOLLOW_SUGGESTION_LIKE_WEIGHT = 0.5
+FOLLOW_SUGGESTION_MAX_LIKERS = 500
+
+# Search: results per page on the home search and number of matching users
+SEARCH_RESULTS_PER_PAGE = 12
+SEARCH_USER_RESULTS = 6
+
+# Search-as-you-type: per-process prefix index size cap (index keys),
+# suggestions per kind, and how long change records stay replayable
+SUGGEST_MAX_ENTRIES = 200000
+SUGGEST_RESULTS = 5
+SUGGEST_MIN_LENGTH = 1
+SUGGEST_CHANGE_TTL = 3600
+
+# Live notification stream (server-sent events, needs the ASGI app).
+# NOTIFICATION_BROKER is 'local' (in-process, single worker), 'database'
+# (polls the notifications table; works across workers) or a dotted path.
+NOTIFICATION_BROKER = os.environ.get('NOTIFICATION_BROKER', 'local')
+NOTIFICATION_POLL_INTERVAL = 2
+NOTIFICATION_STREAM_HEARTBEAT = 15
+NOTIFICATION_STREAM_MAX_AGE = 300
+NOTIFICATION_STREAM_RETRY_MS = 5000
+# Cached unread counts are adjusted on every write, which keeps them exact
+# with a shared cache (see INVALIDATED_CACHE_TIMEOUT)
+UNREAD_COUNT_CACHE_TIMEOUT = INVALIDATED_CACHE_TIMEOUT
+# Likes/comments on a photo within this many seconds share one notification
+NOTIFICATION_COALESCE_WINDOW = 60 * 60
+# With NOTIFICATION_OUTBOX=1 notifications are written to an outbox in the
+# request's transaction and delivered by ``manage.py
+# run_notification_worker``; otherwise they are delivered inline. The
+# worker is a separate process, so the outbox needs a shared cache and the
+# database broker for counts and streams to see its writes; it is on by
+# default only when both are configured.
+NOTIFICATION_OUTBOX = os.environ.get(
+    'NOTIFICATION_OUTBOX',
+    '1' if CACHE_BACKEND != 'locmem' and NOTIFICATION_BROKER != 'local'
+    else '0',
+) == '1'
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 5
+# Seconds before the first retry; doubles with every further attempt
+NOTIFICATION_OUTBOX_RETRY_DELAY = 30
+# New-photo notifications to followers are written this many per
+# transaction; a worker holds a fan-out for NOTIFICATION_FANOUT_LEASE seconds
+# past its last chunk before another worker may resume it
+NOTIFICATION_FANOUT_BATCH_SIZE = 1000
+NOTIFICATION_FANOUT_LEASE = 300
+# Upload fan-outs are always queued in the outbox. Without the outbox
+# (no worker sharing the cache and broker) the web process drains them on a
+# background thread after the upload commits, off the request path, and
+# run_notification_worker leaves them alone
+NOTIFICATION_FANOUT_THREAD = os.environ.get(
+    'NOTIFICATION_FANOUT_THREAD',
+    '1' if not NOTIFICATION_OUTBOX and 'test' not in sys.argv else '0',
+) == '1'
+# Days notifications are kept by ``manage.py prune_notifications``, for read
+# and unread ones separately (None keeps them). Per-type entries override
+# 'default' key by key.
+NOTIFICATION_RETENTION = {
+    'default': {'read': 90, 'unread': 365},
+    'photo_upload': {'read': 30},
+}
+
+# Direct uploads: the browser posts images straight to storage with a
+# signed ticket. 'cloudinary' needs CLOUDINARY_URL; 'local' is an offline
+# stand-in endpoint in this app that stores files in MEDIA_ROOT.
+DIRECT_UPLOAD_BACKEND = os.environ.get(
+    'DIRECT_UPLOAD_BACKEND',
+    'cloudinary' if os.environ.get('CLOUDINARY_URL')
+    and 'test' not in sys.argv else 'local',
+)
+DIRECT_UPLOAD_FOLDER = 'photos'
+# Folder of profile avatars moved to storage by ``create_profiles``
+DIRECT_UPLOAD_AVATAR_FOLDER = 'avatars'
+# Seconds a ticket stays valid
+DIRECT_UPLOAD_TICKET_TTL = 60 * 30
+# Largest image accepted by the upload form and the local stand-in
+UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+# Upload pipeline: with UPLOAD_PIPELINE=1 the upload form spools the image
+# to UPLOAD_SPOOL_DIR and returns at once; ``manage.py process_uploads``
+# stores it and publishes the photo. The worker reads the spooled files, so
+# it must run on the same machine or share the directory; the pipeline is on
+# by default only when UPLOAD_SPOOL_DIR is configured.
+UPLOAD_SPOOL_DIR = os.environ.get(
+    'UPLOAD_SPOOL_DIR', os.path.join(BASE_DIR, 'upload_spool'))
+UPLOAD_PIPELINE = os.environ.get(
+    'UPLOAD_PIPELINE', '1' if 'UPLOAD_SPOOL_DIR' in os.environ else '0',
+) == '1'
+UPLOAD_PIPELINE_WORKERS = 4
+UPLOAD_PIPELINE_MAX_ATTEMPTS = 5
+# Seconds before the first retry (doubling after that), and how long a
+# worker holds claimed uploads before another worker may take them over
+UPLOAD_PIPELINE_RETRY_DELAY = 30
+UPLOAD_PIPELINE_LEASE = 600
+# Bulk uploads: files (including archive members) per request, and how many
+# are sent to storage at the same time
+BULK_UPLOAD_MAX_FILES = 200
+BULK_UPLOAD_WORKERS = 8
+
+# Photo card fragment cache lifetime (seconds); versions make it exact with
+# a shared cache (see INVALIDATED_CACHE_TIMEOUT)
+PHOTO_CARD_CACHE_TIMEOUT = INVALIDATED_CACHE_TIMEOUT
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 